@@ -3,8 +3,8 @@ import sound
 import pygame
 import math
 import random
-import copy
 import os
+import time
 
 import constants
 import events
@@ -15,6 +15,12 @@ import geometry
 import ball
 import levels
 import editor
+from simulation import timestep
+from simulation import physics
+from simulation import predict
+from simulation import prefetch
+from simulation import replay
+from simulation import session
 
 
 def screen_update(fps):
@@ -85,6 +91,16 @@ def render_level_number(number):
     return graphics.textify(str(number))
 
 
+def render_blocks(level):
+    """Returns a new surface with the level's blocks, start and end drawn
+    on it.  Called on the prefetcher's worker thread too, so it only draws
+    on the surface it makes, and never converts it for the display."""
+    surface = graphics.new_surface(constants.SCREEN_SIZE)
+    level.draw_debug_layer(surface, levels.LAYER_BLOCKS, (0, 0))
+    level.draw_debug_start_end(surface, (0, 0))
+    return surface
+
+
 class MenuScreen:
     PAUSE_LENGTH = 60
     GROW_LENGTH = 120
@@ -236,7 +252,7 @@ class MenuScreen:
         self.mouse_level = -1
         self.previous_frame_mouse_level = -1
         self.mouse_arrow = 0
-        self.block_layers = levels.load_all_block_layers()
+        self.thumbnails = levels.Thumbnails(levels.level_repository)
 
         self.grow_frame = 0
         self.grow_course = False
@@ -434,7 +450,6 @@ class MenuScreen:
 
             elif self.editor_button == self.DELETE:
                 levels.delete_level(self.selected_level)
-                del self.block_layers[self.selected_level]
                 if self.selected_level == self.last_editor_level - 1:
                     self.selected_level = -1
 
@@ -443,7 +458,6 @@ class MenuScreen:
 
             elif self.editor_button == self.ADD:
                 levels.make_new_level(self.last_editor_level)
-                self.block_layers.append(levels.Layer())
                 self.last_editor_level += 1
                 self.update_add_level()
 
@@ -451,9 +465,6 @@ class MenuScreen:
                 if self.selected_level > LAST_LEVEL + 1:
                     level = self.selected_level
                     levels.swap_levels(level, level - 1)
-                    temp = self.block_layers[level]
-                    self.block_layers[level] = self.block_layers[level - 1]
-                    self.block_layers[level - 1] = temp
 
                     self.selected_level -= 1
 
@@ -461,9 +472,6 @@ class MenuScreen:
                 if self.selected_level < self.last_editor_level - 1:
                     level = self.selected_level
                     levels.swap_levels(level, level + 1)
-                    temp = self.block_layers[level]
-                    self.block_layers[level] = self.block_layers[level + 1]
-                    self.block_layers[level + 1] = temp
 
                     self.selected_level += 1
 
@@ -627,17 +635,20 @@ class MenuScreen:
             level = -1
             thumbnail_disabled = True
 
-        is_valid_level = level != -1 and level < len(self.block_layers)
+        # thumbnails are only loaded for the levels on this page
+        self.thumbnails.load(range(min(last_level, self.last_editor_level)))
+
+        is_valid_level = level != -1 and level < self.last_editor_level
         if is_valid_level and not thumbnail_disabled:
             # position = constants.FULL_MIDDLE_INT
             # pygame.draw.circle(surface, constants.BLACK, position, 60)
 
-            layer = self.block_layers[level]
+            thumbnail = self.thumbnails.surface(level, constants.BLACK, 3)
             x = constants.FULL_MIDDLE[0] + x_offset
             y = constants.FULL_MIDDLE[1] + y_offset
             x -= levels.WIDTH * 3 / 2
             y -= levels.HEIGHT * 3 / 2
-            layer.draw_thumbnail(surface, (x, y), constants.BLACK, 3)
+            surface.blit(thumbnail, (x, y))
 
         if self.show_credits:
             x = SCREEN_LEFT + game_title_x + x_offset
@@ -713,13 +724,15 @@ class MenuScreen:
             y += 3
         surface.blit(self.ADD_TEXT, (x, y))
 
-        is_valid_level = 0 <= selected_level < len(self.block_layers)
+        self.thumbnails.load(range(LAST_LEVEL + 1, self.last_editor_level))
+
+        is_valid_level = 0 <= selected_level < self.last_editor_level
         if is_valid_level and not thumbnail_disabled:
-            layer = self.block_layers[selected_level]
+            thumbnail = self.thumbnails.surface(selected_level,
+                                                constants.WHITE, 3)
             x = self.EDITOR_THUMBNAIL_X + x_offset
             y = self.EDITOR_THUMBNAIL_Y + y_offset
-
-            layer.draw_thumbnail(surface, (x, y), constants.WHITE, 3)
+            surface.blit(thumbnail, (x, y))
 
             for text_num, text in enumerate(self.EDITOR_TEXTS):
                 x = self.EDITOR_TEXTS_X[text_num] + x_offset
@@ -917,20 +930,16 @@ class MenuScreen:
         return 0
 
 
-class PlayScreen:
-    SLOWMO_MAX = 8.0  # the largest factor of slowmo possible
-    SPEEDUP_FACTOR = 0.05  # how much the slowmo effect "wears off" each frame
-
+class PlayScreen(session.Session):
+    """Playing a level.  Everything that changes the physics is in
+    simulation.session; this adds drawing, sounds and ripples on top."""
     AIMER_LAYERS = 4
+    PATH_SPACING = 4  # frames between the dots of predicted paths
 
     RESTART_DELAY = 90
 
     def __init__(self):
-        self.level = None
-        self.slowmo_factor = 1.0  # the coefficient of time-slow.
-        self.balls = []
-        self.players = []
-        self.start_ball = None
+        super().__init__()
         self.level_num = 0
 
         # make sure you DONT DRAW THE RED BUTTONS ON BLOCK_SURFACE
@@ -939,10 +948,6 @@ class PlayScreen:
         self.start_position = constants.SCREEN_MIDDLE
         self.end_open = False
 
-        self.pause_exit = False
-        self.transition = False
-        self.end_ball = None
-
         self.unlocked = True
 
         restart_text = graphics.textify("Press R to restart.")
@@ -960,68 +965,41 @@ class PlayScreen:
 
         self.in_editor = False
 
-    def update(self):
+        # how many physics steps to run each frame, see simulation.timestep
+        self.fixed_step = timestep.FixedStep()
+
+        self.predictor = predict.Predictor()
+        self.predicted_paths = []  # from predictor.update(), while aiming
+
+        # loads the level after this one while this one is played
+        self.prefetcher = prefetch.Prefetcher(levels.level_repository,
+                                              ball.Ball, render_blocks)
+
+    def update(self, steps=1):
+        """Handles this frame's input, then runs steps physics steps."""
         mouse = events.mouse
         new_x = mouse.position[0] - SCREEN_LEFT
         new_y = mouse.position[1] - SCREEN_TOP
         mouse.position = (new_x, new_y)
-        keys = events.keys
 
-        if mouse.released and self.players[0].containing_shells:
-            self.shoot_balls(mouse.position)
-            self.slowmo_factor = 1.0
+        self.play_frame(mouse, events.keys.pressed_key, steps)
+        if self.transition:
+            self.save_replay()
 
         if mouse.held and self.players[0].containing_shells:
-            if mouse.clicked:
-                self.slowmo_factor = self.SLOWMO_MAX
-
-            if self.slowmo_factor > 1.0:
-                self.slowmo_factor -= self.SPEEDUP_FACTOR
-
-                if self.slowmo_factor < 1.0:
-                    self.slowmo_factor = 1.0
-
-            for player in self.players:
-                player.rotate_towards(mouse.position, self.slowmo_factor)
-
-        if keys.pressed_key == pygame.K_r:
-            if mouse.held:
-                self.reset_level(True)
-            else:
-                self.reset_level(False)
+            self.predicted_paths = self.predictor.update(
+                self.level, self.players, mouse.position)
+        else:
+            self.predicted_paths = []
 
-        elif keys.pressed_key == pygame.K_ESCAPE:
-            self.transition = True
-            self.pause_exit = True
-            self.end_ball = self.players[0]
+    def step(self, mouse):
+        frame_events = super().step(mouse)
+        self.play_physics_events(frame_events)
 
         greatest_speed = 0.0
-        ball_index = len(self.balls)
-        for ball_ in reversed(self.balls):
-            ball_index -= 1
-            if ball_.out_of_bounds():
-                del self.balls[ball_index]
-            else:
-                ball_.check_collision(self.level, self.slowmo_factor)
-
-                if self.level.pressed_buttons == self.level.total_buttons:
-                    if ball_.touching_end:
-                        self.transition = True
-                        self.end_ball = ball_
-
-                        if ball_.shell_type == ball.GHOST:
-                            instrument = sound.ghost_instrument
-                        elif ball_.shell_type == ball.FLOAT:
-                            instrument = sound.float_instrument
-                        else:
-                            instrument = sound.normal_instrument
-
-                        instrument.play(sound.CS3, 0.6)
-
-                ball_.update_body(self.slowmo_factor)
-
-                velocity = (ball_.x_velocity, ball_.y_velocity)
-                greatest_speed = max(greatest_speed, geometry.magnitude(velocity))
+        for ball_ in self.balls:
+            velocity = (ball_.x_velocity, ball_.y_velocity)
+            greatest_speed = max(greatest_speed, geometry.magnitude(velocity))
 
         player_shells = 0
         for player in self.players:
@@ -1047,6 +1025,7 @@ class PlayScreen:
                 self.level.draw_debug_start_end(self.block_surface, (0, 0))
 
         graphics.update_ripples(self.slowmo_factor)
+        return frame_events
 
     def draw(self, surface, offset=(0, 0)):
         x = SCREEN_LEFT + offset[0]
@@ -1066,50 +1045,61 @@ class PlayScreen:
             self.draw_aimers(surface, offset)
 
         for ball_ in self.balls:
-            ball_.draw_debug(surface, (x, y))
-
-    def shoot_balls(self, position):
-        """Shoots all player balls towards a specific position."""
-        add_balls = []
-        remove_balls = []
-        for player in self.players:
-            old_ball = player
+            ball_.draw_debug(surface, (x, y), alpha=self.fixed_step.alpha)
 
-            new_radius = player.radius - ball.SHELL_WIDTH
-            new_shell = old_ball.containing_shells[0]
-            new_ball = ball.Ball(player.position, new_radius, new_shell)
-
-            new_ball.is_player = True
-
-            new_ball.angle = old_ball.angle
-            new_ball.containing_shells = old_ball.containing_shells[1:]
-
-            if old_ball.shell_type == ball.CLONE:
-                old_ball.shell_type = old_ball.containing_shells[0]
-                old_ball.containing_shells = old_ball.containing_shells[1:]
-                old_ball.radius = new_radius
-
-            else:
-                old_ball.is_player = False
-                old_ball.containing_shells = []
-                remove_balls.append(old_ball)
-
-            add_balls.append(new_ball)
-
-            new_ball.launch_towards(position)
-            old_ball.x_velocity = -new_ball.x_velocity
-            old_ball.y_velocity = -new_ball.y_velocity
-
-        for player in remove_balls:
-            self.players.remove(player)
+    def play_physics_events(self, frame_events):
+        """Plays the sounds and ripples for everything that happened in the
+        physics this frame.  frame_events comes from physics.step().
+        """
+        for event in frame_events:
+            kind = event[0]
+            ball_ = event[1]
+
+            if kind == physics.BUTTON_PRESSED:
+                self.level.button_ripple(event[2])
+                sound.button_notes.play(sound.button_note, 0.8)
+
+            elif kind == physics.BOUNCED:
+                position, magnitude, shell_type = event[2:]
+                x = position[0] + SCREEN_LEFT
+                y = position[1] + SCREEN_TOP
+                color = ball.SHELL_DEBUG_COLORS[shell_type]
+                graphics.create_ripple((x, y), color, magnitude * 4.0)
+
+                if shell_type == ball.FLOAT:
+                    volume = (magnitude - 1.0) / 5.0 + 0.2
+                    sound.float_scale.play_random(volume)
+                else:
+                    volume = (magnitude - 3.0) / 5.0 + 0.2
+                    sound.normal_scale.play_random(volume, ball_.is_player)
+
+            elif kind == physics.GHOST_PASSED:
+                sound.ghost_scale.play_random(0.8)
+                position = graphics.screen_position(event[2])
+                color = ball.SHELL_DEBUG_COLORS[ball.GHOST]
+                graphics.create_ripple(position, color, ball_.radius)
+
+            elif kind == physics.REACHED_END:
+                if ball_.shell_type == ball.GHOST:
+                    instrument = sound.ghost_instrument
+                elif ball_.shell_type == ball.FLOAT:
+                    instrument = sound.float_instrument
+                else:
+                    instrument = sound.normal_instrument
 
-        for player in add_balls:
-            self.players.append(player)
-            self.balls.append(player)
+                instrument.play(sound.CS3, 0.6)
 
     def draw_aimers(self, surface, offset=(0, 0)):
+        for ball_, points in self.predicted_paths:
+            color = ball.SHELL_DEBUG_COLORS[ball_.shell_type]
+            for point in points[self.PATH_SPACING::self.PATH_SPACING]:
+                point = (point[0] + offset[0], point[1] + offset[1])
+                x, y = graphics.screen_position(point)
+                surface.fill(color, (int(x) - 1, int(y) - 1, 2, 2))
+
         mouse_position = events.mouse.position
         for player in self.players:
+            player_x, player_y = player.drawn_position(self.fixed_step.alpha)
             angle1 = geometry.angle_between(mouse_position, player.position)
             angle2 = angle1 + math.pi
 
@@ -1120,8 +1110,8 @@ class PlayScreen:
 
                 diff1 = geometry.vector_to_difference(angle1, magnitude)
                 diff2 = geometry.vector_to_difference(angle2, magnitude)
-                point1 = (diff1[0] + player.x, diff1[1] + player.y)
-                point2 = (diff2[0] + player.x, diff2[1] + player.y)
+                point1 = (diff1[0] + player_x, diff1[1] + player_y)
+                point2 = (diff2[0] + player_x, diff2[1] + player_y)
                 point1 = (point1[0] + offset[0], point1[1] + offset[1])
                 point2 = (point2[0] + offset[0], point2[1] + offset[1])
                 point1 = graphics.screen_position(point1)
@@ -1131,46 +1121,45 @@ class PlayScreen:
                 width += 2
 
     def reset_level(self, slowmo=False):
-        self.balls = [copy.deepcopy(self.start_ball)]
-        self.players = [self.balls[0]]
-        self.players[0].point_towards_end(self.level)
-        columns = levels.WIDTH
-        rows = levels.HEIGHT
-        self.level.pressed_grid = [[False] * rows for _ in range(columns)]
-        self.level.pressed_buttons = 0
+        super().reset_level(slowmo)
         self.unlocked = False
         self.level.draw_debug_start_end(self.block_surface, (0, 0))
         self.restart_alpha = 0
         self.restart_cover.set_alpha(255)
-        if slowmo:
-            self.slowmo_factor = self.SLOWMO_MAX
+        self.fixed_step.reset()
+        self.predictor.clear()
 
     def load_level(self, level_num):
         """Prepares play_screen to play the given level.
 
         level_num is zero indexed, unlike the save file and in-game numbers.
+        If the level was prefetched, this just swaps it in.
         """
-        self.block_surface.fill(constants.TRANSPARENT)
-        self.slowmo_factor = 1.0
-
         self.level_num = level_num
-        self.level = levels.load_level(level_num)
+        prefetched = self.prefetcher.take(level_num)
+        if prefetched is None:
+            level = levels.load_level(level_num)
+            self.block_surface = render_blocks(level)
+        else:
+            level, self.block_surface = prefetched
 
-        block_layer = levels.LAYER_BLOCKS
-        self.level.draw_debug_layer(self.block_surface, block_layer, (0, 0))
-        self.level.draw_debug_start_end(self.block_surface, (0, 0))
+        self.start_level(level, ball.Ball)
+        self.recorder = replay.Recorder(level)
 
-        start_tile = self.level.start_tile
-        position = levels.middle_pixel(start_tile)
-        radius = ball.first_ball_radius(self.level)
-        containing_shells = self.level.start_shells
-        shell = containing_shells.pop(0)
+        self.prefetcher.start(level_num + 1)
 
-        self.start_ball = ball.Ball(position, radius, shell)
-        self.start_ball.is_player = True
-        self.start_ball.containing_shells = containing_shells
+    def save_replay(self):
+        """Saves the replay of the level being played, so that it can be
+        played back with simulation.replay."""
+        if self.recorder is None:
+            return
 
-        self.reset_level()
+        recording = self.recorder.finish(self)
+        self.recorder = None
+        try:
+            replay.save(recording, replay.level_path(self.level_num))
+        except OSError:
+            pass  # not being able to save a replay shouldn't stop the game
 
 
 class LevelTransition:
@@ -1230,6 +1219,10 @@ class LevelTransition:
 
         self.type = 0
 
+        # seconds the main thread spent in each init_level_to_level(),
+        # which is when the prefetched level is swapped in
+        self.load_times = []
+
     def update(self):
         if self.frame <= self.PAUSE_LAST:
             pass
@@ -1384,6 +1377,7 @@ class LevelTransition:
         main_menu.show_arrows = False
 
     def init_level_to_level(self):
+        started = time.perf_counter()
         self.type = self.LEVEL_TO_LEVEL
         self.something_to_level = True
 
@@ -1394,11 +1388,13 @@ class LevelTransition:
         self.previous_level = play_screen.level
         self.previous_balls = play_screen.balls
 
-        next_level = levels.load_level(play_screen.level_num + 1)
         end_position = play_screen.end_ball.position
+        self.color = ball.SHELL_DEBUG_COLORS[play_screen.end_ball.shell_type]
+
+        play_screen.load_level(play_screen.level_num + 1)
 
         from_point = graphics.screen_position(end_position)
-        to_point = levels.middle_pixel(next_level.start_tile)
+        to_point = levels.middle_pixel(play_screen.level.start_tile)
         to_point = graphics.screen_position(to_point)
 
         length = (self.OUT_LENGTH + self.IN_LENGTH)
@@ -1406,11 +1402,20 @@ class LevelTransition:
         self.y_change = (to_point[1] - from_point[1]) / length
         self.center = from_point
 
-        self.color = ball.SHELL_DEBUG_COLORS[play_screen.end_ball.shell_type]
-
         self.shell_count = 0
 
-        play_screen.load_level(play_screen.level_num + 1)
+        self.load_times.append(time.perf_counter() - started)
+
+    def report(self):
+        """Returns how long the main thread spent on level to level
+        transitions, as a line of text."""
+        if not self.load_times:
+            return "transitions: none yet"
+        return ("transitions: %d, last %.1f ms, worst %.1f ms on the main "
+                "thread; %s" % (len(self.load_times),
+                                self.load_times[-1] * 1000,
+                                max(self.load_times) * 1000,
+                                play_screen.prefetcher.report()))
 
     def init_level_to_menu(self):
         if not play_screen.pause_exit:
@@ -1511,7 +1516,8 @@ while True:
         break
 
     if current_screen == PLAY:
-        play_screen.update()
+        seconds = clock.get_time() / 1000.0
+        play_screen.update(play_screen.fixed_step.advance(seconds))
         play_screen.draw(final_display)
 
         if play_screen.transition and play_screen.in_editor:
@@ -1624,7 +1630,7 @@ while True:
             editor.editor.switch_to_menu = False
             editor.editor.undos = []
 
-            main_menu.block_layers[main_menu.selected_level] = editor.editor.level.layers[levels.LAYER_BLOCKS]
+            levels.flush_levels()
             main_menu.selected_level = -1
 
             current_screen = MENU
@@ -1643,6 +1649,10 @@ while True:
     graphics.fader.draw(final_display)
 
     # debug.debug(clock.get_fps())
+    # debug.debug(play_screen.fixed_step.sim_ratio())
+    # debug.debug("awake, asleep:", *play_screen.ball_counts())
+    # debug.debug(levels.level_repository.report())
+    # debug.debug(transition.report())
     # debug.debug(current_screen)
     # debug.debug(main_menu.grow_frame)
     # debug.debug(main_menu.mouse_arrow)
@@ -1657,6 +1667,10 @@ while True:
     # else:
     screen_update(60)
 
+if current_screen == PLAY:
+    play_screen.save_replay()
+levels.close_levels()
+
 if main_menu.exit_fading:
     file = open("Volume Storage.txt", 'w')
     file.write(str(main_menu.exit_volume))
@@ -1,6 +1,12 @@
 import ctypes
-user32 = ctypes.windll.user32
-user32.SetProcessDPIAware()
+
+# ctypes.windll only exists on Windows.  Everywhere else (including headless
+# simulation runs) the full screen is treated as being just the playfield.
+try:
+    user32 = ctypes.windll.user32
+    user32.SetProcessDPIAware()
+except AttributeError:
+    user32 = None
 
 SCREEN_WIDTH = 500
 SCREEN_HEIGHT = 500
@@ -8,8 +14,12 @@ SCREEN_SIZE = (SCREEN_WIDTH, SCREEN_HEIGHT)
 SCREEN_MIDDLE = (float(SCREEN_WIDTH) / 2, float(SCREEN_HEIGHT) / 2)
 SCREEN_MIDDLE_INT = (SCREEN_WIDTH // 2, SCREEN_HEIGHT // 2)
 
-FULL_WIDTH = user32.GetSystemMetrics(0)
-FULL_HEIGHT = user32.GetSystemMetrics(1)
+if user32:
+    FULL_WIDTH = user32.GetSystemMetrics(0)
+    FULL_HEIGHT = user32.GetSystemMetrics(1)
+else:
+    FULL_WIDTH = SCREEN_WIDTH
+    FULL_HEIGHT = SCREEN_HEIGHT
 FULL_SIZE = (FULL_WIDTH, FULL_HEIGHT)
 FULL_MIDDLE = (float(FULL_WIDTH) / 2, float(FULL_HEIGHT) / 2)
 FULL_MIDDLE_INT = (FULL_WIDTH // 2, FULL_HEIGHT // 2)
@@ -277,9 +277,8 @@ class MainMenu:
         else:
             self.last_page = (level_count - 1) // self.LEVELS_PER_PAGE
 
-            file = open("levels.txt", 'r')
-            level_array = file.read().split(levels.LEVEL_SEPARATOR)
-            file.close()
+            levels.flush_levels()
+            level_array = levels.level_repository.store.level_strings()
 
             y = self.LEVEL_BUTTON_SPACING
             for level_num, level_string in enumerate(level_array):
@@ -1,49 +1,45 @@
 import pygame
 
-import math
-import geometry
 import constants
 import graphics
+from simulation import repository
+from simulation import store
+from simulation import thumbnail
+from simulation import world
 
 pygame.init()
 
-# Note that the levels in levels.txt are saved flipped along the bottom-left
-# top-right diagonal - that is, each "row" in the file is actually a column
-# in-game, and vice versa.  This is so that when retrieving things from the
-# 2D matrix that represents the level, the x coordinate comes first and the
-# y coordinate comes second.
-
-WIDTH = constants.LEVEL_WIDTH
-HEIGHT = constants.LEVEL_HEIGHT
-PIXEL_WIDTH = WIDTH * constants.TILE_WIDTH
-PIXEL_HEIGHT = HEIGHT * constants.TILE_HEIGHT
-
-LAYER_ID_COUNTS = (8, 9)
-EMPTY = 1
-BLOCKS_WALL = 2
-# The corner blocks are named based off of the two flat sides of the block.
-# For example, on BLOCKS_TOPLEFT, the top and left sides are flat, and the
-# diagonal is from the topright to the bottomleft.
-BLOCKS_TOPLEFT = 3
-BLOCKS_TOPRIGHT = 4
-BLOCKS_BOTTOMRIGHT = 5
-BLOCKS_BOTTOMLEFT = 6
-BLOCKS_START = 7
-BLOCKS_END = 8
-
-BUTTONS_LEFT = 2
-BUTTONS_UP = 3
-BUTTONS_RIGHT = 4
-BUTTONS_DOWN = 5
-BUTTONS_TOPLEFT = 6
-BUTTONS_TOPRIGHT = 7
-BUTTONS_BOTTOMRIGHT = 8
-BUTTONS_BOTTOMLEFT = 9
-
-
-LAYER_COUNT = constants.LAYERS
-LAYER_BLOCKS = constants.LAYER_BLOCKS
-LAYER_BUTTONS = constants.LAYER_BUTTONS
+# The parts of a level that the physics needs live in simulation.world, so
+# that they can be used without pygame.  They're all available from here too.
+
+WIDTH = world.WIDTH
+HEIGHT = world.HEIGHT
+PIXEL_WIDTH = world.PIXEL_WIDTH
+PIXEL_HEIGHT = world.PIXEL_HEIGHT
+
+LAYER_ID_COUNTS = world.LAYER_ID_COUNTS
+EMPTY = world.EMPTY
+BLOCKS_WALL = world.BLOCKS_WALL
+BLOCKS_TOPLEFT = world.BLOCKS_TOPLEFT
+BLOCKS_TOPRIGHT = world.BLOCKS_TOPRIGHT
+BLOCKS_BOTTOMRIGHT = world.BLOCKS_BOTTOMRIGHT
+BLOCKS_BOTTOMLEFT = world.BLOCKS_BOTTOMLEFT
+BLOCKS_START = world.BLOCKS_START
+BLOCKS_END = world.BLOCKS_END
+
+BUTTONS_LEFT = world.BUTTONS_LEFT
+BUTTONS_UP = world.BUTTONS_UP
+BUTTONS_RIGHT = world.BUTTONS_RIGHT
+BUTTONS_DOWN = world.BUTTONS_DOWN
+BUTTONS_TOPLEFT = world.BUTTONS_TOPLEFT
+BUTTONS_TOPRIGHT = world.BUTTONS_TOPRIGHT
+BUTTONS_BOTTOMRIGHT = world.BUTTONS_BOTTOMRIGHT
+BUTTONS_BOTTOMLEFT = world.BUTTONS_BOTTOMLEFT
+
+
+LAYER_COUNT = world.LAYER_COUNT
+LAYER_BLOCKS = world.LAYER_BLOCKS
+LAYER_BUTTONS = world.LAYER_BUTTONS
 
 
 DEBUG_START_COLOR = constants.YELLOW
@@ -52,90 +48,60 @@ DEBUG_END_LOCKED_COLOR = constants.LOCK_COLOR
 DEBUG_BUTTON_COLOR = constants.RED
 
 
-# these are the characters that split up the different parts of levels.txt.
-LEVEL_SEPARATOR = '*'    # character that separates each level
-LAYER_SEPARATOR = '~'    # character that separates each layer in the level
-COLUMN_SEPARATOR = '\n'  # character that separates each column in the level
-TILE_SEPARATOR = ' '     # character that separates each tile in the column
+LEVEL_SEPARATOR = world.LEVEL_SEPARATOR
+LAYER_SEPARATOR = world.LAYER_SEPARATOR
+COLUMN_SEPARATOR = world.COLUMN_SEPARATOR
+TILE_SEPARATOR = world.TILE_SEPARATOR
 
+out_of_bounds = world.out_of_bounds
+grid_tile_position = world.grid_tile_position
+tile_pixel_position = world.tile_pixel_position
+middle_pixel = world.middle_pixel
+tiles_touching_ball = world.tiles_touching_ball
+is_solid = world.is_solid
+is_ground = world.is_ground
 
-def make_new_level(index):
-    """Appends a new, completely empty level at the end of levels.txt."""
-    file = open("levels.txt", 'r')
-    level_array = file.read().split(LEVEL_SEPARATOR)
-    file.close()
 
-    level_array.insert(index, Level().to_string())
-    string = LEVEL_SEPARATOR.join(level_array)
-
-    file = open("levels.txt", 'w')
-    file.write(string)
-    file.close()
+def make_new_level(index):
+    """Inserts a new, completely empty level into levels.txt at index."""
+    level_repository.insert(index, Level())
 
 
 def save_level(level_num, updated_level):
     """Replaces the level at index level_num with updated_level.
 
-    updated_level must be an instance of the Level class.
+    updated_level must be an instance of the Level class.  It's written to
+    levels.txt's journal straight away, so a crash afterwards can't lose it.
     """
-    file = open("levels.txt", 'r')
-    level_array = file.read().split(LEVEL_SEPARATOR)
-    file.close()
+    level_repository.save(level_num, updated_level)
+
 
-    level_array[level_num] = updated_level.to_string()
-    string = LEVEL_SEPARATOR.join(level_array)
+def flush_levels():
+    """Writes every level saved without flushing to levels.txt's journal,
+    where it's safe from crashes."""
+    level_repository.flush()
 
-    file = open("levels.txt", 'w')
-    file.write(string)
-    file.close()
+
+def close_levels():
+    """Writes every saved level into levels.txt itself, so that the file
+    can be read on its own again.  Called when the game closes."""
+    with level_repository.lock:
+        level_repository.flush()
+        level_repository.store.compact()
 
 
 def load_level(level_num):
     """Returns the level saved in levels.txt, at index level_num."""
-    file = open("levels.txt", 'r')
-    level_array = file.read().split(LEVEL_SEPARATOR)
-    file.close()
-
-    level = string_to_level(level_array[level_num])
-    return level
+    return level_repository.load(level_num)
 
 
 def delete_level(level_num):
-    file = open("levels.txt", 'r')
-    level_array = file.read().split(LEVEL_SEPARATOR)
-    file.close()
-
-    del level_array[level_num]
-
-    string = LEVEL_SEPARATOR.join(level_array)
-
-    file = open("levels.txt", 'w')
-    file.write(string)
-    file.close()
-
-
-def load_all_block_layers():
-    """Returns a list containing the block layer of every level.  Used in the
-    main menu to draw level thumbnails in the center of the level select.
-    """
-    file = open("levels.txt", 'r')
-    level_strings = file.read().split(LEVEL_SEPARATOR)
-    file.close()
-
-    levels = [string_to_level(string) for string in level_strings]
-    return [level.layers[LAYER_BLOCKS] for level in levels]
+    level_repository.delete(level_num)
 
 
 def count_levels():
     """Returns the number of levels in the file."""
-    file = open("levels.txt", 'r')
-    file_string = file.read()
-    file.close()
-
-    if file_string == "" or file_string.isspace():
-        return 0
-
-    return file_string.count(LEVEL_SEPARATOR) + 1
+    return level_repository.count()
 
 
 def swap_levels(level_num1, level_num2):
@@ -143,74 +109,21 @@ def swap_levels(level_num1, level_num2):
     if level_num1 < 0 or level_num2 < 0:
         raise Exception("Attempted to swap level below 0!")
 
-    file = open("levels.txt", 'r')
-    level_array = file.read().split(LEVEL_SEPARATOR)
-    file.close()
-
-    level_count = len(level_array)
+    level_count = level_repository.count()
     if level_num1 >= level_count or level_num2 >= level_count:
         raise Exception("Attempted to swap level past last level!")
 
-    temp = level_array[level_num1]
-    level_array[level_num1] = level_array[level_num2]
-    level_array[level_num2] = temp
-
-    string = LEVEL_SEPARATOR.join(level_array)
-
-    file = open("levels.txt", 'w')
-    file.write(string)
-    file.close()
-
-
-def out_of_bounds(tile_position):
-    """Returns whether a (column, row) pair is a valid coordinate inside
-    the level.
-    """
-    if 0 <= tile_position[0] < WIDTH and 0 <= tile_position[1] < HEIGHT:
-        return False
-    return True
+    level_repository.swap(level_num1, level_num2)
 
 
 def string_to_layer(string):
     """Takes a string and converts it into a Layer object."""
-    columns = string.split(COLUMN_SEPARATOR)
-
-    string_grid = [column.split(TILE_SEPARATOR) for column in columns]
-    grid = [[EMPTY] * HEIGHT for _ in range(WIDTH)]
-
-    for column in range(WIDTH):
-        for row in range(HEIGHT):
-            grid[column][row] = int(string_grid[column][row])
-
-    new_layer = Layer()
-    new_layer.grid = grid
-    return new_layer
+    return world.string_to_layer(string, Layer())
 
 
 def string_to_level(string):
     """Takes a string and converts it into a Level object."""
-    strings = string.split(LAYER_SEPARATOR)
-
-    shell_strings = strings[0]
-    shell_values = [int(shell) for shell in shell_strings.split()]
-
-    start_end_string = strings[1]
-    start_end_values = [int(value) for value in start_end_string.split()]
-
-    layer_strings = strings[2:]
-    layers = [string_to_layer(layer_string) for layer_string in layer_strings]
-
-    new_level = Level()
-    new_level.layers = layers
-    new_level.start_tile = (start_end_values[0], start_end_values[1])
-    new_level.end_tile = (start_end_values[2], start_end_values[3])
-    new_level.start_shells = shell_values
-    for column in range(WIDTH):
-        for row in range(HEIGHT):
-            if new_level.is_button((column, row)):
-                new_level.total_buttons += 1
-
-    return new_level
+    return world.string_to_level(string, Level())
 
 
 BUTTON_THICKNESS = 5
@@ -313,17 +226,6 @@ def draw_debug_tile(surface, layer_num, tile_id, pixel_position):
         pygame.draw.rect(surface, DEBUG_BUTTON_COLOR, (x, y, width, height))
 
 
-def grid_tile_position(point):
-    """Returns the row and column of the tile that the given point is on."""
-    column = int(point[0] // constants.TILE_WIDTH)
-    row = int(point[1] // constants.TILE_HEIGHT)
-
-    if not out_of_bounds((column, row)):
-        return column, row
-    else:
-        return None
-
-
 def grid_pixel_position(point):
     """Returns the top left corner of the tile that the point is on."""
     tile_position = grid_tile_position(point)
@@ -336,12 +238,6 @@ def grid_pixel_position(point):
         return None
 
 
-def tile_pixel_position(tile_position):
-    """Returns the top left corner of a given tile."""
-    column, row = tile_position
-    return column * constants.TILE_WIDTH, row * constants.TILE_HEIGHT
-
-
 def tile_rect(pixel_position):
     """Returns a rectangle the size of a tile.
 
@@ -351,67 +247,7 @@ def tile_rect(pixel_position):
     return pixel_position[0], pixel_position[1], width, height
 
 
-def middle_pixel(tile_position):
-    x = tile_position[0] * constants.TILE_WIDTH + constants.TILE_WIDTH // 2
-    y = tile_position[1] * constants.TILE_HEIGHT + constants.TILE_HEIGHT // 2
-    return x, y
-
-
-BALL_CHECKS = 16
-
-
-def tiles_touching_ball(radius, ball_center):
-    """Returns a set of tuples, each a (column, row) pair, of the tiles
-    that the ball touches.  Note that this is not necessarily 100%
-    accurate, since it simply checks a few points around the circumference
-    of the ball (the amount of points is defined by _BALL_CHECKS).
-    """
-    tile_list = []
-
-    center_x, center_y = ball_center
-    for point_num in range(BALL_CHECKS):
-        angle = math.pi * 2.0 * (point_num / BALL_CHECKS)
-        delta_x, delta_y = geometry.vector_to_difference(angle, radius - 1)
-
-        point = (center_x + delta_x, center_y + delta_y)
-        tile_list.append(grid_tile_position(point))
-
-    return set(tile_list)
-
-
-def is_ground(tile_type):
-    if tile_type == BLOCKS_WALL:
-        return True
-    if tile_type == BLOCKS_TOPLEFT:
-        return True
-    if tile_type == BLOCKS_TOPRIGHT:
-        return True
-    return False
-
-
-class Layer:
-    def __init__(self):
-        self.grid = [[EMPTY] * HEIGHT for _ in range(WIDTH)]
-
-    def tile_at(self, tile_position):
-        """Returns the tile at tile_position, which is a (column, row) pair."""
-        if out_of_bounds(tile_position):
-            return None
-        return self.grid[tile_position[0]][tile_position[1]]
-
-    def to_string(self):
-        """Converts the layer into a string.  For writing to files."""
-        column_strings = []
-        for column in range(WIDTH):
-            tile_strings = []
-
-            for row in range(HEIGHT):
-                tile_strings.append(str(self.grid[column][row]))
-
-            column_strings.append(TILE_SEPARATOR.join(tile_strings))
-
-        return COLUMN_SEPARATOR.join(column_strings)
-
+class Layer(world.Layer):
     def draw_thumbnail(self, surface, position, color=constants.WHITE, size=2):
         """Draws a small thumbnail of the layer."""
         start_x, start_y = position
@@ -423,43 +259,10 @@ class Layer:
                     rect = (x, y, size, size)
                     surface.fill(color, rect)
 
-    def change_tile(self, tile_id, tile_position):
-        """Changes the tile at tile_position to tile_id.
 
-        tile_position is a (column, row) pair.
-        """
-        self.grid[tile_position[0]][tile_position[1]] = tile_id
-
-
-class Level:
-    def __init__(self):
-        self.layers = [Layer() for _ in range(LAYER_COUNT)]
-        self.start_tile = (WIDTH // 2, HEIGHT // 2)
-        self.end_tile = (WIDTH // 2 + 5, HEIGHT // 2)
-        self.start_shells = [0]  # the shells that the ball starts with
-        self.total_buttons = 0
-        self.pressed_buttons = 0
-        self.pressed_grid = [[False] * HEIGHT for _ in range(WIDTH)]
-
-    def to_string(self):
-        """Converts the level into a string, for writing to files."""
-        shell_string = " ".join([str(shell) for shell in self.start_shells])
-        start_string = str(self.start_tile[0]) + " " + str(self.start_tile[1])
-        end_string = str(self.end_tile[0]) + " " + str(self.end_tile[1])
-        layer_strings = [layer.to_string() for layer in self.layers]
-
-        final_string = shell_string + LAYER_SEPARATOR
-        final_string += start_string + " " + end_string + LAYER_SEPARATOR
-        final_string += LAYER_SEPARATOR.join(layer_strings)
-        return final_string
-
-    def tile_at(self, tile_position):
-        """Returns the tile type that is occupying a given position.
-
-        tile_position is a (layer, column, row) triplet.
-        """
-        layer = self.layers[tile_position[0]]
-        return layer.tile_at((tile_position[1], tile_position[2]))
+class Level(world.Level):
+    def new_layer(self):
+        return Layer()
 
     def draw_tile_at(self, surface, tile_position, grid_top_left=(0, 0)):
         """Draws the tiles (on all layers) occupying a given position.
@@ -526,85 +329,6 @@ class Level:
             color = DEBUG_END_COLOR
         pygame.draw.rect(surface, color, tile_rect((x, y)))
 
-    def change_tile(self, tile_id, tile_position):
-        """Changes the tile at a certain position.
-
-        tile_position is a (layer, column, row) triplet.
-        """
-        layer = self.layers[tile_position[0]]
-        layer.change_tile(tile_id, (tile_position[1], tile_position[2]))
-
-    def tile_to_segments(self, tile_position):
-        """Returns a list of Segments representing a tile at the specified
-        tile_position.  This will always only check LAYER_BLOCKS.
-
-        tile_position is a (column, row pair).
-        """
-        layer = self.layers[LAYER_BLOCKS]
-        tile = layer.tile_at(tile_position)
-
-        if tile == EMPTY:
-            return []
-
-        else:
-            width = constants.TILE_WIDTH
-            height = constants.TILE_HEIGHT
-            x = tile_position[0] * constants.TILE_WIDTH
-            y = tile_position[1] * constants.TILE_HEIGHT
-            top_left = (x, y)
-            top_right = (x + width, y)
-            bottom_right = (x + width, y + height)
-            bottom_left = (x, y + height)
-
-            if tile == BLOCKS_WALL:
-                points = (top_left, top_right, bottom_right, bottom_left)
-            elif tile == BLOCKS_TOPLEFT:
-                points = (top_left, top_right, bottom_left)
-            elif tile == BLOCKS_TOPRIGHT:
-                points = (top_right, bottom_right, top_left)
-            elif tile == BLOCKS_BOTTOMRIGHT:
-                points = (bottom_right, bottom_left, top_right)
-            elif tile == BLOCKS_BOTTOMLEFT:
-                points = (bottom_left, top_left, bottom_right)
-            else:
-                return []
-
-            return geometry.points_to_segment_list(points)
-
-    def is_button(self, tile_position):
-        """Returns whether a tile contains a button or not."""
-        tile = self.layers[LAYER_BUTTONS].tile_at(tile_position)
-        if tile == EMPTY:
-            return False
-        return True
-
-    def unpress(self, tile_position):
-        """Unpresses the button at the given position."""
-        tile = self.layers[LAYER_BUTTONS].tile_at(tile_position)
-        if tile == EMPTY:
-            raise Exception("There is no button on tile " + str(tile_position))
-
-        if self.is_pressed(tile_position):
-            self.pressed_grid[tile_position[0]][tile_position[1]] = False
-            self.pressed_buttons -= 1
-
-    def press(self, tile_position):
-        """Presses the button at a given position."""
-        tile = self.layers[LAYER_BUTTONS].tile_at(tile_position)
-        if tile == EMPTY:
-            raise Exception("There is no button on tile " + str(tile_position))
-
-        if not self.is_pressed(tile_position):
-            self.pressed_grid[tile_position[0]][tile_position[1]] = True
-            self.pressed_buttons += 1
-
-    def is_pressed(self, tile_position):
-        """Returns whether a tile is pressed or not.
-
-        If no button exists on the tile, this returns False.
-        """
-        return self.pressed_grid[tile_position[0]][tile_position[1]]
-
     def button_ripple(self, tile_position):
         button_type = self.layers[LAYER_BUTTONS].tile_at(tile_position)
         x, y = middle_pixel(tile_position)
@@ -637,3 +361,49 @@ class Level:
         position = graphics.screen_position((x, y))
 
         graphics.create_ripple(position, DEBUG_BUTTON_COLOR, 20)
+
+
+class Thumbnails(thumbnail.ThumbnailMasks):
+    """Surfaces with each level's thumbnail drawn on them, made from the
+    masks the first time each is needed and then kept."""
+    def __init__(self, level_repository, results=None):
+        super().__init__(level_repository, results)
+        self.surfaces = {}  # (level key, color, size) -> surface
+
+    def surface(self, level_num, color=constants.WHITE, size=2):
+        """Returns the thumbnail of the level at level_num, with its blocks
+        color and each tile size pixels wide.  Everything else is
+        transparent."""
+        key, mask = self.mask(level_num)
+        surface = self.surfaces.get((key, color, size))
+        if surface is None:
+            surface = render_thumbnail(mask, color, size)
+            self.surfaces[(key, color, size)] = surface
+        return surface
+
+
+def render_thumbnail(mask, color, size):
+    """Draws a thumbnail mask onto a new surface, all at once with
+    pygame.surfarray if there's numpy, or a tile at a time if not."""
+    try:
+        import numpy
+    except ImportError:
+        surface = graphics.new_surface((WIDTH * size, HEIGHT * size))
+        for tile_index, not_empty in enumerate(mask):
+            if not_empty:
+                column, row = divmod(tile_index, HEIGHT)
+                surface.fill(color, (column * size, row * size, size, size))
+        return surface
+
+    tiles = numpy.frombuffer(mask, dtype=numpy.uint8).reshape(WIDTH, HEIGHT)
+    pixels = tiles.astype(bool).repeat(size, axis=0).repeat(size, axis=1)
+    colors = numpy.empty(pixels.shape + (3,), dtype=numpy.uint8)
+    colors[...] = constants.TRANSPARENT
+    colors[pixels] = color
+    surface = pygame.surfarray.make_surface(colors)
+    surface.set_colorkey(constants.TRANSPARENT)
+    return surface
+
+
+# every level that's loaded and saved goes through here
+level_repository = repository.LevelRepository(store.open_store(), Level, Layer)
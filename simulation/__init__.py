@@ -0,0 +1,6 @@
+# The simulation package is everything the game needs to run its physics,
+# without pygame.  It never opens a window, plays a sound or loads an image,
+# so it can be imported by scripts that fire thousands of shots headlessly.
+
+from simulation.world import Level, Layer, load_level, string_to_level
+from simulation.physics import Ball, new_player, shoot, step
@@ -0,0 +1,364 @@
+import numpy
+
+import constants
+from simulation import physics
+from simulation import world
+
+# The batch simulator steps many balls at once using numpy.  It does the
+# same physics as physics.Ball.update_body() and check_collision() in the
+# STEPPED collision mode only, so walls are looked for at check_steps()
+# points along the way each frame.  Balls default to the SWEPT mode, which
+# finds the first contact exactly, so a batch only matches balls whose
+# COLLISION is STEPPED, and its results for the same shots can differ a
+# little from the game's.
+# Other than that, there are a few differences:
+# - the angle and spin of balls aren't simulated, since they're cosmetic.
+# - no events are made.  Instead, after each step, bounced and reached_end
+#   say which balls bounced and which ones finished the level.
+# Balls fall asleep and wake up the same way as physics.Ball too.
+# Walls are found the same way, through the tiles that
+# tiles_touching_ball() finds, so positions match physics.Ball to within
+# TOLERANCE pixels.  The exception is a ball that is exactly as far from
+# two walls at once, like one flying diagonally into a corner.  Rounding
+# decides which wall it bounces off of, and the two can pick differently.
+TOLERANCE = 1e-4
+
+
+class BatchLevel:
+    """A level's collision data, as numpy arrays."""
+    def __init__(self, level):
+        # every segment gets a number, and each tile stores the numbers of
+        # its segments, padded out with -1.  Tiles are numbered
+        # column * HEIGHT + row.
+        numbers = {}
+        tile_numbers = {}
+        for column in range(world.WIDTH):
+            for row in range(world.HEIGHT):
+                tile_numbers[column, row] = [
+                    numbers.setdefault(segment, len(numbers))
+                    for segment in level.tile_to_segments((column, row))]
+
+        most = max([len(found) for found in tile_numbers.values()], default=0)
+        self.tile_segments = numpy.full((world.WIDTH * world.HEIGHT, most), -1)
+        for (column, row), found in tile_numbers.items():
+            self.tile_segments[column * world.HEIGHT + row, :len(found)] = found
+        self.has_segments = (self.tile_segments != -1).any(axis=1)
+
+        # an extra segment at the end, for the padding to point at
+        points = [segment.point1 + segment.point2 for segment in numbers]
+        points.append((0.0, 0.0, 1.0, 0.0))
+        points = numpy.array(points, dtype=float)
+        self.segment_starts = points[:, 0:2]
+        self.segment_deltas = points[:, 2:4] - points[:, 0:2]
+        self.segment_lengths = (self.segment_deltas ** 2).sum(axis=1)
+
+        # every button gets a number, and each tile stores its button's
+        # number, or -1 if it doesn't have one
+        self.button_grid = numpy.full(world.WIDTH * world.HEIGHT, -1)
+        self.total_buttons = 0
+        for column in range(world.WIDTH):
+            for row in range(world.HEIGHT):
+                if level.is_button((column, row)):
+                    tile = column * world.HEIGHT + row
+                    self.button_grid[tile] = self.total_buttons
+                    self.total_buttons += 1
+
+        self.end_tile = level.end_tile
+
+
+def from_balls(balls, groups=None):
+    """Returns a BallBatch holding copies of the given physics.Balls.
+
+    groups is a list with one number per ball.  Balls in the same group
+    share pressed buttons, like the balls of one play through a level do.
+    By default, every ball is in group 0.
+    """
+    if groups is None:
+        groups = [0] * len(balls)
+
+    batch = BallBatch(len(balls), max(groups, default=0) + 1)
+    for index, ball in enumerate(balls):
+        batch.x[index] = ball.x
+        batch.y[index] = ball.y
+        batch.x_velocity[index] = ball.x_velocity
+        batch.y_velocity[index] = ball.y_velocity
+        batch.radius[index] = ball.radius
+        batch.collision_radius[index] = ball.collision_radius()
+        batch.shell_type[index] = ball.shell_type
+        batch.is_player[index] = ball.is_player
+        batch.normal_bounce_decay[index] = ball.NORMAL_BOUNCE_DECAY
+        batch.floating_bounce_decay[index] = ball.FLOATING_BOUNCE_DECAY
+        batch.x_bounce_decay[index] = ball.x_bounce_decay
+        batch.y_bounce_decay[index] = ball.y_bounce_decay
+        batch.group[index] = groups[index]
+        batch.rest_frames[index] = ball.rest_frames
+        batch.rest_x[index] = ball.rest_x
+        batch.rest_y[index] = ball.rest_y
+
+    return batch
+
+
+class BallBatch:
+    """Many balls, stored as one numpy array per attribute."""
+    CHECK_STEPS = physics.Ball.CHECK_STEPS
+    STEP_SPACING = physics.Ball.STEP_SPACING
+    GROUNDED_THRESHOLD = physics.Ball.GROUNDED_THRESHOLD
+    SLEEP_FRAMES = physics.Ball.SLEEP_FRAMES
+    SLEEP_DISTANCE = physics.Ball.SLEEP_DISTANCE
+
+    def __init__(self, count, groups=1):
+        self.count = count
+        self.x = numpy.zeros(count)
+        self.y = numpy.zeros(count)
+        self.x_velocity = numpy.zeros(count)
+        self.y_velocity = numpy.zeros(count)
+        self.radius = numpy.zeros(count)
+        self.collision_radius = numpy.zeros(count)
+        self.shell_type = numpy.zeros(count, dtype=int)
+        self.is_player = numpy.zeros(count, dtype=bool)
+        self.normal_bounce_decay = numpy.full(count, 0.7)
+        self.floating_bounce_decay = numpy.full(count, 0.9)
+        self.x_bounce_decay = numpy.full(count, 0.7)
+        self.y_bounce_decay = numpy.full(count, 0.7)
+        self.group = numpy.zeros(count, dtype=int)
+        self.rest_frames = numpy.zeros(count, dtype=int)
+        self.rest_x = numpy.zeros(count)
+        self.rest_y = numpy.zeros(count)
+
+        self.in_play = numpy.ones(count, dtype=bool)
+        self.touching_end = numpy.zeros(count, dtype=bool)
+        self.bounced = numpy.zeros(count, dtype=bool)
+        self.reached_end = numpy.zeros(count, dtype=bool)
+
+        self.groups = groups
+        self.pressed = None
+
+    def step(self, level, slowmo_factor=1.0):
+        """Advances every ball by one frame, like physics.step().
+
+        level is a BatchLevel.  Balls that leave the screen stay in the
+        arrays, but are marked as no longer in_play.
+        """
+        if self.pressed is None:
+            self.pressed = numpy.zeros((self.groups, level.total_buttons),
+                                       dtype=bool)
+
+        pressed_counts = self.pressed.sum(axis=1)
+        self.in_play &= ~self.out_of_bounds()
+        self.check_collision(level, slowmo_factor)
+
+        all_pressed = self.pressed.all(axis=1)[self.group]
+        self.reached_end = self.awake() & self.touching_end & all_pressed
+
+        self.update_body(slowmo_factor)
+        self.update_rest(slowmo_factor)
+
+        # pressing a button wakes up every ball in the same group
+        changed = self.pressed.sum(axis=1) != pressed_counts
+        self.rest_frames[changed[self.group]] = 0
+
+    def awake(self):
+        """Returns which balls are in play and not asleep."""
+        return self.in_play & (self.rest_frames < self.SLEEP_FRAMES)
+
+    def update_rest(self, slowmo_factor=1.0):
+        """Counts how long each awake ball has been resting, like
+        physics.Ball.update_rest()."""
+        awake = self.awake()
+        speed_squared = self.x_velocity ** 2 + self.y_velocity ** 2
+        sleep_distance = self.SLEEP_DISTANCE / slowmo_factor
+        resting = self.bounced & (speed_squared < self.GROUNDED_THRESHOLD ** 2)
+        resting &= numpy.abs(self.x - self.rest_x) <= sleep_distance
+        resting &= numpy.abs(self.y - self.rest_y) <= sleep_distance
+
+        self.rest_frames[awake & resting] += 1
+        moved = awake & ~resting
+        self.rest_frames[moved] = 0
+        self.rest_x[moved] = self.x[moved]
+        self.rest_y[moved] = self.y[moved]
+
+    def out_of_bounds(self):
+        x = (self.x + constants.SCREEN_LEFT).astype(int)
+        y = (self.y + constants.SCREEN_TOP).astype(int)
+        inside = (-100 <= x) & (x < constants.FULL_WIDTH + 100)
+        inside &= (-100 <= y) & (y < constants.FULL_HEIGHT + 100)
+        return ~inside
+
+    def floating(self):
+        return ~self.is_player & (self.shell_type == physics.FLOAT)
+
+    def update_body(self, slowmo_factor=1.0):
+        """Moves every awake ball according to its velocity and gravity."""
+        moving = self.awake()
+        floating = self.floating() & moving
+
+        self.x += numpy.where(moving, self.x_velocity / slowmo_factor, 0.0)
+        self.y += numpy.where(moving, self.y_velocity / slowmo_factor, 0.0)
+
+        gravity = numpy.where(floating, 0.0, constants.GRAVITY)
+        self.y_velocity += numpy.where(moving, gravity / slowmo_factor, 0.0)
+
+        drag = numpy.where(floating, 0.993 + min(0.0065, 0.0015 * slowmo_factor), 1.0)
+        self.x_velocity *= drag
+        self.y_velocity *= drag
+
+    def check_collision(self, level, slowmo_factor=1.0):
+        """Bounces every awake ball off of the nearest wall it touches."""
+        self.touching_end[:] = False
+        self.bounced[:] = False
+
+        start_x = self.x
+        start_y = self.y
+        delta_x = self.x_velocity / slowmo_factor
+        delta_y = self.y_velocity / slowmo_factor
+
+        # ghosts that have been shot pass straight through walls
+        tangible = ~(~self.is_player & (self.shell_type == physics.GHOST))
+        checking = numpy.flatnonzero(self.awake())
+
+        # like physics.Ball.check_steps()
+        distance = numpy.sqrt(delta_x * delta_x + delta_y * delta_y)
+        spacing = self.collision_radius * self.STEP_SPACING
+        steps = (distance / spacing).astype(int) + 1
+        steps = numpy.minimum(steps, self.CHECK_STEPS)
+
+        for step in range(1, self.CHECK_STEPS + 1):
+            checking = checking[steps[checking] >= step]
+            if checking.size == 0:
+                break
+
+            multiplier = step / steps[checking]
+            x = start_x[checking] + delta_x[checking] * multiplier
+            y = start_y[checking] + delta_y[checking] * multiplier
+            radius = self.collision_radius[checking]
+
+            tiles, touching = self.check_tiles(level, checking, x, y, radius)
+
+            # only tangible balls touching a tile that has walls can bounce
+            touching &= level.has_segments[tiles]
+            near_walls = touching.any(axis=1) & tangible[checking]
+            solid = checking[near_walls]
+            if solid.size == 0:
+                continue
+            x = x[near_walls]
+            y = y[near_walls]
+            radius = radius[near_walls]
+            tiles = tiles[near_walls]
+            touching = touching[near_walls]
+
+            # the segments of those tiles
+            candidates = level.tile_segments[tiles]
+            candidates[~touching] = -1
+            candidates = candidates.reshape(solid.size, -1)
+            missing = candidates == -1
+
+            # nearest point on each of those segments
+            starts = level.segment_starts[candidates]
+            deltas = level.segment_deltas[candidates]
+            offset_x = x[:, None] - starts[:, :, 0]
+            offset_y = y[:, None] - starts[:, :, 1]
+            along = offset_x * deltas[:, :, 0] + offset_y * deltas[:, :, 1]
+            along = numpy.clip(along / level.segment_lengths[candidates],
+                               0.0, 1.0)
+            away_x = offset_x - along * deltas[:, :, 0]
+            away_y = offset_y - along * deltas[:, :, 1]
+            distances = away_x ** 2 + away_y ** 2
+            distances[missing] = numpy.inf
+
+            # a ball that's exactly on a segment isn't touching it
+            distances[distances == 0.0] = numpy.inf
+
+            nearest = distances.argmin(axis=1)
+            every = numpy.arange(nearest.size)
+            shortest = numpy.sqrt(distances[every, nearest])
+            hit = shortest < radius
+
+            hit_balls = solid[hit]
+            normal_x = away_x[every, nearest][hit] / shortest[hit]
+            normal_y = away_y[every, nearest][hit] / shortest[hit]
+            self.bounce(hit_balls, normal_x, normal_y)
+
+            checking = numpy.setdiff1d(checking, hit_balls, assume_unique=True)
+
+        self.update_bounce_decay()
+
+    def check_tiles(self, level, balls, x, y, radius):
+        """Presses buttons and checks for the end, using the same tiles as
+        tiles_touching_ball(), in the same order.
+
+        Returns the number of every tile in range of each ball, along with
+        whether each one is really touched.
+        """
+        most = radius.max(initial=0.0)
+        span_columns = int(2 * most // constants.TILE_WIDTH) + 2
+        span_rows = int(2 * most // constants.TILE_HEIGHT) + 2
+
+        first_column = numpy.floor_divide(x - radius, constants.TILE_WIDTH)
+        first_row = numpy.floor_divide(y - radius, constants.TILE_HEIGHT)
+        last_column = numpy.floor_divide(x + radius, constants.TILE_WIDTH)
+        last_row = numpy.floor_divide(y + radius, constants.TILE_HEIGHT)
+        columns = first_column[:, None] + numpy.arange(span_columns)
+        rows = first_row[:, None] + numpy.arange(span_rows)
+
+        # how far each tile is from the center of each ball
+        left = columns * constants.TILE_WIDTH
+        top = rows * constants.TILE_HEIGHT
+        gap_x = numpy.maximum(left - x[:, None], 0.0)
+        gap_x = numpy.maximum(gap_x, x[:, None] - left - constants.TILE_WIDTH)
+        gap_y = numpy.maximum(top - y[:, None], 0.0)
+        gap_y = numpy.maximum(gap_y, y[:, None] - top - constants.TILE_HEIGHT)
+
+        column_inside = (columns >= 0) & (columns < world.WIDTH)
+        column_inside &= columns <= last_column[:, None]
+        row_inside = (rows >= 0) & (rows < world.HEIGHT)
+        row_inside &= rows <= last_row[:, None]
+
+        # one row of tiles per ball, a column at a time
+        room = (radius ** 2)[:, None] - gap_x ** 2
+        touching = gap_y[:, None, :] ** 2 < room[:, :, None]
+        touching &= column_inside[:, :, None] & row_inside[:, None, :]
+        touching = touching.reshape(balls.size, -1)
+
+        columns = numpy.clip(columns, 0, world.WIDTH - 1).astype(int)
+        rows = numpy.clip(rows, 0, world.HEIGHT - 1).astype(int)
+        tiles = columns[:, :, None] * world.HEIGHT + rows[:, None, :]
+        tiles = tiles.reshape(balls.size, -1)
+
+        end_column, end_row = level.end_tile
+        at_end = touching & (tiles == end_column * world.HEIGHT + end_row)
+        self.touching_end[balls[at_end.any(axis=1)]] = True
+
+        if level.total_buttons:
+            buttons = numpy.where(touching, level.button_grid[tiles], -1)
+            ball_index, tile_index = numpy.nonzero(buttons >= 0)
+            groups = self.group[balls[ball_index]]
+            self.pressed[groups, buttons[ball_index, tile_index]] = True
+
+        return tiles, touching
+
+    def bounce(self, balls, normal_x, normal_y):
+        """Reflects the velocity of each ball off of a wall, given the unit
+        normals pointing from the walls towards the balls."""
+        x_velocity = self.x_velocity[balls]
+        y_velocity = self.y_velocity[balls]
+        dot = x_velocity * normal_x + y_velocity * normal_y
+        x_velocity = x_velocity - 2.0 * dot * normal_x
+        y_velocity = y_velocity - 2.0 * dot * normal_y
+
+        self.x_velocity[balls] = x_velocity * self.x_bounce_decay[balls]
+        self.y_velocity[balls] = y_velocity * self.y_bounce_decay[balls]
+        self.bounced[balls] = True
+
+    def update_bounce_decay(self):
+        floating = self.floating()
+        grounded = ~floating & (numpy.abs(self.y_velocity) < self.GROUNDED_THRESHOLD)
+
+        x_decay = numpy.where(floating, self.floating_bounce_decay,
+                              self.normal_bounce_decay)
+        y_decay = x_decay.copy()
+        x_decay[grounded] = 0.95
+        y_decay[grounded] = self.y_velocity[grounded] / 2
+
+        awake = self.awake()
+        self.x_bounce_decay = numpy.where(awake, x_decay, self.x_bounce_decay)
+        self.y_bounce_decay = numpy.where(awake, y_decay, self.y_bounce_decay)
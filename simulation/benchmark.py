@@ -0,0 +1,50 @@
+import sys
+
+from simulation import benchmarks
+from simulation.benchmarks import collision
+from simulation.benchmarks import files
+from simulation.benchmarks import memory
+from simulation.benchmarks import stepping
+
+# Run this file to measure how fast the simulation is:
+#     python -m simulation.benchmark [name ...]
+# where each name is one of the keys of BENCHMARKS.  With no names, every
+# benchmark is run.  The benchmarks themselves are in simulation.benchmarks,
+# one module for each part of the game they measure.
+#
+# Benchmarks that compare new code with the code it replaced check() that
+# the results agree within a tolerance, and if any of them don't, the run
+# exits with status 1 once everything has run.
+BENCHMARKS = {
+    "batch": stepping.run_batch,
+    "broadphase": collision.run_broadphase,
+    "spatial": stepping.run_spatial,
+    "store": files.run_store,
+    "repository": files.run_repository,
+    "prefetch": files.run_prefetch,
+    "journal": files.run_journal,
+    "binary": files.run_binary,
+    "startup": files.run_startup,
+    "thumbnails": files.run_thumbnails,
+    "layers": memory.run_layers,
+    "sweep": collision.run_sweep,
+    "check_steps": collision.run_check_steps,
+    "vector": collision.run_vector,
+    "field": collision.run_field,
+    "timestep": stepping.run_timestep,
+    "reset": stepping.run_reset,
+    "predict": stepping.run_predict,
+    "cache": files.run_cache,
+}
+
+
+if __name__ == "__main__":
+    names = sys.argv[1:] or list(BENCHMARKS)
+    for name in names:
+        BENCHMARKS[name]()
+    failures = benchmarks.failures
+    if failures:
+        print("%d checks failed:" % len(failures))
+        for failure in failures:
+            print("  " + failure)
+        sys.exit(1)
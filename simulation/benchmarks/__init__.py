@@ -0,0 +1,64 @@
+import math
+import time
+
+import simulation
+from simulation import physics
+
+# Helpers shared by the benchmarks in this package, which
+# simulation.benchmark runs.  Benchmarks that compare new code with the
+# code it replaced check() that the results agree within a tolerance, and
+# if any of them don't, the run exits with status 1 once everything has
+# run.
+
+failures = []  # the description of every check() that failed
+
+
+def check(passed, description):
+    """Records description as a failure unless passed."""
+    if not passed:
+        print("  FAILED: " + description)
+        failures.append(description)
+
+
+class SteppedBall(simulation.Ball):
+    """A Ball that looks for walls CHECK_STEPS times a frame, instead of
+    finding the first contact exactly."""
+    __slots__ = ()
+    COLLISION = physics.STEPPED
+
+
+class FieldBall(simulation.Ball):
+    """A Ball that reads the level's distance field CHECK_STEPS times a
+    frame, instead of looking at the walls themselves."""
+    __slots__ = ()
+    COLLISION = physics.FIELD
+
+
+def shot_balls(level, angle, ball_type=None, power=12.0):
+    """Returns the balls in play right after the player's first shot, fired
+    at the given angle and power."""
+    player = simulation.new_player(level, ball_type)
+    balls = [player]
+    if player.containing_shells:
+        target = (player.x + math.cos(angle) * 50,
+                  player.y + math.sin(angle) * 50)
+        simulation.shoot([player], balls, target)
+        for ball in balls:
+            ball.x_velocity *= power / 12.0
+            ball.y_velocity *= power / 12.0
+    return balls
+
+
+def shot_angles(count):
+    return [math.pi * 2.0 * (shot / count) for shot in range(count)]
+
+
+def calls_per_second_of(function, calls, seconds):
+    total = 0
+    start = time.perf_counter()
+    elapsed = 0.0
+    while elapsed < seconds:
+        function()
+        total += calls
+        elapsed = time.perf_counter() - start
+    return total / elapsed
@@ -0,0 +1,514 @@
+import glob
+import math
+import os
+import random
+import time
+
+import constants
+import geometry
+import simulation
+from simulation import benchmarks
+from simulation import cache
+from simulation import physics
+from simulation import replay
+from simulation import vector
+from simulation import world
+
+# Benchmarks of how balls find walls: the broadphase, swept collision,
+# adaptive check steps, the vector maths and distance fields.
+
+# vector can only differ from geometry by floating point rounding
+VECTOR_TOLERANCE = 1e-6
+
+# A bouncing ball is chaotic, so checking for walls at all differently
+# changes how some shots end.  Checking once more per frame than always
+# shows how many (the noise floor), and checking adaptively can change at
+# most CHECK_STEPS_TOLERANCE times that many, plus one.
+CHECK_STEPS_TOLERANCE = 2
+
+
+class FixedSteppedBall(benchmarks.SteppedBall):
+    """A SteppedBall that always looks for walls CHECK_STEPS times a frame,
+    however far it's going."""
+    __slots__ = ()
+
+    def check_steps(self, radius, delta_x, delta_y):
+        return self.CHECK_STEPS
+
+
+class FinerSteppedBall(FixedSteppedBall):
+    """A FixedSteppedBall that looks for walls one more time a frame, to
+    show how much any change in where walls are looked for changes the
+    results."""
+    __slots__ = ()
+    CHECK_STEPS = physics.Ball.CHECK_STEPS + 1
+
+
+class CountingSteppedBall(benchmarks.SteppedBall):
+    """A SteppedBall that adds up how many times it looks for walls."""
+    __slots__ = ()
+    checks = 0
+    calls = 0
+
+    def check_steps(self, radius, delta_x, delta_y):
+        steps = benchmarks.SteppedBall.check_steps(self, radius, delta_x,
+                                                   delta_y)
+        CountingSteppedBall.checks += steps
+        CountingSteppedBall.calls += 1
+        return steps
+
+
+def compare_sweep(ball_type, level_nums=None, shots=8, frames=300,
+                  power=12.0):
+    """Fires shots at every level with balls of ball_type, and returns
+    (microseconds of physics.step() per ball per frame, frames where a
+    ball's center went through a wall, ball-frames run)."""
+    if level_nums is None:
+        level_nums = range(world.count_levels())
+
+    elapsed = 0.0
+    tunnels = 0
+    ball_frames = 0
+    for level_num in level_nums:
+        level = simulation.load_level(level_num)
+        walls = level_walls(level)
+        for angle in benchmarks.shot_angles(shots):
+            level = simulation.load_level(level_num)
+            balls = benchmarks.shot_balls(level, angle, ball_type, power)
+            for frame in range(frames):
+                before = [(ball, ball.x, ball.y) for ball in balls]
+                ball_frames += len(balls)
+
+                start = time.perf_counter()
+                simulation.step(level, balls)
+                elapsed += time.perf_counter() - start
+
+                for ball, x, y in before:
+                    if ball.shell_type == physics.GHOST and not ball.is_player:
+                        continue
+                    if crosses_any((x, y), (ball.x, ball.y), walls):
+                        tunnels += 1
+
+    return elapsed / max(ball_frames, 1) * 1e6, tunnels, ball_frames
+
+
+def shot_outcome(level, balls, frames, slowmo_factor=1.0):
+    """Runs a shot, and returns the frames that each button was pressed
+    on, and the first frame the level was beaten on (or None)."""
+    pressed = []
+    for frame in range(frames):
+        for event in simulation.step(level, balls, slowmo_factor):
+            if event[0] == physics.BUTTON_PRESSED:
+                pressed.append((frame, event[2]))
+            elif event[0] == physics.REACHED_END:
+                return pressed, frame
+    return pressed, None
+
+
+def compare_check_steps(ball_type=benchmarks.SteppedBall, level_nums=None,
+                        shots=8, frames=300, slowmo_factor=1.0):
+    """Fires the same shots with FixedSteppedBalls and balls of ball_type,
+    and returns (shots that pressed the same buttons on the same frames
+    and were beaten on the same frame, shots)."""
+    if level_nums is None:
+        level_nums = range(world.count_levels())
+
+    same = 0
+    runs = 0
+    for level_num in level_nums:
+        for angle in benchmarks.shot_angles(shots):
+            outcomes = []
+            for shot_type in (FixedSteppedBall, ball_type):
+                level = simulation.load_level(level_num)
+                balls = benchmarks.shot_balls(level, angle, shot_type)
+                outcomes.append(shot_outcome(level, balls, frames,
+                                             slowmo_factor))
+            runs += 1
+            if outcomes[0] == outcomes[1]:
+                same += 1
+    return same, runs
+
+
+def compare_replay_check_steps(paths, ball_type=benchmarks.SteppedBall):
+    """Plays replays back with FixedSteppedBalls and balls of ball_type,
+    and returns (replays that ended with the same buttons pressed, and
+    beaten or not the same way, replays)."""
+    same = 0
+    for path in paths:
+        outcomes = []
+        for played_type in (FixedSteppedBall, ball_type):
+            game = replay.play(replay.load(path), played_type)
+            outcomes.append((game.level.snapshot_buttons(), game.transition,
+                             game.pause_exit))
+        if outcomes[0] == outcomes[1]:
+            same += 1
+    return same, len(paths)
+
+
+def average_check_steps(level_nums=None, shots=8, frames=300,
+                        slowmo_factor=1.0):
+    """Returns how many times a SteppedBall looks for walls per frame, on
+    average."""
+    if level_nums is None:
+        level_nums = range(world.count_levels())
+
+    CountingSteppedBall.checks = 0
+    CountingSteppedBall.calls = 0
+    for level_num in level_nums:
+        for angle in benchmarks.shot_angles(shots):
+            level = simulation.load_level(level_num)
+            balls = benchmarks.shot_balls(level, angle, CountingSteppedBall)
+            for frame in range(frames):
+                simulation.step(level, balls, slowmo_factor)
+    return CountingSteppedBall.checks / max(CountingSteppedBall.calls, 1)
+
+
+def level_walls(level):
+    walls = set()
+    for column in range(world.WIDTH):
+        for row in range(world.HEIGHT):
+            walls.update(level.tile_to_segments((column, row)))
+    return [(wall.point1, wall.point2) for wall in walls]
+
+
+def crosses_any(start, end, walls):
+    """Returns whether the path from start to end goes through any of the
+    walls, which are (point1, point2) pairs."""
+    for point1, point2 in walls:
+        side1 = cross(point1, point2, start)
+        side2 = cross(point1, point2, end)
+        if side1 * side2 >= 0.0:
+            continue
+        side3 = cross(start, end, point1)
+        side4 = cross(start, end, point2)
+        if side3 * side4 < 0.0:
+            return True
+    return False
+
+
+def cross(origin, point1, point2):
+    return ((point1[0] - origin[0]) * (point2[1] - origin[1]) -
+            (point1[1] - origin[1]) * (point2[0] - origin[0]))
+
+
+def sampled_tiles_touching_ball(radius, ball_center, checks=16):
+    """The old tiles_touching_ball(), which looked up the tiles under a
+    few points around the edge of the ball.  Kept to compare against."""
+    tile_list = []
+
+    center_x, center_y = ball_center
+    for point_num in range(checks):
+        angle = math.pi * 2.0 * (point_num / checks)
+        delta_x, delta_y = geometry.vector_to_difference(angle, radius - 1)
+
+        point = (center_x + delta_x, center_y + delta_y)
+        tile_list.append(world.grid_tile_position(point))
+
+    return set(tile_list)
+
+
+def ball_samples(count, seed=0):
+    """Returns count random (radius, center) pairs covering the level."""
+    generator = random.Random(seed)
+    samples = []
+    for _ in range(count):
+        radius = generator.choice(range(6, 26, 2))
+        center = (generator.uniform(-30.0, constants.SCREEN_WIDTH + 30.0),
+                  generator.uniform(-30.0, constants.SCREEN_HEIGHT + 30.0))
+        samples.append((radius, center))
+    return samples
+
+
+def compare_broadphase(samples):
+    """Returns how many samples the old sampled broadphase found a tile
+    for that tiles_touching_ball() didn't, and how many tiles each found
+    in total."""
+    missed = 0
+    found_sampled = 0
+    found_exact = 0
+    for radius, center in samples:
+        sampled = sampled_tiles_touching_ball(radius, center) - {None}
+        exact = set(world.tiles_touching_ball(radius, center))
+        if not sampled <= exact:
+            missed += 1
+        found_sampled += len(sampled)
+        found_exact += len(exact)
+    return missed, found_sampled, found_exact
+
+
+def calls_per_second(function, samples, seconds):
+    calls = 0
+    start = time.perf_counter()
+    elapsed = 0.0
+    while elapsed < seconds:
+        for radius, center in samples:
+            for tile in function(radius, center):
+                pass
+        calls += len(samples)
+        elapsed = time.perf_counter() - start
+    return calls / elapsed
+
+
+def random_walls_and_points(count, seed=0):
+    """Returns count random (wall points, point, velocity) triples.  Half
+    of the walls lie along the tile grid, like the ones in levels do."""
+    generator = random.Random(seed)
+    samples = []
+    for sample in range(count):
+        if sample % 2:
+            x = generator.randrange(0, 500, constants.TILE_WIDTH)
+            y = generator.randrange(0, 500, constants.TILE_HEIGHT)
+            length = generator.randrange(1, 5) * constants.TILE_WIDTH
+            direction = generator.choice(((1, 0), (0, 1), (1, 1), (1, -1)))
+            point1 = (float(x), float(y))
+            point2 = (float(x + direction[0] * length),
+                      float(y + direction[1] * length))
+        else:
+            point1 = (generator.uniform(0, 500), generator.uniform(0, 500))
+            point2 = (generator.uniform(0, 500), generator.uniform(0, 500))
+        point = (generator.uniform(0, 500), generator.uniform(0, 500))
+        velocity = (generator.uniform(-20, 20), generator.uniform(-20, 20))
+        samples.append((point1, point2, point, velocity))
+    return samples
+
+
+def compare_vector(samples):
+    """Checks the vector module against the geometry functions that the
+    physics used to use.  Returns the largest differences in wall distance,
+    bounced velocity and spin, and how many times they disagreed about
+    whether a wall was flat ground."""
+    distance_error = 0.0
+    bounce_error = 0.0
+    spin_error = 0.0
+    flat_disagreements = 0
+    for point1, point2, point, velocity in samples:
+        segment = geometry.Segment(point1, point2)
+        old_segment = geometry.point_and_segment(point, segment)
+        if not old_segment:
+            continue
+
+        old_segment.slope = -old_segment.slope
+        perpendicular = -geometry.inverse(old_segment.slope)
+        old_bounce = geometry.reflect_vector(perpendicular,
+                                             (velocity[0], -velocity[1]))
+        old_bounce = (old_bounce[0], -old_bounce[1])
+        direction = -math.atan(perpendicular)
+        old_spin = geometry.component_in_direction(
+            geometry.difference_to_vector(velocity), direction)
+        old_flat = abs(perpendicular) < 0.0001
+
+        wall = vector.Wall(point1, point2)
+        distance_squared, offset_x, offset_y = vector.point_and_wall(
+            point[0], point[1], wall)
+        distance = math.sqrt(distance_squared)
+        normal_x = offset_x / distance
+        normal_y = offset_y / distance
+        new_bounce = vector.reflect(velocity[0], velocity[1],
+                                    normal_x, normal_y)
+        new_spin = vector.along_surface(velocity[0], velocity[1],
+                                        normal_x, normal_y)
+        new_flat = vector.is_flat(normal_x, normal_y)
+
+        distance_error = max(distance_error,
+                             abs(distance - old_segment.length))
+        bounce_error = max(bounce_error,
+                           abs(new_bounce[0] - old_bounce[0]),
+                           abs(new_bounce[1] - old_bounce[1]))
+        spin_error = max(spin_error, abs(new_spin - old_spin))
+        if new_flat != old_flat:
+            flat_disagreements += 1
+
+    return distance_error, bounce_error, spin_error, flat_disagreements
+
+
+def compare_field(level_nums=None, samples=2000, seed=0):
+    """Checks each level's distance field against the exact distance to
+    its walls, at random points within 30 pixels of a wall.
+
+    Returns (largest difference in distance, average difference, normals
+    off by more than 0.1, disagreements, points checked).  At each point, a
+    ball of a random radius is checked for touching a wall.  A disagreement
+    is when only one of the two says it does.  The normals are only
+    compared when both say it does, and can be far off around inside
+    corners, where two walls are about as close as each other.
+    """
+    import numpy
+    from simulation import field
+
+    if level_nums is None:
+        level_nums = range(world.count_levels())
+
+    generator = random.Random(seed)
+    largest = 0.0
+    total = 0.0
+    normals_off = 0
+    disagreements = 0
+    checked = 0
+    for level_num in level_nums:
+        level = simulation.load_level(level_num)
+        walls = level_walls(level)
+        if not walls:
+            continue
+        walls = [vector.Wall(point1, point2) for point1, point2 in walls]
+        distance_field = field.DistanceField(field.build_distances(level))
+
+        found = 0
+        while found < samples:
+            x = generator.uniform(0.0, field.PIXELS_WIDE)
+            y = generator.uniform(0.0, field.PIXELS_TALL)
+            nearest = min([vector.point_and_wall(x, y, wall)
+                           for wall in walls], key=lambda near: near[0])
+            distance = math.sqrt(nearest[0])
+            if distance > 30.0 or distance == 0.0:
+                continue
+            found += 1
+
+            inside = field.inside_blocks(level, numpy.array([x]),
+                                         numpy.array([y]))[0]
+            normal_x = nearest[1] / distance
+            normal_y = nearest[2] / distance
+            if inside:
+                distance = -distance
+                normal_x = -normal_x
+                normal_y = -normal_y
+
+            sampled, sampled_x, sampled_y = distance_field.sample(x, y)
+            difference = abs(sampled - distance)
+            largest = max(largest, difference)
+            total += difference
+
+            radius = generator.choice(range(6, 26, 2))
+            if (sampled < radius) != (distance < radius):
+                disagreements += 1
+            elif distance < radius:
+                off = math.hypot(sampled_x - normal_x, sampled_y - normal_y)
+                if off > 0.1:
+                    normals_off += 1
+            checked += 1
+
+    return (largest, total / max(checked, 1), normals_off, disagreements,
+            checked)
+
+
+def time_field(level_num=0):
+    """Returns how many seconds it takes to build a level's field, and to
+    load it from the cache."""
+    import tempfile
+    from simulation import field
+
+    level = simulation.load_level(level_num)
+    with tempfile.TemporaryDirectory() as folder:
+        results = cache.ResultCache(folder)
+        start = time.perf_counter()
+        field.load_field(level, results)
+        built = time.perf_counter() - start
+
+        start = time.perf_counter()
+        field.load_field(level, results)
+        loaded = time.perf_counter() - start
+    return built, loaded
+
+
+def run_broadphase():
+    samples = ball_samples(10000)
+    missed, found_sampled, found_exact = compare_broadphase(samples)
+    print("tiles_touching_ball: %d of %d balls had a sampled tile it missed" %
+          (missed, len(samples)))
+    print("  tiles found: %d sampled, %d exact" % (found_sampled, found_exact))
+    for name, function in (("sampled", sampled_tiles_touching_ball),
+                           ("exact", world.tiles_touching_ball)):
+        rate = calls_per_second(function, samples[:1000], 1.0)
+        print("  %7s: %9.0f calls/s" % (name, rate))
+
+
+def run_sweep():
+    for power in (12.0, 24.0, 48.0):
+        print("launch power %g, every level, 8 shots of 300 frames:" % power)
+        for name, ball_type in (("stepped", benchmarks.SteppedBall),
+                                ("swept", simulation.Ball)):
+            cost, tunnels, ball_frames = compare_sweep(ball_type, power=power)
+            print("  %7s: %6.1f us per ball-frame, %d tunnels in %d "
+                  "ball-frames" % (name, cost, tunnels, ball_frames))
+
+
+def run_check_steps():
+    print("stepped balls, every level, 8 shots of 300 frames, "
+          "at most %d checks a frame:" % physics.Ball.CHECK_STEPS)
+    finer_same, runs = compare_check_steps(FinerSteppedBall)
+    print("  for comparison, always checking %d times: %d of %d shots the same"
+          % (FinerSteppedBall.CHECK_STEPS, finer_same, runs))
+    for slowmo_factor in (1.0, 8.0):
+        same, runs = compare_check_steps(slowmo_factor=slowmo_factor)
+        average = average_check_steps(slowmo_factor=slowmo_factor)
+        print("  slowmo %g: %.2f checks per ball-frame, %d of %d shots the "
+              "same as always checking %d times"
+              % (slowmo_factor, average, same, runs, physics.Ball.CHECK_STEPS))
+        check_check_steps(runs - same, runs - finer_same,
+                          "shots in slowmo %g" % slowmo_factor)
+
+    paths = sorted(glob.glob(os.path.join(replay.REPLAY_FOLDER, "*.replay")))
+    if paths:
+        same, runs = compare_replay_check_steps(paths)
+        finer_same, runs = compare_replay_check_steps(paths, FinerSteppedBall)
+        print("  replays in %s/: %d of %d ended the same way (%d always "
+              "checking %d times)" % (replay.REPLAY_FOLDER, same, runs,
+                                       finer_same,
+                                       FinerSteppedBall.CHECK_STEPS))
+        check_check_steps(runs - same, runs - finer_same, "replays")
+    else:
+        print("  no replays in %s/ to compare" % replay.REPLAY_FOLDER)
+
+
+def check_check_steps(changed, noise, what):
+    allowed = CHECK_STEPS_TOLERANCE * noise + 1
+    benchmarks.check(changed <= allowed,
+                     "adaptive checks changed %d %s, more than the %d allowed"
+                     % (changed, what, allowed))
+
+
+def run_field():
+    built, loaded = time_field()
+    print("distance field: %.0f ms to build, %.1f ms to load from the cache"
+          % (built * 1000, loaded * 1000))
+    largest, average, normals_off, disagreements, checked = compare_field()
+    print("  vs exact walls, within 30 px of one: largest difference %.3f px,"
+          " average %.4f px" % (largest, average))
+    print("  touching a wall or not: %d disagreements in %d random balls"
+          % (disagreements, checked))
+    print("  normals off by more than 0.1 while touching: %d" % normals_off)
+    # build every level's field first, so that only stepping is timed
+    for level_num in range(world.count_levels()):
+        simulation.load_level(level_num).distance_field()
+
+    print("every level, 8 shots of 300 frames:")
+    for name, ball_type in (("stepped", benchmarks.SteppedBall),
+                            ("swept", simulation.Ball),
+                            ("field", benchmarks.FieldBall)):
+        cost, tunnels, ball_frames = compare_sweep(ball_type)
+        print("  %7s: %6.1f us per ball-frame, %d tunnels in %d ball-frames"
+              % (name, cost, tunnels, ball_frames))
+
+
+def run_vector():
+    samples = random_walls_and_points(100000)
+    distance, bounce, spin, flat = compare_vector(samples)
+    print("vector vs geometry, %d random walls and points:" % len(samples))
+    print("  largest difference: %.2g px distance, %.2g px/frame bounce, "
+          "%.2g spin" % (distance, bounce, spin))
+    print("  disagreements about flat ground: %d" % flat)
+    benchmarks.check(max(distance, bounce, spin) <= VECTOR_TOLERANCE,
+                     "vector differs from geometry by more than %g"
+                     % VECTOR_TOLERANCE)
+    benchmarks.check(flat == 0,
+                     "vector and geometry disagree about flat ground")
+
+    walls = [(geometry.Segment(point1, point2), vector.Wall(point1, point2),
+              point) for point1, point2, point, velocity in samples[:1000]]
+    rate = benchmarks.calls_per_second_of(
+        lambda: [geometry.point_and_segment(point, segment)
+                 for segment, wall, point in walls], len(walls), 1.0)
+    print("  geometry.point_and_segment: %9.0f calls/s" % rate)
+    rate = benchmarks.calls_per_second_of(
+        lambda: [vector.point_and_wall(point[0], point[1], wall)
+                 for segment, wall, point in walls], len(walls), 1.0)
+    print("      vector.point_and_wall: %9.0f calls/s" % rate)
@@ -0,0 +1,496 @@
+import math
+import os
+import random
+import shutil
+import tempfile
+import time
+
+import simulation
+from simulation import benchmarks
+from simulation import binary
+from simulation import cache
+from simulation import physics
+from simulation import prefetch
+from simulation import repository
+from simulation import store
+from simulation import thumbnail
+from simulation import world
+
+# Benchmarks of reading and writing levels: the store, the repository,
+# prefetching, the journal, binary packs, startup, thumbnails and the
+# result cache.
+
+
+def time_cache(level_nums=None):
+    """Works out every level's mesh and distance field twice, with an
+    empty ResultCache and then a full one.  Returns ({kind: (seconds
+    empty, seconds full)}, the cache's report())."""
+    from simulation import field
+
+    if level_nums is None:
+        level_nums = range(world.count_levels())
+    levels = [simulation.load_level(level_num) for level_num in level_nums]
+
+    times = {}
+    with tempfile.TemporaryDirectory() as folder:
+        results = cache.ResultCache(folder)
+        makers = ((cache.MESH, lambda level: level.build_mesh(results)),
+                  (cache.FIELD,
+                   lambda level: field.load_field(level, results)))
+        for kind, make in makers:
+            seconds = []
+            for _ in range(2):
+                start = time.perf_counter()
+                for level in levels:
+                    make(level)
+                seconds.append(time.perf_counter() - start)
+            times[kind] = tuple(seconds)
+        return times, results.report()
+
+
+def write_pack(path, level_count, seed=0):
+    """Writes a level file of level_count levels, picked at random from
+    the shipped ones."""
+    file = open(world.LEVEL_FILE, 'r')
+    level_strings = file.read().split(world.LEVEL_SEPARATOR)
+    file.close()
+
+    generator = random.Random(seed)
+    pack = [generator.choice(level_strings) for _ in range(level_count)]
+    file = open(path, 'w')
+    file.write(world.LEVEL_SEPARATOR.join(pack))
+    file.close()
+
+
+def read_split(path):
+    """Reads the level file the way levels.py used to, every time."""
+    file = open(path, 'r')
+    level_array = file.read().split(world.LEVEL_SEPARATOR)
+    file.close()
+    return level_array
+
+
+def time_store(path, reads=200, saves=5, seed=0):
+    """Returns seconds per call of (counting the levels, reading a random
+    level's string, saving a random level), first by reading and splitting
+    the whole file, then through a LevelStore.  Also returns how long the
+    store took to index the file the first time."""
+    generator = random.Random(seed)
+    count = len(read_split(path))
+    level_nums = [generator.randrange(count) for _ in range(reads)]
+
+    start = time.perf_counter()
+    for _ in range(reads):
+        len(read_split(path))
+    old_count = (time.perf_counter() - start) / reads
+
+    start = time.perf_counter()
+    for level_num in level_nums:
+        read_split(path)[level_num]
+    old_read = (time.perf_counter() - start) / reads
+
+    start = time.perf_counter()
+    for level_num in level_nums[:saves]:
+        level_array = read_split(path)
+        file = open(path, 'w')
+        file.write(world.LEVEL_SEPARATOR.join(level_array))
+        file.close()
+    old_save = (time.perf_counter() - start) / saves
+
+    level_store = store.LevelStore(path)
+    start = time.perf_counter()
+    level_store.refresh()
+    indexed = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for _ in range(reads):
+        level_store.count()
+    new_count = (time.perf_counter() - start) / reads
+
+    start = time.perf_counter()
+    for level_num in level_nums:
+        level_store.level_string(level_num)
+    new_read = (time.perf_counter() - start) / reads
+
+    start = time.perf_counter()
+    for level_num in level_nums[:saves]:
+        level_store.replace(level_num, level_store.level_string(level_num))
+    new_save = (time.perf_counter() - start) / saves
+    level_store.close()
+
+    return (old_count, old_read, old_save), (new_count, new_read, new_save), \
+        indexed
+
+
+def run_store():
+    folder = tempfile.mkdtemp()
+    try:
+        # saving is timed too, so even levels.txt is copied first
+        path = os.path.join(folder, "levels.txt")
+        shutil.copy(world.LEVEL_FILE, path)
+        packs = [("levels.txt", path)]
+        for level_count in (1000, 10000):
+            path = os.path.join(folder, "%d levels.txt" % level_count)
+            write_pack(path, level_count)
+            packs.append(("%d levels" % level_count, path))
+
+        for name, path in packs:
+            old, new, indexed = time_store(path)
+            print("%s (%d levels, %.1f MB), indexed in %.2f ms:"
+                  % (name, len(read_split(path)),
+                     os.path.getsize(path) / 1e6, indexed * 1000))
+            for label, old_time, new_time in zip(("count", "read", "save"),
+                                                 old, new):
+                print("  %5s: %9.3f ms reading the whole file, %8.3f ms "
+                      "with the index" % (label, old_time * 1000,
+                                         new_time * 1000))
+    finally:
+        shutil.rmtree(folder)
+
+
+def play_through(load, level_count, plays=2):
+    """Loads levels the way the game does when playing through every
+    level plays times: the transition loads the next level to find its
+    start, then the play screen loads it again."""
+    for _ in range(plays):
+        for level_num in range(level_count):
+            load(level_num)
+            load(level_num)
+
+
+def time_repository(path, saves=20, seed=0):
+    """Returns (seconds per load without a repository, seconds per load
+    with one, the repository's hit rate, the bytes it keeps, seconds per
+    save written straight away, seconds per save written in one batch)."""
+    level_store = store.LevelStore(path)
+    level_count = level_store.count()
+    loads = level_count * 4
+
+    start = time.perf_counter()
+    play_through(lambda level_num: level_store.load(level_num, world.Level()),
+                 level_count)
+    old_load = (time.perf_counter() - start) / loads
+
+    levels = repository.LevelRepository(level_store)
+    start = time.perf_counter()
+    play_through(levels.load, level_count)
+    new_load = (time.perf_counter() - start) / loads
+
+    # saving used to load the old level to forget its cache entries, then
+    # write the file
+    generator = random.Random(seed)
+    level_nums = [generator.randrange(level_count) for _ in range(saves)]
+    start = time.perf_counter()
+    for level_num in level_nums:
+        old_level = level_store.load(level_num, world.Level())
+        cache.shared.invalidate(cache.level_key(old_level))
+        level_store.replace(level_num, old_level.to_string())
+    old_save = (time.perf_counter() - start) / saves
+
+    edited = [levels.load(level_num) for level_num in level_nums]
+    start = time.perf_counter()
+    for level_num, level in zip(level_nums, edited):
+        levels.save(level_num, level, flush=False)
+    levels.flush()
+    new_save = (time.perf_counter() - start) / saves
+
+    results = (old_load, new_load, levels.hit_rate(), levels.memory_bytes(),
+               old_save, new_save)
+    level_store.close()
+    return results
+
+
+def time_transitions(path, prefetching, ball_type=simulation.Ball):
+    """Plays through every level in the file at path, with a new
+    repository and an empty cache, and returns the seconds the main thread
+    spent getting each next level ready to play balls of ball_type, the
+    way the game's level to level transition does."""
+    level_store = store.LevelStore(path)
+    levels = repository.LevelRepository(level_store)
+    prefetcher = prefetch.Prefetcher(levels, ball_type)
+
+    def load(level_num):
+        prefetched = None
+        if prefetching:
+            prefetched = prefetcher.take(level_num)
+        if prefetched is None:
+            level = levels.load(level_num)
+            if ball_type.COLLISION == physics.FIELD:
+                level.distance_field()
+        if prefetching:
+            prefetcher.start(level_num + 1)
+
+    times = []
+    for level_num in range(levels.count()):
+        start = time.perf_counter()
+        load(level_num)
+        times.append(time.perf_counter() - start)
+        if prefetcher.thread is not None:
+            prefetcher.thread.join()  # the level is played meanwhile
+    level_store.close()
+    return times[1:]  # nothing's prefetched before the first level
+
+
+def time_thumbnails(path, page_size=18):
+    """Returns the seconds taken to get the thumbnail masks of a page of
+    levels ready for (a new cache, where each level's block layer has to be
+    read, and the same cache again after the game restarts)."""
+    folder = tempfile.mkdtemp()
+    try:
+        results = cache.ResultCache(folder)
+        times = []
+        for _ in range(2):
+            level_store = store.LevelStore(path)
+            masks = thumbnail.ThumbnailMasks(
+                repository.LevelRepository(level_store), results)
+            start = time.perf_counter()
+            masks.load(range(page_size))
+            times.append(time.perf_counter() - start)
+            level_store.close()
+    finally:
+        shutil.rmtree(folder)
+    return times
+
+
+def time_saves(path, saves=20, seed=0):
+    """Returns seconds per save of a random level for (rewriting the whole
+    file like saving used to, rewriting it into a temporary file that
+    replaces it, appending to the journal), and then the seconds taken to
+    compact the journal."""
+    level_store = store.LevelStore(path)
+    count = level_store.count()
+    generator = random.Random(seed)
+    level_nums = [generator.randrange(count) for _ in range(saves)]
+
+    start = time.perf_counter()
+    for level_num in level_nums:
+        level_array = read_split(path)
+        file = open(path, 'w')
+        file.write(world.LEVEL_SEPARATOR.join(level_array))
+        file.close()
+    rewrite = (time.perf_counter() - start) / saves
+
+    start = time.perf_counter()
+    for level_num in level_nums:
+        store.write_atomically(path, level_store.contents())
+    atomic = (time.perf_counter() - start) / saves
+
+    # big enough that nothing is compacted until it's timed
+    compact_bytes = store.COMPACT_BYTES
+    store.COMPACT_BYTES = math.inf
+    try:
+        start = time.perf_counter()
+        for level_num in level_nums:
+            level_store.replace(level_num, level_store.level_string(level_num))
+        journal = (time.perf_counter() - start) / saves
+    finally:
+        store.COMPACT_BYTES = compact_bytes
+
+    start = time.perf_counter()
+    level_store.compact()
+    compaction = time.perf_counter() - start
+    level_store.close()
+    return rewrite, atomic, journal, compaction
+
+
+def time_formats(text_path, folder):
+    """Converts a level file into a pack and a compressed pack, and reads
+    every level from each.  Returns a list of (name, file size, seconds
+    per level read without building its mesh)."""
+    file = open(text_path, 'r')
+    text = file.read()
+    file.close()
+
+    paths = [("text", text_path)]
+    for name, compress in (("pack", False), ("compressed", True)):
+        path = os.path.join(folder, name + ".rslv")
+        file = open(path, 'wb')
+        file.write(binary.text_to_pack(text, compress))
+        file.close()
+        paths.append((name, path))
+
+    results = []
+    for name, path in paths:
+        level_store = store.LevelStore(path)
+        count = level_store.count()
+        level = world.Level()
+        start = time.perf_counter()
+        if level_store.is_pack:
+            for level_num in range(count):
+                binary.read_record(level_store.record(level_num), level)
+        else:
+            for level_num in range(count):
+                world.read_level_string(level_store.level_string(level_num),
+                                        level)
+        seconds = (time.perf_counter() - start) / count
+        results.append((name, os.path.getsize(path), seconds))
+        level_store.close()
+    return results
+
+
+def time_startup(path, repeats=3):
+    """Returns the fastest seconds taken to read every block layer in a
+    level file, for each way of reading them: a whole level each with its
+    mesh, like the main menu used to, a whole level each without a mesh,
+    and only the block layer of each level, like thumbnails do."""
+    def with_meshes(level_store):
+        return [world.string_to_level(string).layers[world.LAYER_BLOCKS]
+                for string in level_store.level_strings()]
+
+    def without_meshes(level_store):
+        return [world.read_level_string(string).layers[world.LAYER_BLOCKS]
+                for string in level_store.level_strings()]
+
+    def blocks_only(level_store):
+        return [world.read_layer_string(string, world.LAYER_BLOCKS)
+                for string in level_store.level_strings()]
+
+    times = []
+    for read in (with_meshes, without_meshes, blocks_only):
+        fastest = math.inf
+        for _ in range(repeats):
+            level_store = store.LevelStore(path)
+            start = time.perf_counter()
+            read(level_store)
+            fastest = min(fastest, time.perf_counter() - start)
+            level_store.close()
+        times.append(fastest)
+    return times
+
+
+def run_journal():
+    folder = tempfile.mkdtemp()
+    try:
+        path = os.path.join(folder, "levels.txt")
+        shutil.copy(world.LEVEL_FILE, path)
+        packs = [("levels.txt", path)]
+        for level_count in (1000, 10000):
+            path = os.path.join(folder, "%d levels.txt" % level_count)
+            write_pack(path, level_count)
+            packs.append(("%d levels" % level_count, path))
+
+        print("saving a level, ms per save:")
+        print("  %-14s %8s %10s %10s %10s %12s"
+              % ("", "MB", "rewrite", "atomic", "journal", "compaction"))
+        for name, path in packs:
+            size = os.path.getsize(path) / 1e6
+            rewrite, atomic, journal, compaction = time_saves(path)
+            print("  %-14s %8.1f %10.2f %10.2f %10.2f %12.2f"
+                  % (name, size, rewrite * 1e3, atomic * 1e3, journal * 1e3,
+                     compaction * 1e3))
+    finally:
+        shutil.rmtree(folder)
+
+
+def run_repository():
+    folder = tempfile.mkdtemp()
+    shared = cache.shared
+    try:
+        path = os.path.join(folder, "levels.txt")
+        shutil.copy(world.LEVEL_FILE, path)
+        # saving forgets cache entries, so the real ones are left alone
+        cache.shared = cache.ResultCache(os.path.join(folder, "cache"))
+        for level_num in range(world.count_levels(path)):
+            world.load_level(level_num, path)
+
+        old_load, new_load, hit_rate, memory, old_save, new_save = \
+            time_repository(path)
+        print("playing through levels.txt twice, each level loaded twice:")
+        print("  without a repository: %6.2f ms per load" % (old_load * 1e3))
+        print("  with a repository:    %6.2f ms per load, %.0f%% hits, "
+              "%.0f KB kept for %d levels"
+              % (new_load * 1e3, hit_rate * 100, memory / 1024,
+                 repository.MAX_LEVELS))
+        print("saving 20 levels:")
+        print("  written straight away: %6.2f ms per save" % (old_save * 1e3))
+        print("  written in one batch:  %6.2f ms per save" % (new_save * 1e3))
+    finally:
+        cache.shared = shared
+        shutil.rmtree(folder)
+
+
+def run_prefetch():
+    shared = cache.shared
+    print("main thread time to get the next level ready, playing through "
+          "levels.txt:")
+    try:
+        for ball_type, name in ((simulation.Ball, "swept"),
+                                (benchmarks.FieldBall, "field")):
+            print("  %s balls:" % name)
+            for prefetching in (False, True):
+                folder = tempfile.mkdtemp()
+                try:
+                    cache.shared = cache.ResultCache(folder)
+                    times = time_transitions(world.LEVEL_FILE, prefetching,
+                                             ball_type)
+                finally:
+                    shutil.rmtree(folder)
+                print("    %-20s %7.2f ms on average, %7.2f ms at worst"
+                      % ("prefetched:" if prefetching
+                         else "loaded when needed:",
+                         sum(times) / len(times) * 1000, max(times) * 1000))
+    finally:
+        cache.shared = shared
+
+
+def run_thumbnails():
+    folder = tempfile.mkdtemp()
+    try:
+        packs = [("levels.txt", world.LEVEL_FILE)]
+        path = os.path.join(folder, "10000 levels.txt")
+        write_pack(path, 10000)
+        packs.append(("10000 levels", path))
+
+        print("getting the thumbnails of a page of 18 levels ready:")
+        for name, path in packs:
+            new, cached = time_thumbnails(path)
+            print("  %-14s %6.2f ms made from the levels, %6.2f ms from "
+                  "the cache" % (name, new * 1e3, cached * 1e3))
+    finally:
+        shutil.rmtree(folder)
+
+
+def run_binary():
+    folder = tempfile.mkdtemp()
+    try:
+        pack_path = os.path.join(folder, "10000 levels.txt")
+        write_pack(pack_path, 10000)
+        for name, path in (("levels.txt", world.LEVEL_FILE),
+                           ("10000 levels", pack_path)):
+            print("%s, reading every level:" % name)
+            for format_name, size, seconds in time_formats(path, folder):
+                print("  %10s: %9d bytes, %6.1f us per level"
+                      % (format_name, size, seconds * 1e6))
+    finally:
+        shutil.rmtree(folder)
+
+
+def run_startup():
+    folder = tempfile.mkdtemp()
+    try:
+        big_path = os.path.join(folder, "1000 levels.txt")
+        write_pack(big_path, 1000)
+        # so that the meshes come out of the cache, like they usually do
+        for level_num in range(world.count_levels()):
+            simulation.load_level(level_num)
+
+        for name, path in (("levels.txt", world.LEVEL_FILE),
+                           ("1000 levels", big_path)):
+            meshes, no_meshes, blocks_only = time_startup(path)
+            print("%s, reading every block layer for the main menu:" % name)
+            print("  level by level, with meshes:  %7.1f ms" % (meshes * 1e3))
+            print("  level by level, no meshes:    %7.1f ms"
+                  % (no_meshes * 1e3))
+            print("  block layers only:            %7.1f ms"
+                  % (blocks_only * 1e3))
+    finally:
+        shutil.rmtree(folder)
+
+
+def run_cache():
+    times, report = time_cache()
+    print("every level, worked out with an empty cache and then a full one:")
+    for kind, (empty, full) in sorted(times.items()):
+        print("  %5s: %7.1f ms empty, %6.1f ms full"
+              % (kind, empty * 1000, full * 1000))
+    print("  " + report)
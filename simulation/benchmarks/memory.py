@@ -0,0 +1,81 @@
+import simulation
+from simulation import benchmarks
+from simulation import repository
+from simulation import world
+
+# Benchmarks of how levels are kept in memory.
+
+
+class ListLayer(world.Layer):
+    """A Layer kept as a list of columns of tiles, like layers used to be,
+    to compare with."""
+    grid = None
+
+    def __init__(self, layer=None):
+        if layer is None:
+            layer = world.Layer()
+        self.grid = layer.grid
+
+    def tile_at(self, tile_position):
+        if world.out_of_bounds(tile_position):
+            return None
+        return self.grid[tile_position[0]][tile_position[1]]
+
+
+def layer_memory(level_nums=None):
+    """Returns the average bytes per level of (its layers and pressed
+    buttons kept as lists, the same kept as bytes and a bitset, the whole
+    level)."""
+    if level_nums is None:
+        level_nums = range(world.count_levels())
+
+    totals = [0, 0, 0]
+    for level_num in level_nums:
+        level = simulation.load_level(level_num)
+        lists = [ListLayer(layer) for layer in level.layers]
+        lists.append([[False] * world.HEIGHT for _ in range(world.WIDTH)])
+        totals[0] += repository.size_of(lists, set())
+        totals[1] += repository.size_of([level.layers, level.pressed_bits],
+                                        set())
+        totals[2] += repository.size_of(level, set())
+    return [total / len(level_nums) for total in totals]
+
+
+def tile_at_calls(layer, seconds=1.0):
+    positions = [(column, row) for column in range(-1, world.WIDTH + 1)
+                 for row in range(-1, world.HEIGHT + 1)]
+    tile_at = layer.tile_at
+
+    def look_at_every_tile():
+        for position in positions:
+            tile_at(position)
+
+    return benchmarks.calls_per_second_of(look_at_every_tile, len(positions),
+                                          seconds)
+
+
+def snapshots_per_second(level, seconds=1.0):
+    """Returns how many times a second the level's buttons can be
+    snapshotted and restored."""
+    level.press(next(iter(tile for tile in world.TILE_INDEXES
+                          if level.is_button(tile))))
+
+    def snapshot_and_restore():
+        level.restore_buttons(level.snapshot_buttons())
+
+    return benchmarks.calls_per_second_of(snapshot_and_restore, 1, seconds)
+
+
+def run_layers():
+    lists, arrays, whole = layer_memory()
+    print("layers and pressed buttons, per level: %.0f bytes as lists, "
+          "%.0f bytes as bytes and a bitset (%.0f bytes for the whole level)"
+          % (lists, arrays, whole))
+    level = simulation.load_level(20)
+    blocks = level.layers[world.LAYER_BLOCKS]
+    print("tile_at(), including out of bounds: %.2f M calls/s as lists, "
+          "%.2f M calls/s as bytes"
+          % (tile_at_calls(ListLayer(blocks)) / 1e6,
+             tile_at_calls(blocks) / 1e6))
+    print("snapshotting and restoring buttons: %.2f M times/s"
+          % (snapshots_per_second(level) / 1e6))
@@ -0,0 +1,348 @@
+import copy
+import math
+import random
+import time
+import tracemalloc
+
+import simulation
+from simulation import benchmarks
+from simulation import physics
+from simulation import predict
+from simulation import spatial
+from simulation import timestep
+from simulation import world
+
+# Benchmarks of stepping balls: the batch stepper, spatial hashing, the
+# fixed timestep, restarting levels and prediction.
+
+
+def compare_batch(level_nums=None, shots=8, frames=300):
+    """Runs the same shots through physics.step() with STEPPED balls, the
+    only collision mode a BallBatch does, and through a BallBatch, and
+    returns (runs that matched, runs, largest difference in position seen
+    before the first frame where a run stopped matching)."""
+    from simulation import batch
+
+    if level_nums is None:
+        level_nums = range(world.count_levels())
+
+    matched = 0
+    runs = 0
+    largest = 0.0
+    for level_num in level_nums:
+        for angle in benchmarks.shot_angles(shots):
+            level = simulation.load_level(level_num)
+            balls = benchmarks.shot_balls(level, angle, benchmarks.SteppedBall)
+            in_play = list(balls)
+            balls_batch = batch.from_balls(balls)
+            level_batch = batch.BatchLevel(level)
+
+            runs += 1
+            for frame in range(frames):
+                simulation.step(level, in_play)
+                balls_batch.step(level_batch)
+
+                difference = 0.0
+                for index, ball in enumerate(balls):
+                    if ball in in_play:
+                        difference = max(difference,
+                                         abs(ball.x - balls_batch.x[index]),
+                                         abs(ball.y - balls_batch.y[index]))
+                if difference > batch.TOLERANCE:
+                    break
+                largest = max(largest, difference)
+            else:
+                matched += 1
+
+    return matched, runs, largest
+
+
+def benchmark_batch(counts=(1, 100, 10000), level_num=0, seconds=1.0):
+    """Returns a list of (ball count, steps per second) pairs for a
+    BallBatch stepping that many balls through one level."""
+    from simulation import batch
+
+    level = simulation.load_level(level_num)
+    level_batch = batch.BatchLevel(level)
+
+    results = []
+    for count in counts:
+        balls = []
+        groups = []
+        for shot, angle in enumerate(benchmarks.shot_angles(count)):
+            new_balls = benchmarks.shot_balls(level, angle)
+            balls += new_balls
+            groups += [shot] * len(new_balls)
+        balls = balls[:count]
+        groups = groups[:count]
+
+        balls_batch = batch.from_balls(balls, groups)
+        results.append((count, steps_per_second(balls_batch.step,
+                                                level_batch, seconds)))
+    return results
+
+
+def steps_per_second(step, level, seconds):
+    steps = 0
+    start = time.perf_counter()
+    elapsed = 0.0
+    while elapsed < seconds:
+        step(level)
+        steps += 1
+        elapsed = time.perf_counter() - start
+    return steps / elapsed
+
+
+def crowd(level, count, seed=0):
+    """Returns count normal balls scattered over the level's open tiles,
+    flying in random directions."""
+    generator = random.Random(seed)
+    open_tiles = [(column, row) for column in range(world.WIDTH)
+                  for row in range(world.HEIGHT)
+                  if not level.is_solid((column, row))]
+    balls = []
+    for _ in range(count):
+        x, y = world.middle_pixel(generator.choice(open_tiles))
+        ball = simulation.Ball((x, y), generator.choice(range(6, 16, 2)),
+                               physics.NORMAL)
+        ball.launch(generator.uniform(0.0, math.pi * 2.0),
+                    generator.uniform(0.0, 12.0))
+        balls.append(ball)
+    return balls
+
+
+def time_crowd(count, level_num=20, frames=30):
+    """Steps count balls in a level, and returns microseconds per ball per
+    frame of (physics.step(), rebuilding a SpatialHash, finding balls on
+    buttons and the end with it, finding touching balls with it, finding
+    touching balls by checking every pair), and whether both ways of
+    finding touching balls agreed on every frame."""
+    level = simulation.load_level(level_num)
+    balls = crowd(level, count)
+    grid = spatial.SpatialHash()
+    times = [0.0] * 5
+    agreed = True
+    ball_frames = 0
+    for _ in range(frames):
+        ball_frames += len(balls)
+        start = time.perf_counter()
+        simulation.step(level, balls)
+        times[0] += time.perf_counter() - start
+
+        start = time.perf_counter()
+        grid.rebuild(balls)
+        times[1] += time.perf_counter() - start
+
+        start = time.perf_counter()
+        grid.balls_on_buttons(level)
+        grid.balls_on_end(level)
+        times[2] += time.perf_counter() - start
+
+        start = time.perf_counter()
+        pairs = grid.touching_pairs()
+        times[3] += time.perf_counter() - start
+
+        start = time.perf_counter()
+        slow_pairs = spatial.touching_pairs_slowly(balls)
+        times[4] += time.perf_counter() - start
+
+        # the grid can miss pairs that only touch outside of the level
+        found = set(map(frozenset, pairs))
+        if not found <= set(map(frozenset, slow_pairs)):
+            agreed = False
+        for pair in slow_pairs:
+            if touch_in_level(*pair) and frozenset(pair) not in found:
+                agreed = False
+
+    ball_frames = max(ball_frames, 1)
+    return [seconds / ball_frames * 1e6 for seconds in times], agreed
+
+
+def touch_in_level(ball, other):
+    """Returns whether two touching balls overlap at a point inside the
+    level, where SpatialHash has cells."""
+    radius = other.collision_radius()
+    reach = ball.collision_radius() + radius
+    x = other.x + (ball.x - other.x) * (radius / reach)
+    y = other.y + (ball.y - other.y) * (radius / reach)
+    return 0.0 <= x < world.PIXEL_WIDTH and 0.0 <= y < world.PIXEL_HEIGHT
+
+
+def faster_than_real_time(level_nums=None, shots=8, seconds=5.0):
+    """Runs every shot for seconds of game time without drawing, and
+    returns how many seconds of game time were run per real second."""
+    if level_nums is None:
+        level_nums = range(world.count_levels())
+
+    game_time = 0.0
+    start = time.perf_counter()
+    for level_num in level_nums:
+        for angle in benchmarks.shot_angles(shots):
+            level = simulation.load_level(level_num)
+            balls = benchmarks.shot_balls(level, angle)
+            steps = timestep.run_steps(
+                lambda: simulation.step(level, balls), seconds)
+            game_time += steps * timestep.STEP
+    return game_time / (time.perf_counter() - start)
+
+
+def schedule_frames(frame_seconds, speed=1.0, seed=0):
+    """Feeds a FixedStep frames that take frame_seconds each, give or take
+    a quarter, for one minute of real time.  Returns (steps per frame,
+    game time run divided by real time, the most steps in one frame)."""
+    randomizer = random.Random(seed)
+    fixed_step = timestep.FixedStep(speed)
+    real_time = 0.0
+    most = 0
+    while real_time < 60.0:
+        seconds = frame_seconds * randomizer.uniform(0.75, 1.25)
+        real_time += seconds
+        most = max(most, fixed_step.advance(seconds))
+    game_time = fixed_step.steps * timestep.STEP
+    return fixed_step.sim_ratio(), game_time / real_time, most
+
+
+def reset_times(level_num=20, resets=20000):
+    """Returns the microseconds that restarting a level takes, first by
+    deep copying the player and making a new pressed_grid, then with
+    snapshots."""
+    level = simulation.load_level(level_num)
+    player = simulation.new_player(level)
+
+    start = time.perf_counter()
+    for _ in range(resets):
+        balls = [copy.deepcopy(player)]
+        # levels used to keep a list of lists of bools for their buttons
+        pressed_grid = [[False] * world.HEIGHT for _ in range(world.WIDTH)]
+        level.pressed_buttons = 0
+    copied = time.perf_counter() - start
+    copied_state = balls[0].snapshot()
+
+    state = player.snapshot()
+    buttons = level.snapshot_buttons()
+    start = time.perf_counter()
+    for _ in range(resets):
+        balls = [simulation.Ball.from_snapshot(state)]
+        level.restore_buttons(buttons)
+    restored = time.perf_counter() - start
+
+    benchmarks.check(balls[0].snapshot() == copied_state,
+                     "restarting from a snapshot makes a different player")
+    benchmarks.check(level.pressed_grid == pressed_grid
+                     and level.pressed_buttons == 0,
+                     "restarting from a snapshot leaves buttons pressed")
+
+    return copied / resets * 1000000, restored / resets * 1000000
+
+
+def bytes_per_ball(count=10000):
+    tracemalloc.start()
+    balls = [simulation.Ball((250.0, 250.0), 6, physics.NORMAL)
+             for _ in range(count)]
+    used = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return used / len(balls)
+
+
+def time_predictions(level_nums=None, shots=8, frames=60):
+    """Aims at each level for frames frames, turning a little each frame,
+    and times every Predictor.update().  Returns (the update times in
+    seconds, predictions started, frames until the first prediction was
+    done for each aim, times the game's state was changed)."""
+    if level_nums is None:
+        level_nums = range(world.count_levels())
+
+    update_times = []
+    started = 0
+    frames_to_finish = []
+    changed = 0
+    for level_num in level_nums:
+        level = simulation.load_level(level_num)
+        player = simulation.new_player(level)
+        state = player.snapshot()
+        buttons = level.snapshot_buttons()
+        for angle in benchmarks.shot_angles(shots):
+            predictor = predict.Predictor()
+            finished = None
+            for frame in range(frames):
+                # turning about as fast as a ball turns in slowmo
+                aim = angle + frame * 0.002
+                target = (player.x + math.cos(aim) * 50,
+                          player.y + math.sin(aim) * 50)
+                prediction = predictor.prediction
+
+                start = time.perf_counter()
+                predictor.update(level, [player], target)
+                update_times.append(time.perf_counter() - start)
+
+                if predictor.prediction is not prediction:
+                    started += 1
+                if finished is None and predictor.prediction.done():
+                    finished = frame + 1
+            frames_to_finish.append(finished)
+
+            if player.snapshot() != state:
+                changed += 1
+            if level.snapshot_buttons() != buttons:
+                changed += 1
+    return update_times, started, frames_to_finish, changed
+
+
+def run_batch():
+    matched, runs, largest = compare_batch()
+    print("batch vs physics.step, STEPPED collision only (the game uses "
+          "SWEPT): %d of %d runs match for 300 frames" % (matched, runs))
+    print("  largest difference while matching: %.2g px" % largest)
+    for count, rate in benchmark_batch():
+        print("  %6d balls: %9.1f steps/s, %12.0f ball-steps/s" %
+              (count, rate, rate * count))
+
+
+def run_spatial():
+    print("balls flying around level 21, microseconds per ball per frame:")
+    print("  balls     step  rebuild  buttons  touching  every pair")
+    for count in (1, 10, 100, 1000):
+        times, agreed = time_crowd(count)
+        if agreed:
+            agreement = ""
+        else:
+            agreement = "  (DIFFERENT touching balls)"
+        print("  %5d %8.1f %8.2f %8.2f %9.2f %11.2f%s"
+              % ((count,) + tuple(times) + (agreement,)))
+
+
+def run_timestep():
+    print("fixed steps of %.1f ms, one minute of frames:" %
+          (timestep.STEP * 1000))
+    for fps, speed in ((144, 1.0), (60, 1.0), (30, 1.0), (60, 4.0)):
+        ratio, pace, most = schedule_frames(1.0 / fps, speed)
+        print("  %3d fps at %gx speed: %.2f steps per frame (at most %d), "
+              "%.3fx real time" % (fps, speed, ratio, most, pace))
+    pace = faster_than_real_time()
+    print("  without drawing, every level, 8 shots of 5 s: %.0fx real time"
+          % pace)
+
+
+def run_reset():
+    copied, restored = reset_times()
+    print("restarting a level: %.1f us with deepcopy, %.1f us from snapshots"
+          % (copied, restored))
+    print("  %.0f bytes per ball" % bytes_per_ball())
+
+
+def run_predict():
+    update_times, started, frames_to_finish, changed = time_predictions()
+    update_times.sort()
+    middle = update_times[len(update_times) // 2]
+    high = update_times[len(update_times) * 99 // 100]
+    print("predicting %d frames ahead, every level, 8 aims of 60 frames:"
+          % predict.FRAMES)
+    print("  Predictor.update(): median %.2f ms, 99th percentile %.2f ms, "
+          "budget %.1f ms"
+          % (middle * 1000, high * 1000, predict.BUDGET * 1000))
+    print("  %d predictions started for %d updates"
+          % (started, len(update_times)))
+    print("  updates until the first prediction was done: at most %d, "
+          "average %.2f" % (max(frames_to_finish),
+                            sum(frames_to_finish) / len(frames_to_finish)))
+    print("  times the player or buttons were changed: %d" % changed)
@@ -0,0 +1,200 @@
+import struct
+import sys
+import time
+import zlib
+
+from simulation import world
+
+# A level pack is the same levels as a level file, in a binary format that
+# is smaller and quicker to read.  It starts with a HEADER, then where each
+# level's record starts as an OFFSET from the start of the file, then one
+# more OFFSET for the end of the last record, then the records themselves.
+#
+# A record is a RECORD_HEADER (the start and end tiles, and how many
+# shells there are), one byte per shell, then one byte per tile of each
+# layer, column by column like in levels.txt.  In a COMPRESSED pack, every
+# record is zlib compressed on its own, so that one level can still be read
+# without the others.
+#
+# Packs convert to and from level files without losing anything:
+#     python -m simulation.binary IN OUT [--compress]
+# turns a level file into a pack, or a pack into a level file, depending on
+# what IN is.  world.load_level() and levels.load_level() read either kind,
+# telling them apart by the MAGIC at the start of packs.
+MAGIC = b"RSLV"
+FORMAT_VERSION = 1
+HEADER = struct.Struct("<4sBBI")  # magic, version, flags, level count
+OFFSET = struct.Struct("<I")
+RECORD_HEADER = struct.Struct("<BBBBB")  # start column and row, end column
+                                         # and row, shell count
+
+# the header flags
+COMPRESSED = 1
+
+TILES = world.WIDTH * world.HEIGHT
+# the tile bytes, as the strings they are in level files
+TILE_STRINGS = [str(tile) for tile in range(256)]
+
+
+def is_pack(data):
+    """Returns whether data, the start of a file, is a level pack."""
+    return data[:len(MAGIC)] == MAGIC
+
+
+def string_to_record(string):
+    """Converts a level's string from a level file into a record."""
+    strings = string.split(world.LAYER_SEPARATOR)
+    shells = [int(shell) for shell in strings[0].split()]
+    start_end = [int(value) for value in strings[1].split()]
+
+    pieces = [RECORD_HEADER.pack(*start_end, len(shells)), bytes(shells)]
+    for layer_string in strings[2:]:
+        tiles = bytes(map(int, layer_string.split()))
+        if len(tiles) != TILES:
+            raise ValueError("a layer has %d tiles, not %d"
+                             % (len(tiles), TILES))
+        pieces.append(tiles)
+    return b"".join(pieces)
+
+
+def record_to_string(record):
+    """Converts a record back into the string it would be in a level
+    file."""
+    start_column, start_row, end_column, end_row, shell_count = \
+        RECORD_HEADER.unpack_from(record)
+    position = RECORD_HEADER.size
+    shells = record[position:position + shell_count]
+    position += shell_count
+
+    shell_string = " ".join([TILE_STRINGS[shell] for shell in shells])
+    start_end_string = "%d %d %d %d" % (start_column, start_row,
+                                        end_column, end_row)
+    layer_strings = []
+    for _ in range(world.LAYER_COUNT):
+        column_strings = []
+        for column in range(world.WIDTH):
+            tiles = record[position:position + world.HEIGHT]
+            position += world.HEIGHT
+            column_strings.append(world.TILE_SEPARATOR.join(
+                [TILE_STRINGS[tile] for tile in tiles]))
+        layer_strings.append(world.COLUMN_SEPARATOR.join(column_strings))
+
+    return world.LAYER_SEPARATOR.join([shell_string, start_end_string]
+                                      + layer_strings)
+
+
+def record_to_level(record, new_level=None):
+    """Converts a record into a Level, like world.string_to_level().  If
+    new_level is given, the record is read into it instead of into a
+    brand new Level."""
+    new_level = read_record(record, new_level)
+    new_level.build_mesh()
+    return new_level
+
+
+def read_record(record, new_level=None):
+    """Like record_to_level(), but doesn't build the level's collision
+    mesh, like world.read_level_string()."""
+    start_column, start_row, end_column, end_row, shell_count = \
+        RECORD_HEADER.unpack_from(record)
+    position = RECORD_HEADER.size
+
+    if new_level is None:
+        new_level = world.Level()
+    new_level.unshare()
+    new_level.start_shells = list(record[position:position + shell_count])
+    position += shell_count
+    new_level.start_tile = (start_column, start_row)
+    new_level.end_tile = (end_column, end_row)
+
+    for layer in new_level.layers:
+        # records keep the tiles in the same order as Layer.tiles
+        layer.tiles = bytearray(record[position:position + TILES])
+        position += TILES
+
+    buttons = record[position - TILES:position]
+    new_level.total_buttons = TILES - buttons.count(world.EMPTY)
+    new_level.field = None
+    return new_level
+
+
+def pack(records, compress=False):
+    """Returns the bytes of a level pack holding the given records."""
+    flags = 0
+    if compress:
+        flags |= COMPRESSED
+        records = [zlib.compress(record) for record in records]
+
+    header = HEADER.pack(MAGIC, FORMAT_VERSION, flags, len(records))
+    offsets = []
+    position = HEADER.size + OFFSET.size * (len(records) + 1)
+    for record in records:
+        offsets.append(OFFSET.pack(position))
+        position += len(record)
+    offsets.append(OFFSET.pack(position))
+    return b"".join([header] + offsets + records)
+
+
+def read_header(data):
+    """Returns (whether the records are compressed, where each record
+    starts followed by where the last one ends) for the level pack in
+    data.  Raises ValueError if it isn't a pack this version can read."""
+    if len(data) < HEADER.size or not is_pack(data):
+        raise ValueError("not a level pack")
+    magic, version, flags, count = HEADER.unpack_from(data)
+    if version != FORMAT_VERSION:
+        raise ValueError("a version %d level pack, not version %d"
+                         % (version, FORMAT_VERSION))
+
+    table = data[HEADER.size:HEADER.size + OFFSET.size * (count + 1)]
+    starts = [offset for offset, in OFFSET.iter_unpack(table)]
+    return bool(flags & COMPRESSED), starts
+
+
+def unpack(data):
+    """Returns every record in a level pack."""
+    compressed, starts = read_header(data)
+    records = [data[start:end] for start, end in zip(starts, starts[1:])]
+    if compressed:
+        records = [zlib.decompress(record) for record in records]
+    return records
+
+
+def text_to_pack(text, compress=False):
+    """Converts the contents of a level file into a level pack."""
+    if not text or text.isspace():
+        return pack([], compress)
+    level_strings = text.split(world.LEVEL_SEPARATOR)
+    return pack([string_to_record(string) for string in level_strings],
+                compress)
+
+
+def pack_to_text(data):
+    """Converts a level pack into the contents of a level file."""
+    return world.LEVEL_SEPARATOR.join([record_to_string(record)
+                                       for record in unpack(data)])
+
+
+if __name__ == "__main__":
+    arguments = sys.argv[1:]
+    compress = "--compress" in arguments
+    if compress:
+        arguments.remove("--compress")
+    in_path, out_path = arguments
+
+    file = open(in_path, 'rb')
+    data = file.read()
+    file.close()
+
+    start = time.perf_counter()
+    if is_pack(data):
+        converted = pack_to_text(data).encode("ascii")
+    else:
+        converted = text_to_pack(data.decode("ascii"), compress)
+    seconds = time.perf_counter() - start
+
+    file = open(out_path, 'wb')
+    file.write(converted)
+    file.close()
+    print("%s (%d bytes) -> %s (%d bytes) in %.1f ms"
+          % (in_path, len(data), out_path, len(converted), seconds * 1000))
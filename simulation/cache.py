@@ -0,0 +1,175 @@
+import collections
+import hashlib
+import os
+import pickle
+import threading
+
+# Things worked out from a level that take a while to make (collision
+# meshes, distance fields, solver results, thumbnails) are saved in
+# CACHE_FOLDER, so they only have to be made once.  Each one is saved
+# under its kind and the level_key() of the level it came from, which is a
+# hash of the whole level, so a level that changes just gets new entries.
+# Changing ENGINE_VERSION makes every old entry get ignored, so bump it
+# whenever the physics or any of the saved things change.
+#
+# When the folder holds more than MAX_BYTES, the entries that were used
+# least recently are deleted.  A cache can be used from more than one
+# thread at once.
+ENGINE_VERSION = 3
+CACHE_FOLDER = "cache"
+MAX_BYTES = 256 * 1024 * 1024  # a distance field is about 1 MB
+
+# the kinds of entry
+MESH = "mesh"
+FIELD = "field"
+SOLUTION = "solution"
+THUMBNAIL = "thumbnail"
+
+
+class ResultCache:
+    """A folder of pickled results, with least recently used eviction."""
+    def __init__(self, folder=CACHE_FOLDER, max_bytes=MAX_BYTES):
+        self.folder = folder
+        self.max_bytes = max_bytes
+
+        # file name -> size, least recently used first.  Filled in from
+        # the folder the first time it's needed.
+        self.sizes = None
+        self.total_bytes = 0
+        self.lock = threading.RLock()  # for sizes and the counters
+
+        self.hits = collections.Counter()  # kind -> how many
+        self.misses = collections.Counter()
+
+    def get(self, kind, key):
+        """Returns the entry saved for kind and key, or None if there
+        isn't one."""
+        name = entry_name(kind, key)
+        path = os.path.join(self.folder, name)
+        try:
+            file = open(path, 'rb')
+            try:
+                value = pickle.load(file)
+            finally:
+                file.close()
+            os.utime(path)
+        except (OSError, EOFError, pickle.UnpicklingError):
+            with self.lock:
+                self.misses[kind] += 1
+            return None
+
+        with self.lock:
+            self.hits[kind] += 1
+            sizes = self.load_sizes()
+            if name in sizes:
+                sizes.move_to_end(name)
+        return value
+
+    def put(self, kind, key, value):
+        """Saves value for kind and key, then deletes old entries until
+        the folder fits in max_bytes."""
+        name = entry_name(kind, key)
+        path = os.path.join(self.folder, name)
+        data = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+        try:
+            os.makedirs(self.folder, exist_ok=True)
+            # written to the side first, so that another process reading
+            # the entry never sees half of it
+            temporary_path = "%s.%d.%d.tmp" % (path, os.getpid(),
+                                               threading.get_ident())
+            file = open(temporary_path, 'wb')
+            try:
+                file.write(data)
+            finally:
+                file.close()
+            os.replace(temporary_path, path)
+        except OSError:
+            return  # things still work, they just won't be saved
+
+        with self.lock:
+            sizes = self.load_sizes()
+            self.total_bytes -= sizes.pop(name, 0)
+            sizes[name] = len(data)
+            self.total_bytes += len(data)
+            self.evict()
+
+    def invalidate(self, key):
+        """Deletes every kind of entry saved for key."""
+        with self.lock:
+            sizes = self.load_sizes()
+            for name in list(sizes):
+                if name.endswith("-" + key):
+                    self.remove(name)
+
+    def clear(self):
+        with self.lock:
+            for name in list(self.load_sizes()):
+                self.remove(name)
+
+    def evict(self):
+        with self.lock:
+            sizes = self.load_sizes()
+            while self.total_bytes > self.max_bytes and sizes:
+                self.remove(next(iter(sizes)))
+
+    def remove(self, name):
+        self.total_bytes -= self.sizes.pop(name)
+        try:
+            os.remove(os.path.join(self.folder, name))
+        except OSError:
+            pass  # another process already deleted it
+
+    def load_sizes(self):
+        if self.sizes is not None:
+            return self.sizes
+
+        entries = []
+        try:
+            for entry in os.scandir(self.folder):
+                if entry.name.endswith(".tmp"):
+                    continue
+                stat = entry.stat()
+                entries.append((stat.st_mtime, entry.name, stat.st_size))
+        except OSError:
+            pass  # there's no folder until something is saved
+        entries.sort()
+
+        self.sizes = collections.OrderedDict()
+        self.total_bytes = 0
+        for _, name, size in entries:
+            self.sizes[name] = size
+            self.total_bytes += size
+        return self.sizes
+
+    def counters(self):
+        """Returns {kind: (hits, misses)} for every kind that was looked
+        up."""
+        kinds = set(self.hits) | set(self.misses)
+        return {kind: (self.hits[kind], self.misses[kind]) for kind in kinds}
+
+    def report(self):
+        """Returns the counters as a line of text."""
+        parts = []
+        for kind, (hits, misses) in sorted(self.counters().items()):
+            parts.append("%s %d hits, %d misses" % (kind, hits, misses))
+        return "cache: " + "; ".join(parts)
+
+
+def level_key(level):
+    """Returns the key that entries worked out from level are saved
+    under."""
+    return string_key(level.to_string())
+
+
+def string_key(level_string):
+    """Returns the level_key() of the level that level_string is, as long
+    as it's laid out exactly like Level.to_string() lays levels out."""
+    digest = hashlib.sha1(level_string.encode("utf-8")).hexdigest()
+    return "%s-%d" % (digest, ENGINE_VERSION)
+
+
+def entry_name(kind, key):
+    return "%s-%s" % (kind, key)
+
+
+shared = ResultCache()
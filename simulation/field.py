@@ -0,0 +1,128 @@
+import numpy
+
+import constants
+from simulation import cache
+from simulation import world
+
+# A distance field stores, for every whole pixel of a level, how far it is
+# from the nearest wall.  Pixels inside of blocks are negative.  Looking up
+# a ball's distance to the walls is then just a few reads from an array,
+# however many walls there are, and the direction out of the nearest wall
+# comes from how the distance changes around the ball.
+#
+# Fields are saved in the simulation.cache, so each level's is only built
+# once.
+
+PIXELS_WIDE = world.WIDTH * constants.TILE_WIDTH
+PIXELS_TALL = world.HEIGHT * constants.TILE_HEIGHT
+FAR = 1000000.0  # the distance outside of the level, where there are no walls
+
+
+class DistanceField:
+    """The distance from every whole pixel of a level to its walls."""
+    def __init__(self, distances):
+        # indexed [x, y], with one more row and column than there are pixels
+        # so that points on the bottom and right edges can be looked up
+        self.distances = distances
+
+        # reading single numbers out of a memoryview is much quicker than
+        # out of a numpy array
+        self.values = memoryview(distances.reshape(-1))
+
+    def sample(self, x, y):
+        """Returns (distance, normal x, normal y) for the point (x, y).
+        The normal is the unit vector pointing away from the nearest wall.
+        """
+        if not (0.0 <= x < PIXELS_WIDE and 0.0 <= y < PIXELS_TALL):
+            return FAR, 0.0, 0.0
+
+        column = int(x)
+        row = int(y)
+        across = x - column
+        down = y - row
+
+        values = self.values
+        index = column * (PIXELS_TALL + 1) + row
+        top_left = values[index]
+        bottom_left = values[index + 1]
+        top_right = values[index + PIXELS_TALL + 1]
+        bottom_right = values[index + PIXELS_TALL + 2]
+
+        top = top_left + (top_right - top_left) * across
+        bottom = bottom_left + (bottom_right - bottom_left) * across
+        distance = top + (bottom - top) * down
+
+        slope_x = ((top_right - top_left) * (1.0 - down) +
+                   (bottom_right - bottom_left) * down)
+        slope_y = bottom - top
+        length = (slope_x * slope_x + slope_y * slope_y) ** 0.5
+        if length == 0.0:
+            return distance, 0.0, 0.0
+        return distance, slope_x / length, slope_y / length
+
+
+def load_field(level, results=None):
+    """Returns the DistanceField of a level, from the ResultCache results
+    if it was saved there before.  Otherwise, it's built and saved for next
+    time."""
+    if results is None:
+        results = cache.shared
+
+    key = cache.level_key(level)
+    distances = results.get(cache.FIELD, key)
+    if distances is None:
+        distances = build_distances(level)
+        results.put(cache.FIELD, key, distances)
+
+    return DistanceField(distances)
+
+
+def build_distances(level):
+    """Returns the signed distance from every whole pixel of a level to the
+    nearest wall, as a float32 array indexed [x, y]."""
+    x, y = numpy.meshgrid(numpy.arange(PIXELS_WIDE + 1, dtype=float),
+                          numpy.arange(PIXELS_TALL + 1, dtype=float),
+                          indexing="ij")
+
+    walls = set()
+    for column in range(world.WIDTH):
+        for row in range(world.HEIGHT):
+            walls.update(level.tile_to_segments((column, row)))
+
+    nearest = numpy.full(x.shape, FAR * FAR)
+    for wall in walls:
+        offset_x = x - wall.point1[0]
+        offset_y = y - wall.point1[1]
+        along = offset_x * wall.along_x + offset_y * wall.along_y
+        along = numpy.clip(along / wall.length_squared, 0.0, 1.0)
+        offset_x -= wall.along_x * along
+        offset_y -= wall.along_y * along
+        numpy.minimum(nearest, offset_x ** 2 + offset_y ** 2, out=nearest)
+
+    distances = numpy.sqrt(nearest)
+    distances[inside_blocks(level, x, y)] *= -1.0
+    return distances.astype(numpy.float32)
+
+
+def inside_blocks(level, x, y):
+    """Returns whether each of the points is inside of a block."""
+    columns = numpy.minimum(x // constants.TILE_WIDTH, world.WIDTH - 1)
+    rows = numpy.minimum(y // constants.TILE_HEIGHT, world.HEIGHT - 1)
+    columns = columns.astype(int)
+    rows = rows.astype(int)
+
+    # how far across and down its tile each point is, from 0 to 1
+    across = x / constants.TILE_WIDTH - columns
+    down = y / constants.TILE_HEIGHT - rows
+
+    tiles = numpy.frombuffer(level.layers[constants.LAYER_BLOCKS].tiles,
+                             dtype=numpy.uint8).reshape(world.WIDTH,
+                                                        world.HEIGHT)
+    tiles = tiles[columns, rows]
+
+    inside = tiles == world.BLOCKS_WALL
+    inside |= (tiles == world.BLOCKS_TOPLEFT) & (across + down < 1.0)
+    inside |= (tiles == world.BLOCKS_TOPRIGHT) & (across > down)
+    inside |= (tiles == world.BLOCKS_BOTTOMRIGHT) & (across + down > 1.0)
+    inside |= (tiles == world.BLOCKS_BOTTOMLEFT) & (across < down)
+    return inside
@@ -0,0 +1,203 @@
+import constants
+from simulation import vector
+from simulation import world
+
+# Every edge in a level lies on a line of the tile grid.  The lines come in
+# four kinds, and each edge is stored as a (kind, line, index) "slot":
+#   HORIZONTAL    line is the row of grid points, index is the column
+#   VERTICAL      line is the column of grid points, index is the row
+#   DIAGONAL_DOWN top left to bottom right, line is column - row
+#   DIAGONAL_UP   top right to bottom left, line is column + row
+# For both diagonals, index is the column of the tile the edge crosses.
+HORIZONTAL = 0
+VERTICAL = 1
+DIAGONAL_DOWN = 2
+DIAGONAL_UP = 3
+
+
+def side_slot(tile, side, tile_position):
+    """Returns the (kind, line, index) slot of one side of a tile."""
+    column, row = tile_position
+    if side == world.SIDE_TOP:
+        return HORIZONTAL, row, column
+    if side == world.SIDE_BOTTOM:
+        return HORIZONTAL, row + 1, column
+    if side == world.SIDE_LEFT:
+        return VERTICAL, column, row
+    if side == world.SIDE_RIGHT:
+        return VERTICAL, column + 1, row
+
+    if tile == world.BLOCKS_TOPRIGHT or tile == world.BLOCKS_BOTTOMLEFT:
+        return DIAGONAL_DOWN, column - row, column
+    return DIAGONAL_UP, column + row, column
+
+
+def slot_tiles(kind, line, index):
+    """Returns the positions of the tiles that could have a side on a slot.
+    Some of them may be out of bounds."""
+    if kind == HORIZONTAL:
+        return (index, line - 1), (index, line)
+    if kind == VERTICAL:
+        return (line - 1, index), (line, index)
+    if kind == DIAGONAL_DOWN:
+        return (index, index - line),
+    return (index, line - index),
+
+
+def run_to_segment(kind, line, first, last):
+    """Returns the Wall covering every slot from first to last."""
+    width = constants.TILE_WIDTH
+    height = constants.TILE_HEIGHT
+    if kind == HORIZONTAL:
+        point1 = (first * width, line * height)
+        point2 = ((last + 1) * width, line * height)
+    elif kind == VERTICAL:
+        point1 = (line * width, first * height)
+        point2 = (line * width, (last + 1) * height)
+    elif kind == DIAGONAL_DOWN:
+        point1 = (first * width, (first - line) * height)
+        point2 = ((last + 1) * width, (last + 1 - line) * height)
+    else:
+        point1 = (first * width, (line - first + 1) * height)
+        point2 = ((last + 1) * width, (line - last) * height)
+    return vector.Wall(point1, point2)
+
+
+def all_lines():
+    """Returns every (kind, line) pair that a level's edges can lie on."""
+    lines = [(HORIZONTAL, line) for line in range(world.HEIGHT + 1)]
+    lines += [(VERTICAL, line) for line in range(world.WIDTH + 1)]
+    lines += [(DIAGONAL_DOWN, line) for line in range(1 - world.HEIGHT, world.WIDTH)]
+    lines += [(DIAGONAL_UP, line) for line in range(world.WIDTH + world.HEIGHT - 1)]
+    return lines
+
+
+def line_length(kind):
+    """Returns how many slots there are along a line of the given kind."""
+    if kind == VERTICAL:
+        return world.HEIGHT
+    return world.WIDTH
+
+
+class CollisionMesh:
+    """The walls of a level, as vector.Walls that never change between
+    frames.
+
+    Sides that are pressed up against the flat side of another block can
+    never be touched, so they're left out.  Sides that line up with each
+    other are joined into one long Wall.  Each tile keeps a tuple of
+    the Walls that make up its exposed sides, so looking them up
+    doesn't create anything.
+    """
+    def __init__(self, layer, walls=None):
+        """walls is a (line_segments, tile_segments) pair saved from a mesh
+        of the same tiles, or None to build the mesh from the layer."""
+        self.layer = layer
+        if walls is not None:
+            self.line_segments, self.tile_segments = walls
+            return
+        self.line_segments = {}  # (kind, line) -> {index: Wall}
+        self.tile_segments = [[()] * world.HEIGHT for _ in range(world.WIDTH)]
+        self.rebuild()
+
+    def copy(self, layer):
+        """Returns a copy of the mesh for layer, which has the same tiles
+        as this mesh's layer, without rebuilding anything."""
+        new_mesh = CollisionMesh.__new__(CollisionMesh)
+        new_mesh.layer = layer
+        # build_line() replaces a line's dictionary rather than changing it
+        new_mesh.line_segments = dict(self.line_segments)
+        new_mesh.tile_segments = [list(column)
+                                  for column in self.tile_segments]
+        return new_mesh
+
+    def segments_at(self, tile_position):
+        """Returns a tuple of the Walls making up the tile at
+        tile_position, which is a (column, row) pair.
+
+        The Walls are shared, so don't change them.
+        """
+        return self.tile_segments[tile_position[0]][tile_position[1]]
+
+    def segment_count(self):
+        """Returns how many distinct Walls are in the mesh."""
+        total = 0
+        for segments in self.line_segments.values():
+            total += len(set(segments.values()))
+        return total
+
+    def rebuild(self):
+        """Rebuilds the whole mesh from the layer."""
+        self.line_segments.clear()
+        for kind, line in all_lines():
+            self.build_line(kind, line)
+
+        for column in range(world.WIDTH):
+            for row in range(world.HEIGHT):
+                self.build_tile((column, row))
+
+    def update_tile(self, tile_position):
+        """Rebuilds only the parts of the mesh that depend on one tile.
+        Call this after the tile at tile_position changes."""
+        column, row = tile_position
+        lines = ((HORIZONTAL, row), (HORIZONTAL, row + 1),
+                 (VERTICAL, column), (VERTICAL, column + 1),
+                 (DIAGONAL_DOWN, column - row), (DIAGONAL_UP, column + row))
+
+        for kind, line in lines:
+            self.build_line(kind, line)
+
+        # a merged Wall can reach across the whole level, so every tile
+        # with a side on one of the lines needs its tuple rebuilt
+        for check_column in range(world.WIDTH):
+            for check_row in range(world.HEIGHT):
+                if abs(check_row - row) <= 1 or abs(check_column - column) <= 1:
+                    self.build_tile((check_column, check_row))
+                elif check_column - check_row == column - row:
+                    self.build_tile((check_column, check_row))
+                elif check_column + check_row == column + row:
+                    self.build_tile((check_column, check_row))
+
+    def exposed(self, kind, line, index):
+        """Returns whether a slot has a side on it that can be touched."""
+        sides = 0
+        for tile_position in slot_tiles(kind, line, index):
+            tile = self.layer.tile_at(tile_position)
+            if tile not in world.BLOCK_SIDES:
+                continue
+
+            for side in world.BLOCK_SIDES[tile]:
+                if side_slot(tile, side, tile_position) == (kind, line, index):
+                    sides += 1
+
+        # two flat sides pressed together cover each other up
+        return sides == 1
+
+    def build_line(self, kind, line):
+        segments = {}
+        first = None
+        length = line_length(kind)
+        for index in range(length + 1):
+            if index < length and self.exposed(kind, line, index):
+                if first is None:
+                    first = index
+            elif first is not None:
+                segment = run_to_segment(kind, line, first, index - 1)
+                for run_index in range(first, index):
+                    segments[run_index] = segment
+                first = None
+
+        self.line_segments[(kind, line)] = segments
+
+    def build_tile(self, tile_position):
+        tile = self.layer.tile_at(tile_position)
+        segments = []
+        if tile in world.BLOCK_SIDES:
+            for side in world.BLOCK_SIDES[tile]:
+                kind, line, index = side_slot(tile, side, tile_position)
+                segment = self.line_segments[(kind, line)].get(index)
+                if segment and segment not in segments:
+                    segments.append(segment)
+
+        column, row = tile_position
+        self.tile_segments[column][row] = tuple(segments)
@@ -0,0 +1,766 @@
+import math
+import operator
+
+import constants
+import geometry
+from simulation import spatial
+from simulation import vector
+from simulation import world
+
+# each "layer" of the ball is called a shell.
+SHELL_TYPES = 4
+CENTER = 0  # the ball at the very center, cannot be shot
+NORMAL = 1  # the normal, 100% tangible shell type
+GHOST = 2  # the paranormal, 0% tangible shell type
+FLOAT = 3  # the futuristic, 0% gravity shell type
+CLONE = 4  # the frankly kinda odd, 200% shell type
+
+MAX_SHELLS = 10
+
+SMALLEST_RADIUS = 6  # the radius of the smallest, innermost ball
+SHELL_WIDTH = 2
+
+# The physics never plays sounds or draws ripples itself.  Instead, anything
+# that the game would want to react to gets appended to an event list as a
+# tuple, whose first item is one of these.
+BUTTON_PRESSED = 1  # (BUTTON_PRESSED, ball, tile_position)
+BOUNCED = 2  # (BOUNCED, ball, position, magnitude, shell_type)
+GHOST_PASSED = 3  # (GHOST_PASSED, ball, position)
+REACHED_END = 4  # (REACHED_END, ball)
+
+# the ways that Ball.check_collision() can find walls
+STEPPED = 1  # look for walls at Ball.check_steps() points along the way
+SWEPT = 2  # solve for the exact moment the ball first touches a wall
+FIELD = 3  # read the level's distance field at Ball.check_steps() points
+
+
+def first_ball_radius(level):
+    return (len(level.start_shells) - 1) * SHELL_WIDTH + SMALLEST_RADIUS
+
+
+def new_player(level, ball_type=None):
+    """Returns the ball that the player starts the level with.
+
+    ball_type is the class of the ball to make, so that the game can get
+    back a ball that knows how to draw itself.
+    """
+    if ball_type is None:
+        ball_type = Ball
+
+    position = world.middle_pixel(level.start_tile)
+    radius = first_ball_radius(level)
+
+    player = ball_type(position, radius, level.start_shells[0])
+    player.is_player = True
+    player.containing_shells = level.start_shells[1:]
+    return player
+
+
+def shoot(players, balls, position):
+    """Shoots all player balls towards a specific position.
+
+    players and balls are both changed in place.  New balls are the same
+    class as the player that shot them.
+    """
+    add_balls = []
+    remove_balls = []
+    for player in players:
+        old_ball = player
+
+        new_radius = player.radius - SHELL_WIDTH
+        new_shell = old_ball.containing_shells[0]
+        new_ball = type(player)(player.position, new_radius, new_shell)
+
+        new_ball.is_player = True
+
+        new_ball.angle = old_ball.angle
+        new_ball.containing_shells = old_ball.containing_shells[1:]
+
+        if old_ball.shell_type == CLONE:
+            old_ball.shell_type = old_ball.containing_shells[0]
+            old_ball.containing_shells = old_ball.containing_shells[1:]
+            old_ball.radius = new_radius
+
+        else:
+            old_ball.is_player = False
+            old_ball.containing_shells = []
+            remove_balls.append(old_ball)
+
+        add_balls.append(new_ball)
+
+        new_ball.launch_towards(position)
+        old_ball.x_velocity = -new_ball.x_velocity
+        old_ball.y_velocity = -new_ball.y_velocity
+        old_ball.wake()
+
+    for player in remove_balls:
+        players.remove(player)
+
+    for player in add_balls:
+        players.append(player)
+        balls.append(player)
+
+
+def step(level, balls, slowmo_factor=1.0, events=None):
+    """Advances every ball by one frame.
+
+    Balls that leave the screen are removed from balls, and balls that are
+    asleep are skipped.  Pressing a button wakes every ball up.  Returns
+    the list of events that happened during the frame.
+
+    The buttons and the end are checked once every ball has moved, through
+    a spatial.SpatialHash of the tiles each ball touched on its way, so
+    each tile is only looked at once however many balls touched it.
+    """
+    if events is None:
+        events = []
+
+    pressed_buttons = level.pressed_buttons
+    touched = spatial.SpatialHash()
+    ball_index = len(balls)
+    for ball in reversed(balls):
+        ball_index -= 1
+        if ball.rest_frames >= ball.SLEEP_FRAMES:
+            continue  # asleep, and a ball that isn't moving can't leave
+
+        if ball.out_of_bounds():
+            del balls[ball_index]
+        else:
+            ball.check_collision(level, slowmo_factor, events, touched)
+            ball.update_body(slowmo_factor)
+            ball.update_rest(slowmo_factor)
+            if ball.rest_frames >= ball.SLEEP_FRAMES:
+                # so that it's drawn exactly where it stopped
+                ball.last_x = ball.x
+                ball.last_y = ball.y
+
+    touch_tiles(level, touched, events)
+
+    if level.pressed_buttons != pressed_buttons:
+        wake_all(balls)
+
+    return events
+
+
+def touch_tiles(level, touched, events):
+    """Presses the unpressed buttons in touched, a SpatialHash of the tiles
+    that balls touched during a step, and lets the balls on the end tile
+    know.  Balls on the end once every button is pressed reach it."""
+    for tile, balls in touched.cells.items():
+        if level.is_button(tile) and not level.is_pressed(tile):
+            level.press(tile)
+            events.append((BUTTON_PRESSED, balls[0], tile))
+
+    at_end = touched.balls_on(level.end_tile)
+    for ball in at_end:
+        ball.touching_end = True
+    if at_end and level.pressed_buttons == level.total_buttons:
+        for ball in at_end:
+            events.append((REACHED_END, ball))
+
+
+def wake_all(balls):
+    for ball in balls:
+        ball.rest_frames = 0
+
+
+def count_asleep(balls):
+    """Returns how many of balls are asleep."""
+    asleep = 0
+    for ball in balls:
+        if ball.rest_frames >= ball.SLEEP_FRAMES:
+            asleep += 1
+    return asleep
+
+
+def first_contact(start, delta, radius, walls):
+    """Returns when a ball moving from start to start + delta first touches
+    one of the given vector.Walls, as a (time, normal x, normal y) triple.
+    time goes from 0 at start to 1 at the end, and the normal is the unit
+    vector pointing from the wall to the center of the ball when they
+    touch.  Returns None if the ball doesn't touch any of them.
+
+    Walls that the ball is already overlapping but moving away from are
+    ignored, so that a ball can always get back out.
+    """
+    start_x, start_y = start
+    delta_x, delta_y = delta
+    speed_squared = vector.dot(delta_x, delta_y, delta_x, delta_y)
+
+    first = None
+    first_time = 2.0
+    for wall in walls:
+        point1_x, point1_y = wall.point1
+
+        # the flat side: how far the ball is from the wall's line, and how
+        # quickly it's closing in on it
+        normal_x = wall.normal_x
+        normal_y = wall.normal_y
+        gap = vector.dot(start_x - point1_x, start_y - point1_y,
+                         normal_x, normal_y)
+        closing = vector.dot(delta_x, delta_y, normal_x, normal_y)
+        if gap < 0.0:
+            gap = -gap
+            closing = -closing
+            normal_x = -normal_x
+            normal_y = -normal_y
+
+        if closing < 0.0 and gap > 0.0:
+            time = max((gap - radius) / -closing, 0.0)
+            if time < first_time:
+                part = vector.dot(start_x + delta_x * time - point1_x,
+                                  start_y + delta_y * time - point1_y,
+                                  wall.along_x, wall.along_y)
+                if 0.0 <= part <= wall.length_squared:
+                    first_time = time
+                    first = (normal_x, normal_y)
+                    continue
+
+        # the ends: where the ball's path comes within radius of each one
+        for corner_x, corner_y in (wall.point1, wall.point2):
+            offset_x = start_x - corner_x
+            offset_y = start_y - corner_y
+            approach = vector.dot(offset_x, offset_y, delta_x, delta_y)
+            if approach >= 0.0:
+                continue
+
+            outside = vector.dot(offset_x, offset_y, offset_x, offset_y)
+            outside -= radius * radius
+            if outside < 0.0:
+                time = 0.0
+            else:
+                discriminant = approach * approach - speed_squared * outside
+                if discriminant < 0.0:
+                    continue
+                time = (-approach - math.sqrt(discriminant)) / speed_squared
+
+            if time < first_time:
+                first_time = time
+                first = (offset_x + delta_x * time, offset_y + delta_y * time)
+
+    if first is None or first_time > 1.0:
+        return None
+
+    normal_x, normal_y = first
+    length = math.sqrt(vector.dot(normal_x, normal_y, normal_x, normal_y))
+    return first_time, normal_x / length, normal_y / length
+
+
+class Ball:
+    """A simulated ball that experiences gravity and rolls."""
+    CHECK_STEPS = 8  # the most intermediate frames to check between frames
+    # how far apart the intermediate frames can be, as a fraction of the
+    # ball's radius.  Slower balls get fewer of them, see check_steps().
+    STEP_SPACING = 0.25
+    COLLISION = SWEPT  # how walls are found, one of the modes above
+    MAX_BOUNCES = 4  # how many walls a swept ball can bounce off in a frame
+    GROUNDED_THRESHOLD = 1.3  # what speed to start grounding the ball at
+
+    # a ball that keeps touching walls without going anywhere falls asleep,
+    # and stops being stepped until something wakes it.  Resting means
+    # moving slower than GROUNDED_THRESHOLD while staying within
+    # SLEEP_DISTANCE of the same spot, for SLEEP_FRAMES frames in a row.
+    # In slowmo, balls only move 1 / slowmo_factor as far each frame, so
+    # SLEEP_DISTANCE shrinks the same way, or balls that are still moving
+    # would fall asleep.
+    SLEEP_FRAMES = 30
+    SLEEP_DISTANCE = 0.25
+
+    # balls are made and thrown away all the time, so they don't get a
+    # __dict__.  Subclasses should set __slots__ = () to keep it that way.
+    __slots__ = ("x", "y", "x_velocity", "y_velocity", "x_acceleration",
+                 "y_acceleration", "position", "radius", "angle",
+                 "angular_velocity", "last_x", "last_y",
+                 "NORMAL_BOUNCE_DECAY", "FLOATING_BOUNCE_DECAY",
+                 "x_bounce_decay", "y_bounce_decay", "is_player",
+                 "containing_shells", "shell_type", "touching_end",
+                 "touching_wall", "rest_frames", "rest_x", "rest_y",
+                 "ghost_ripple_timer", "GHOST_RIPPLE_DELAY")
+    STATE_NAMES = __slots__  # subclasses' own __slots__ are empty
+    get_state = operator.attrgetter(*STATE_NAMES)
+    SHELLS_INDEX = STATE_NAMES.index("containing_shells")
+
+    def __init__(self, position, radius, shell_type, bounce_decay=0.7):
+        self.x = position[0]
+        self.y = position[1]
+        self.x_velocity = 0.0
+        self.y_velocity = 0.0
+        self.x_acceleration = 0.0
+        self.y_acceleration = 0.0
+        self.position = position
+        self.radius = radius
+        self.angle = 0
+
+        # where the ball was before its last update_body(), for drawing it
+        # in between steps
+        self.last_x = self.x
+        self.last_y = self.y
+        self.angular_velocity = 0.0
+
+        # bounce_decay is how bouncy the ball is.  value should be between
+        # 0 and 1.  settting bounce decay greater than 1 is wild, though!
+        # specifically, bounce_decay measures what percentage of the initial
+        # speed is kept after bouncing.
+        self.NORMAL_BOUNCE_DECAY = bounce_decay
+        self.FLOATING_BOUNCE_DECAY = min(0.9, self.NORMAL_BOUNCE_DECAY + 0.2)
+        self.x_bounce_decay = bounce_decay
+        self.y_bounce_decay = bounce_decay
+
+        self.is_player = False
+        self.containing_shells = None
+        self.shell_type = shell_type
+
+        self.touching_end = False
+
+        self.touching_wall = False  # whether it bounced during the last step
+        self.rest_frames = 0  # how many steps it has been resting for
+        self.rest_x = self.x  # where it started resting
+        self.rest_y = self.y
+
+        self.ghost_ripple_timer = 0.0
+        self.GHOST_RIPPLE_DELAY = 5.0
+
+    def snapshot(self):
+        """Returns everything about the ball as a tuple, which restore()
+        can put back later."""
+        state = self.get_state(self)
+        index = self.SHELLS_INDEX
+        if state[index] is not None:
+            # copied, so that changing the ball can't change the snapshot
+            state = state[:index] + (tuple(state[index]),) + state[index + 1:]
+        return state
+
+    def restore(self, state):
+        """Puts the ball back the way it was when snapshot() was called."""
+        for name, value in zip(self.STATE_NAMES, state):
+            setattr(self, name, value)
+        if self.containing_shells is not None:
+            self.containing_shells = list(self.containing_shells)
+
+    @classmethod
+    def from_snapshot(cls, state):
+        """Returns a new ball made from a snapshot(), without going through
+        __init__."""
+        ball = cls.__new__(cls)
+        ball.restore(state)
+        return ball
+
+    def move(self, distance):
+        """Instantly moves the ball a certain distance from its
+        current position."""
+        self.x = self.x + distance[0]
+        self.y = self.y + distance[1]
+        self.position = (self.x, self.y)
+
+    def goto(self, position):
+        """Instantly moves the ball to a certain position on the screen."""
+        self.x = position[0]
+        self.y = position[1]
+        self.position = position
+        self.last_x = self.x
+        self.last_y = self.y
+
+    def is_asleep(self):
+        return self.rest_frames >= self.SLEEP_FRAMES
+
+    def wake(self):
+        self.rest_frames = 0
+
+    def update_rest(self, slowmo_factor=1.0):
+        """Counts how long the ball has been resting, after a step."""
+        speed_squared = vector.dot(self.x_velocity, self.y_velocity,
+                                   self.x_velocity, self.y_velocity)
+        sleep_distance = self.SLEEP_DISTANCE / slowmo_factor
+        if (self.touching_wall and
+                speed_squared < self.GROUNDED_THRESHOLD ** 2 and
+                abs(self.x - self.rest_x) <= sleep_distance and
+                abs(self.y - self.rest_y) <= sleep_distance):
+            self.rest_frames += 1
+        else:
+            self.rest_frames = 0
+            self.rest_x = self.x
+            self.rest_y = self.y
+
+    def drawn_position(self, alpha=1.0):
+        """Returns where to draw the ball, alpha of the way from where it
+        was before the last step to where it is now."""
+        x = self.last_x + (self.x - self.last_x) * alpha
+        y = self.last_y + (self.y - self.last_y) * alpha
+        return x, y
+
+    def update_body(self, slowmo_factor=1.0):
+        """Moves the ball according to its velocity and acceleration.  Also
+        rotates it based on how much it should rotate.
+
+        slowmo_factor is how much the ball slows down due to slowmo.
+        """
+        if not self.is_player and self.shell_type == FLOAT:
+            self.y_acceleration = 0.0
+        else:
+            self.y_acceleration = constants.GRAVITY
+
+        self.last_x = self.x
+        self.last_y = self.y
+
+        distance_x = self.x_velocity / slowmo_factor
+        distance_y = self.y_velocity / slowmo_factor
+        self.move((distance_x, distance_y))
+
+        self.x_velocity += self.x_acceleration / slowmo_factor
+        self.y_velocity += self.y_acceleration / slowmo_factor
+
+        self.angle += self.angular_velocity / slowmo_factor
+
+        if not self.is_player and self.shell_type == FLOAT:
+            self.x_velocity *= 0.993 + min(0.0065, 0.0015 * slowmo_factor)
+            self.y_velocity *= 0.993 + min(0.0065, 0.0015 * slowmo_factor)
+            self.angular_velocity *= 0.98 + min(0.01, 0.00075 * slowmo_factor)
+
+    def next_position(self, slowmo_factor=1.0):
+        """Returns the expected position on the next frame, without
+        taking into account collision."""
+        x = self.x + self.x_velocity / slowmo_factor
+        y = self.y + self.y_velocity / slowmo_factor
+        return x, y
+
+    def check_collision(self, level, slowmo_factor=1.0, events=None,
+                        touched=None):
+        """Updates the player's position and velocity based on where they
+        are going in the level.
+
+        Anything the game should react to (pressed buttons, bounces loud
+        enough to ripple, passing through walls as a ghost) is appended
+        to events, if it is given.  If touched is given, buttons and the
+        end are left for touch_tiles(); see touch_tile().
+        """
+        self.touching_end = False
+        self.touching_wall = False
+
+        if self.COLLISION == SWEPT:
+            ghost_ripple = self.sweep(level, slowmo_factor, events, touched)
+        elif self.COLLISION == FIELD:
+            ghost_ripple = self.sample_field(level, slowmo_factor, events,
+                                             touched)
+        else:
+            ghost_ripple = self.step_through(level, slowmo_factor, events,
+                                             touched)
+
+        floating = not (self.is_player or self.shell_type != FLOAT)
+        if not floating and abs(self.y_velocity) < self.GROUNDED_THRESHOLD:
+            self.x_bounce_decay = 0.95
+            self.y_bounce_decay = self.y_velocity / 2
+        elif floating:
+            self.x_bounce_decay = self.FLOATING_BOUNCE_DECAY
+            self.y_bounce_decay = self.FLOATING_BOUNCE_DECAY
+        else:
+            self.x_bounce_decay = self.NORMAL_BOUNCE_DECAY
+            self.y_bounce_decay = self.NORMAL_BOUNCE_DECAY
+
+        if ghost_ripple and self.ghost_ripple_timer >= self.GHOST_RIPPLE_DELAY:
+            self.ghost_ripple_timer = 0.0
+            if events is not None:
+                events.append((GHOST_PASSED, self, self.position))
+
+        elif self.ghost_ripple_timer < self.GHOST_RIPPLE_DELAY:
+            self.ghost_ripple_timer += 1.0 / slowmo_factor
+
+    def check_steps(self, radius, delta_x, delta_y):
+        """Returns how many points to check along a move of (delta_x,
+        delta_y): enough that they're at most STEP_SPACING * radius apart,
+        and at most CHECK_STEPS."""
+        distance = math.sqrt(vector.dot(delta_x, delta_y, delta_x, delta_y))
+        steps = int(distance / (radius * self.STEP_SPACING)) + 1
+        if steps > self.CHECK_STEPS:
+            return self.CHECK_STEPS
+        return steps
+
+    def step_through(self, level, slowmo_factor=1.0, events=None,
+                     touched=None):
+        """Looks for walls at check_steps() points along the way to where
+        the ball is going, and bounces off of the first one it finds.
+
+        Returns whether the ball is a ghost that passed through a wall.
+        """
+        ghost_ripple = False
+        radius = self.collision_radius()
+
+        full_step = self.next_position(slowmo_factor)
+        steps = self.check_steps(radius, self.x_velocity / slowmo_factor,
+                                 self.y_velocity / slowmo_factor)
+        for step in range(1, steps + 1):
+            multiplier = step / steps
+
+            delta_x = (full_step[0] - self.x) * multiplier
+            delta_y = (full_step[1] - self.y) * multiplier
+
+            next_x = self.x + delta_x
+            next_y = self.y + delta_y
+
+            tiles = world.tiles_touching_ball(radius, (next_x, next_y))
+            shortest = math.inf
+            for tile in tiles:
+                self.touch_tile(level, tile, events, touched)
+
+                if self.shell_type == GHOST and not self.is_player:
+                    if level.is_solid(tile):
+                        ghost_ripple = True
+                    continue
+
+                for wall in level.tile_to_segments(tile):
+                    distance, offset_x, offset_y = vector.point_and_wall(
+                        next_x, next_y, wall)
+                    # a ball right on a wall isn't touching it
+                    if 0.0 < distance < shortest:
+                        shortest = distance
+                        normal_x = offset_x
+                        normal_y = offset_y
+
+            if shortest < radius * radius:
+                shortest = math.sqrt(shortest)
+                self.bounce(normal_x / shortest, normal_y / shortest, events)
+                break
+
+        return ghost_ripple
+
+    def sweep(self, level, slowmo_factor=1.0, events=None, touched=None):
+        """Finds exactly when the ball first touches a wall on the way to
+        where it's going, and bounces off of it.  If that sends it into
+        another wall, it bounces off of that one too, up to MAX_BOUNCES
+        times, after which it stops where it is.
+
+        Returns whether the ball is a ghost that passed through a wall.
+        """
+        radius = self.collision_radius()
+        start = (self.x, self.y)
+        end = self.next_position(slowmo_factor)
+
+        if self.shell_type == GHOST and not self.is_player:
+            return self.pass_through(level, radius, start, end, events,
+                                     touched)
+
+        # the exact check below weeds out walls that are out of reach, so
+        # any tile that could be touched will do here
+        walls = {}
+        for tile in world.tiles_near_path(radius, start, end):
+            for wall in level.tile_to_segments(tile):
+                walls[wall] = None
+
+        for bounce in range(self.MAX_BOUNCES + 1):
+            delta = (end[0] - start[0], end[1] - start[1])
+            contact = first_contact(start, delta, radius, walls)
+            if not contact:
+                if bounce == 0:
+                    self.touch_path(level, radius, start, end, events, touched)
+                break
+
+            time, normal_x, normal_y = contact
+            end = (start[0] + delta[0] * time, start[1] + delta[1] * time)
+            if bounce == 0:
+                self.touch_path(level, radius, start, end, events, touched)
+
+            if bounce == self.MAX_BOUNCES:
+                self.x_velocity = 0.0
+                self.y_velocity = 0.0
+                break
+
+            self.bounce(normal_x, normal_y, events)
+            end = self.next_position(slowmo_factor)
+
+            # walls near the new path might not have been near the old one
+            for tile in world.tiles_near_path(radius, start, end):
+                for wall in level.tile_to_segments(tile):
+                    walls[wall] = None
+
+        return False
+
+    def sample_field(self, level, slowmo_factor=1.0, events=None,
+                     touched=None):
+        """Reads the level's distance field at check_steps() points along
+        the way to where the ball is going, and bounces off of the wall at
+        the first one that's closer than the ball's radius.
+
+        Returns whether the ball is a ghost that passed through a wall.
+        """
+        radius = self.collision_radius()
+        start = (self.x, self.y)
+        end = self.next_position(slowmo_factor)
+
+        if self.shell_type == GHOST and not self.is_player:
+            return self.pass_through(level, radius, start, end, events,
+                                     touched)
+
+        field = level.distance_field()
+        delta_x = end[0] - start[0]
+        delta_y = end[1] - start[1]
+        steps = self.check_steps(radius, self.x_velocity / slowmo_factor,
+                                 self.y_velocity / slowmo_factor)
+        for step in range(1, steps + 1):
+            multiplier = step / steps
+            next_x = start[0] + delta_x * multiplier
+            next_y = start[1] + delta_y * multiplier
+
+            distance, normal_x, normal_y = field.sample(next_x, next_y)
+            if distance < radius and (normal_x or normal_y):
+                self.touch_path(level, radius, start, (next_x, next_y), events,
+                                touched)
+                self.bounce(normal_x, normal_y, events)
+                return False
+
+        self.touch_path(level, radius, start, end, events, touched)
+        return False
+
+    def pass_through(self, level, radius, start, end, events=None,
+                     touched=None):
+        """Touches every tile on the way from start to end, for a ghost
+        that's been shot.  Returns whether it passed through a wall."""
+        ghost_ripple = False
+        for tile in world.tiles_near_path(radius, start, end):
+            if level.is_solid(tile) or self.can_touch(level, tile):
+                if world.path_touches_tile(radius, start, end, tile):
+                    self.touch_tile(level, tile, events, touched)
+                    if level.is_solid(tile):
+                        ghost_ripple = True
+        return ghost_ripple
+
+    def touch_path(self, level, radius, start, end, events=None, touched=None):
+        """Calls touch_tile() for the tiles that the ball touches on its way
+        from start to end."""
+        for tile in world.tiles_near_path(radius, start, end):
+            if self.can_touch(level, tile):
+                if world.path_touches_tile(radius, start, end, tile):
+                    self.touch_tile(level, tile, events, touched)
+
+    def can_touch(self, level, tile):
+        """Returns whether touching a tile would do anything."""
+        if tile == level.end_tile:
+            return True
+        return level.is_button(tile) and not level.is_pressed(tile)
+
+    def collision_radius(self):
+        """Returns the radius that the ball hits walls at.  Ghost shells on
+        the outside of a player don't count."""
+        radius = self.radius
+        if self.shell_type == GHOST and self.is_player:
+            for shell in self.containing_shells:
+                if shell != GHOST:
+                    break
+                radius -= SHELL_WIDTH
+        return radius
+
+    def touch_tile(self, level, tile, events=None, touched=None):
+        """Presses the button on a tile the ball touches, and notes whether
+        the ball is touching the end.  If touched is a SpatialHash, the
+        tile is added to it instead, for touch_tiles() to check later."""
+        if touched is not None:
+            touched.add(self, tile)
+            return
+
+        if tile == level.end_tile:
+            self.touching_end = True
+
+        if level.is_button(tile) and not level.is_pressed(tile):
+            level.press(tile)
+            if events is not None:
+                events.append((BUTTON_PRESSED, self, tile))
+
+    def bounce(self, normal_x, normal_y, events=None):
+        """Bounces the ball off of a wall.  (normal_x, normal_y) is the unit
+        vector pointing from the closest point on the wall to the center
+        of the ball."""
+        self.touching_wall = True
+        self.update_angular_velocity(normal_x, normal_y)
+
+        reflected = vector.reflect(self.x_velocity, self.y_velocity,
+                                   normal_x, normal_y)
+        new_velocity_x = reflected[0] * self.x_bounce_decay
+        new_velocity_y = reflected[1] * self.y_bounce_decay
+
+        self.x_velocity = new_velocity_x
+        self.y_velocity = new_velocity_y
+
+        magnitude = math.sqrt(vector.dot(new_velocity_x, new_velocity_y,
+                                         new_velocity_x, new_velocity_y))
+
+        if self.is_player and self.shell_type == GHOST:
+            for shell in self.containing_shells:
+                if shell != GHOST:
+                    shell_type = shell
+                    break
+            else:
+                shell_type = CENTER
+        else:
+            shell_type = self.shell_type
+
+        if shell_type == CENTER or shell_type == NORMAL:
+            # a few checks to prevent rippling while
+            # rolling on the ground
+            flat_ground = vector.is_flat(normal_x, normal_y)
+            grounded = abs(self.y_velocity) < self.GROUNDED_THRESHOLD
+            if magnitude > 3.0 and not (flat_ground and grounded):
+                if events is not None:
+                    event = (BOUNCED, self, self.position,
+                             magnitude, shell_type)
+                    events.append(event)
+
+        elif self.shell_type == FLOAT:
+            if magnitude > 1.0:
+                if events is not None:
+                    event = (BOUNCED, self, self.position,
+                             magnitude, shell_type)
+                    events.append(event)
+
+    def out_of_bounds(self):
+        x = int(self.x + constants.SCREEN_LEFT)
+        y = int(self.y + constants.SCREEN_TOP)
+        if -100 <= x < constants.FULL_WIDTH + 100:
+            if -100 <= y < constants.FULL_HEIGHT + 100:
+                return False
+        return True
+
+    def update_angular_velocity(self, normal_x, normal_y):
+        """Updates the angular velocity of the ball (how fast it spins).
+
+        Angular velocity here is simplified to be proportional to the
+        velocity of the ball parallel to the contact surface, whose unit
+        normal is (normal_x, normal_y).
+
+        Note that this is purely cosmetic and does not actually affect
+        physics in any way.
+        """
+        along = vector.along_surface(self.x_velocity, self.y_velocity,
+                                     normal_x, normal_y)
+        self.angular_velocity = along / 10
+
+    def launch(self, direction, power=12.0):
+        difference = geometry.vector_to_difference(direction, power)
+        self.x_velocity = difference[0]
+        self.y_velocity = difference[1]
+
+    def launch_towards(self, position, power=12.0):
+        angle = geometry.angle_between(self.position, position)
+        self.launch(angle, power)
+
+    def rotate_towards(self, position, slowmo_factor=1.0):
+        """Rotate the ball to face towards a specific position.
+
+        Does not rotate instantly.
+        """
+        angle = geometry.angle_between(self.position, position)
+        delta_angle = angle - self.angle
+
+        if delta_angle > math.pi:
+            delta_angle = -(math.pi * 2 - delta_angle)
+        elif delta_angle < -math.pi:
+            delta_angle = -(-math.pi * 2 - delta_angle)
+
+        self.angle += delta_angle / slowmo_factor
+
+        while self.angle < -math.pi:
+            self.angle += math.pi * 2
+
+        while self.angle > math.pi:
+            self.angle -= math.pi * 2
+
+    def point_towards_end(self, level):
+        end_point = world.middle_pixel(level.end_tile)
+        self.angle = geometry.angle_between(self.position, end_point)
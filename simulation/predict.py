@@ -0,0 +1,141 @@
+import math
+import time
+
+import geometry
+from simulation import physics
+
+# Predicts where the player's balls will go if they're shot at the mouse,
+# by running the physics ahead on copies of them.  The copies step through
+# the real level, but with the level's pressed buttons swapped out for
+# their own while they do, so nothing the game can see changes.  Events
+# from the copies are thrown away, so there are no sounds or ripples.
+#
+# Running every frame of a prediction at once takes too long to do while
+# drawing, so a Predictor only runs as many frames as fit in BUDGET each
+# time it's updated, and carries on from there the next time.  While the
+# mouse barely moves, the same prediction keeps being used.
+BUDGET = 0.002  # seconds that Predictor.update() may spend stepping
+FRAMES = 120  # how many frames ahead to predict
+
+REUSE_ANGLE = 0.01  # how far the aim can turn before predicting again
+REUSE_DISTANCE = 1.0  # how far the players can drift, in pixels
+
+# when predicting again, the old paths are still shown until the new ones
+# are done, unless the aim or the players have moved further than this
+FALLBACK_ANGLE = 0.1
+FALLBACK_DISTANCE = 10.0
+
+
+class Prediction:
+    """The paths of the balls from one shot, run some number of frames
+    ahead."""
+    def __init__(self, level, players, target):
+        self.target = target
+        self.players = [(player, player.x, player.y) for player in players]
+        self.angle = aim_angle(players, target)
+
+        self.balls = [type(player).from_snapshot(player.snapshot())
+                      for player in players]
+        physics.shoot(list(self.balls), self.balls, target)
+
+        self.buttons = level.snapshot_buttons()
+        self.frame = 0
+
+        # a list of (x, y) points for each ball, even ones that have left
+        # the screen
+        self.paths = {ball: [ball.position] for ball in self.balls}
+
+    def done(self):
+        return self.frame >= FRAMES or not self.balls
+
+    def run(self, level, deadline):
+        """Steps the prediction until it's done, or until the next frame
+        would probably finish after deadline, a time.perf_counter() time.
+        """
+        real_buttons = level.snapshot_buttons()
+        level.restore_buttons(self.buttons)
+
+        now = time.perf_counter()
+        while not self.done():
+            physics.step(level, self.balls)
+            for ball in self.balls:
+                self.paths[ball].append(ball.position)
+            self.frame += 1
+
+            last = now
+            now = time.perf_counter()
+            if now + (now - last) > deadline:
+                break
+
+        self.buttons = level.snapshot_buttons()
+        level.restore_buttons(real_buttons)
+
+    def matches(self, players, target, angle_tolerance, distance_tolerance):
+        """Returns whether this prediction is still close enough to what
+        shooting players at target would do."""
+        if len(players) != len(self.players):
+            return False
+
+        for player, (old_player, x, y) in zip(players, self.players):
+            if player is not old_player:
+                return False
+            if abs(player.x - x) + abs(player.y - y) > distance_tolerance:
+                return False
+
+        turned = abs(aim_angle(players, target) - self.angle)
+        turned = min(turned, math.pi * 2 - turned)
+        return turned <= angle_tolerance
+
+
+class Predictor:
+    """Keeps a Prediction up to date as the aim changes."""
+    def __init__(self):
+        self.prediction = None
+        self.fallback = None  # the last finished Prediction
+
+    def update(self, level, players, target, budget=BUDGET):
+        """Returns the predicted paths of the balls if players were shot
+        at target, as a list of (ball, points) pairs.  Each ball is the
+        copy that was predicted, and points is a list of its (x, y)
+        positions, one per frame.
+
+        Spends at most about budget seconds finishing the prediction, so
+        the paths might not be a full FRAMES long yet.
+        """
+        deadline = time.perf_counter() + budget
+
+        prediction = self.prediction
+        if prediction is None:
+            stale = True
+        elif prediction.done():
+            stale = not prediction.matches(players, target, REUSE_ANGLE,
+                                           REUSE_DISTANCE)
+        else:
+            # an unfinished prediction is finished first if it's close, so
+            # that quick small movements can't keep restarting it forever
+            stale = not prediction.matches(players, target, FALLBACK_ANGLE,
+                                           FALLBACK_DISTANCE)
+
+        if stale:
+            if prediction is not None and prediction.done():
+                self.fallback = prediction
+            prediction = Prediction(level, players, target)
+            self.prediction = prediction
+
+        if not prediction.done():
+            prediction.run(level, deadline)
+
+        fallback = self.fallback
+        if not prediction.done() and fallback is not None:
+            if fallback.matches(players, target, FALLBACK_ANGLE,
+                                FALLBACK_DISTANCE):
+                return list(fallback.paths.items())
+        return list(prediction.paths.items())
+
+    def clear(self):
+        self.prediction = None
+        self.fallback = None
+
+
+def aim_angle(players, target):
+    return geometry.angle_between(players[0].position, target)
@@ -0,0 +1,100 @@
+import threading
+
+from simulation import physics
+
+# Loading a level means parsing it and building its collision mesh (or
+# reading the mesh from the cache).  Doing that when the level is needed
+# makes the transition into it stutter, so a Prefetcher does it for the
+# next level on a worker thread while the current one is being played,
+# and the transition just takes what's ready.  Balls that find walls with
+# the FIELD collision mode need the level's distance field too, so it's
+# made on the worker for them; nothing else needs it, or numpy.  The game
+# also has the worker draw the level's blocks, with a render function
+# that's given the level.
+#
+# The worker only touches the level it's making, what render makes from
+# it, the LevelRepository and the shared ResultCache, which both lock
+# themselves.  render mustn't touch the display or anything the main
+# thread draws with.  If the level file changes while the worker runs,
+# what it made is thrown away, and the level is loaded the normal way
+# instead.
+
+
+class Prefetcher:
+    """Loads one level ahead of time from a repository.LevelRepository,
+    for balls of ball_type, and calls render(level) if it's given."""
+    def __init__(self, level_repository, ball_type=physics.Ball,
+                 render=None):
+        self.repository = level_repository
+        self.needs_field = ball_type.COLLISION == physics.FIELD
+        self.render = render
+
+        self.level_num = None  # the level being prefetched
+        self.thread = None
+        # [level, what render() made, repository.changes when it started],
+        # with the first two filled in by the worker when it's done
+        self.result = None
+
+        self.hits = 0
+        self.misses = 0
+
+    def start(self, level_num):
+        """Starts loading the level at level_num, unless it's already
+        loading.  Nothing happens if there's no such level."""
+        if level_num == self.level_num:
+            return
+        self.cancel()
+        if not 0 <= level_num < self.repository.count():
+            return
+
+        result = [None, None, self.repository.changes]
+
+        def load():
+            try:
+                level = self.repository.load(level_num)
+                if self.needs_field:
+                    level.distance_field()
+                if self.render is not None:
+                    result[1] = self.render(level)
+                result[0] = level
+            except Exception:
+                # left for take() to miss, so that loading it again on the
+                # main thread raises the error where it can be seen
+                pass
+
+        self.level_num = level_num
+        self.result = result
+        self.thread = threading.Thread(target=load, daemon=True)
+        self.thread.start()
+
+    def take(self, level_num):
+        """Returns (the level at level_num, what render() made from it, or
+        None without render), waiting for the worker to finish if it
+        hasn't yet.  Returns None if the level wasn't prefetched, or the
+        level file changed since."""
+        if level_num != self.level_num:
+            self.misses += 1
+            return None
+
+        self.thread.join()
+        level, rendered, changes = self.result
+        self.level_num = None
+        self.thread = None
+        self.result = None
+        if level is None or changes != self.repository.changes:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        return level, rendered
+
+    def cancel(self):
+        """Forgets the level being prefetched.  The worker is left to
+        finish on its own."""
+        self.level_num = None
+        self.thread = None
+        self.result = None
+
+    def report(self):
+        return "prefetched: %d of %d levels" % (self.hits,
+                                                self.hits + self.misses)
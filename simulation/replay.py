@@ -0,0 +1,180 @@
+import hashlib
+import os
+import random
+import struct
+import sys
+import time
+import zlib
+
+from simulation import session
+from simulation import timestep
+from simulation import world
+
+# A replay is every frame of input given to a session.Session while a
+# level was played, so that the exact same game can be played back.  The
+# physics never uses random numbers, but the game's shakes and sounds do,
+# so the random module is seeded at the start of every recording too.
+#
+# Run this file to play replays back headlessly, as fast as possible, and
+# check that they end up the same way they did when they were recorded:
+#     python -m simulation.replay FILE ...
+#
+# Files start with a HEADER, then the sha1 of the Session.state() at the
+# end of the recording, then the level (as its zlib compressed string),
+# then every frame as a FRAME, all zlib compressed together.
+MAGIC = b"RSRP"
+FORMAT_VERSION = 1
+HEADER = struct.Struct("<4sBIdII")  # magic, version, seed, start slowmo,
+                                    # frames, compressed level bytes
+FRAME = struct.Struct("<BBdd")  # steps, input flags, mouse x, mouse y
+NO_END_STATE = bytes(20)
+
+REPLAY_FOLDER = "replays"
+
+# the input flags
+CLICKED = 1
+RELEASED = 2
+HELD = 4
+RESTART = 8
+EXIT = 16
+
+
+class Replay:
+    """The input for every frame of one recording of a level."""
+    def __init__(self, level_string, seed, start_slowmo=1.0):
+        self.level_string = level_string
+        self.seed = seed
+        self.start_slowmo = start_slowmo  # the slowmo_factor at frame 0
+        self.frames = []  # (steps, flags, mouse x, mouse y) tuples
+        self.end_state = NO_END_STATE  # from state_digest()
+
+
+class Recorder:
+    """Set as a Session's recorder to record its input into a Replay."""
+    def __init__(self, level, seed=None):
+        if seed is None:
+            seed = random.randrange(2 ** 32)
+        random.seed(seed)
+        self.replay = Replay(level.to_string(), seed)
+
+    def add(self, game, mouse, pressed_key, steps):
+        if not self.replay.frames:
+            self.replay.start_slowmo = game.slowmo_factor
+
+        flags = 0
+        if mouse.clicked:
+            flags |= CLICKED
+        if mouse.released:
+            flags |= RELEASED
+        if mouse.held:
+            flags |= HELD
+        if pressed_key == session.RESTART_KEY:
+            flags |= RESTART
+        elif pressed_key == session.EXIT_KEY:
+            flags |= EXIT
+
+        x, y = mouse.position
+        self.replay.frames.append((steps, flags, x, y))
+
+    def finish(self, game):
+        """Notes how the game ended, and returns the Replay."""
+        self.replay.end_state = state_digest(game)
+        return self.replay
+
+
+def state_digest(game):
+    return hashlib.sha1(repr(game.state()).encode("utf-8")).digest()
+
+
+def play(replay, ball_type=None):
+    """Plays a Replay back without drawing, and returns the Session at the
+    end of it.  ball_type is the class of ball to play with."""
+    random.seed(replay.seed)
+    game = session.Session()
+    game.start_level(world.string_to_level(replay.level_string), ball_type)
+    game.slowmo_factor = replay.start_slowmo
+
+    for steps, flags, x, y in replay.frames:
+        mouse = session.Mouse((x, y), bool(flags & CLICKED),
+                              bool(flags & RELEASED), bool(flags & HELD))
+        if flags & RESTART:
+            pressed_key = session.RESTART_KEY
+        elif flags & EXIT:
+            pressed_key = session.EXIT_KEY
+        else:
+            pressed_key = None
+        game.play_frame(mouse, pressed_key, steps)
+    return game
+
+
+def save(replay, path):
+    level_data = zlib.compress(replay.level_string.encode("utf-8"))
+    frame_data = b"".join([FRAME.pack(*frame) for frame in replay.frames])
+    header = HEADER.pack(MAGIC, FORMAT_VERSION, replay.seed,
+                         replay.start_slowmo, len(replay.frames),
+                         len(level_data))
+
+    folder = os.path.dirname(path)
+    if folder:
+        os.makedirs(folder, exist_ok=True)
+    file = open(path, 'wb')
+    file.write(header)
+    file.write(replay.end_state)
+    file.write(level_data)
+    file.write(zlib.compress(frame_data))
+    file.close()
+
+
+def load(path):
+    """Returns the Replay saved at path.  Raises ValueError if it isn't a
+    replay this version of the game can read."""
+    file = open(path, 'rb')
+    data = file.read()
+    file.close()
+
+    if len(data) < HEADER.size or data[:len(MAGIC)] != MAGIC:
+        raise ValueError(path + " is not a replay")
+    magic, version, seed, start_slowmo, frame_count, level_size = \
+        HEADER.unpack_from(data)
+    if version != FORMAT_VERSION:
+        raise ValueError("%s is a version %d replay, not version %d"
+                         % (path, version, FORMAT_VERSION))
+
+    position = HEADER.size
+    end_state = data[position:position + len(NO_END_STATE)]
+    position += len(NO_END_STATE)
+    level_string = zlib.decompress(data[position:position + level_size])
+    position += level_size
+    frame_data = zlib.decompress(data[position:])
+
+    replay = Replay(level_string.decode("utf-8"), seed, start_slowmo)
+    replay.end_state = end_state
+    replay.frames = list(FRAME.iter_unpack(frame_data))
+    if len(replay.frames) != frame_count:
+        raise ValueError(path + " is cut off")
+    return replay
+
+
+def level_path(level_num):
+    """Returns where the game saves the last replay of a level.  level_num
+    is zero indexed."""
+    return os.path.join(REPLAY_FOLDER, "level %d.replay" % (level_num + 1))
+
+
+if __name__ == "__main__":
+    for path in sys.argv[1:]:
+        replay = load(path)
+        start = time.perf_counter()
+        game = play(replay)
+        seconds = time.perf_counter() - start
+
+        steps = sum(frame[0] for frame in replay.frames)
+        if replay.end_state == NO_END_STATE:
+            result = "no end state was recorded"
+        elif state_digest(game) == replay.end_state:
+            result = "same end state"
+        else:
+            result = "DIFFERENT end state"
+        print("%s: %d frames, %d steps, %.0f frames/s, %.0fx real time, %s"
+              % (path, len(replay.frames), steps, len(replay.frames) / seconds,
+                 steps * timestep.STEP / seconds, result))
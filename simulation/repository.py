@@ -0,0 +1,225 @@
+import collections
+import sys
+import threading
+
+from simulation import cache
+from simulation import store
+from simulation import world
+
+# A LevelRepository owns the parsed levels of one level file, so that
+# playing, moving on to the next level and editing don't each read and
+# parse the level again.  It keeps up to max_levels of them, and forgets
+# the one used least recently when there are too many.
+#
+# Nobody outside gets the repository's own Level objects.  load() returns
+# a Level.view() of one, which shares its tiles and collision mesh but has
+# its own pressed buttons, so playing a level never changes the saved one.
+# Editing a view gives it its own copy of the tiles first.
+#
+# save() writes the level to the store's journal straight away, so that
+# a crash can't lose it.  Something that saves several levels as part of
+# one change can save them with flush=False instead, which only marks them
+# dirty, and then flush() writes all of them at once.  Dirty levels are
+# also flushed before the file's levels are inserted, deleted or moved,
+# and before one is forgotten, but until then a crash loses them.
+#
+# Levels can be loaded on another thread (see simulation.prefetch), so
+# everything that reads or changes the kept levels or the store holds the
+# lock.  Parsing a level doesn't, so saving on the main thread never waits
+# for a level that's being loaded on another one.
+MAX_LEVELS = 16
+
+
+class LevelRepository:
+    """The levels in a store.LevelStore, parsed and kept in memory."""
+    def __init__(self, level_store, new_level=world.Level,
+                 new_layer=world.Layer, max_levels=MAX_LEVELS):
+        self.store = level_store
+        self.new_level = new_level
+        self.new_layer = new_layer
+        self.max_levels = max_levels
+
+        # level_num -> Level, least recently used first
+        self.levels = collections.OrderedDict()
+        self.dirty = set()  # the level_nums saved since the last flush()
+        self.lock = threading.RLock()
+        # goes up whenever a level is saved, inserted, deleted or moved, so
+        # that anything made from an earlier load() can tell it's stale
+        self.changes = 0
+
+        self.hits = 0
+        self.misses = 0
+        self.flushes = 0
+
+    def count(self):
+        """Returns how many levels there are.  Saving never changes it, so
+        the file's count is still right with levels waiting to be
+        written."""
+        with self.lock:
+            return self.store.count()
+
+    def load(self, level_num):
+        """Returns a view() of the level at level_num."""
+        with self.lock:
+            level = self.levels.get(level_num)
+            if level is not None:
+                self.hits += 1
+                self.levels.move_to_end(level_num)
+                return level.view()
+            self.misses += 1
+            level_data = self.store.level_data(level_num)
+            changes = self.changes
+
+        level = store.parse_level(level_data, self.new_level())
+
+        with self.lock:
+            # only kept if nothing changed the level file meanwhile
+            if self.changes == changes:
+                kept = self.levels.get(level_num)
+                if kept is None:
+                    self.levels[level_num] = level
+                    self.evict()
+                else:
+                    level = kept  # loaded on another thread meanwhile
+            return level.view()
+
+    def save(self, level_num, level, flush=True):
+        """Replaces the level at level_num with level, and writes it to the
+        store's journal.  With flush=False, it's written by the next
+        flush() instead."""
+        with self.lock:
+            self.store.bounds(level_num)  # for the IndexError
+            self.changes += 1
+
+            # entries for the old version of the level will never be used
+            # again.  Keys are hashes of the whole level, so if the file lays
+            # a level out differently from to_string(), the wrong key is just
+            # an entry that's left for the cache to evict.
+            old_level = self.levels.get(level_num)
+            if old_level is None:
+                old_key = cache.string_key(
+                    self.store.level_string(level_num))
+            else:
+                old_key = cache.level_key(old_level)
+            cache.shared.invalidate(old_key)
+
+            saved_level = level.view()
+            self.levels[level_num] = saved_level
+            self.levels.move_to_end(level_num)
+            self.dirty.add(level_num)
+            if flush:
+                self.flush()
+            self.evict()
+
+    def flush(self):
+        """Writes every saved level to the store."""
+        with self.lock:
+            if not self.dirty:
+                return
+            self.store.replace_many(
+                {level_num: self.levels[level_num].to_string()
+                 for level_num in self.dirty})
+            self.dirty.clear()
+            self.flushes += 1
+
+    def evict(self):
+        while len(self.levels) > self.max_levels:
+            level_num = next(iter(self.levels))
+            if level_num in self.dirty:
+                self.flush()
+            del self.levels[level_num]
+
+    def insert(self, level_num, level):
+        """Puts level in front of the level at level_num, or at the end if
+        level_num is the number of levels."""
+        with self.lock:
+            self.flush()
+            self.store.insert(level_num, level.to_string())
+            self.changes += 1
+            self.renumber(lambda number: number + (number >= level_num))
+
+    def delete(self, level_num):
+        with self.lock:
+            self.flush()
+            self.store.delete(level_num)
+            self.changes += 1
+            self.levels.pop(level_num, None)
+            self.renumber(lambda number: number - (number > level_num))
+
+    def swap(self, level_num1, level_num2):
+        with self.lock:
+            self.flush()
+            self.store.swap(level_num1, level_num2)
+            self.changes += 1
+            swapped = {level_num1: level_num2, level_num2: level_num1}
+            self.renumber(lambda number: swapped.get(number, number))
+
+    def renumber(self, new_number):
+        """Moves every kept level to new_number(its old number)."""
+        self.levels = collections.OrderedDict(
+            (new_number(level_num), level)
+            for level_num, level in self.levels.items())
+
+    def block_layer(self, level_num):
+        """Returns the block layer of the level at level_num, without
+        building the rest of the level if it isn't kept."""
+        with self.lock:
+            level = self.levels.get(level_num)
+            if level is not None:
+                return level.layers[world.LAYER_BLOCKS]
+            return world.read_layer_string(self.store.level_string(level_num),
+                                           world.LAYER_BLOCKS,
+                                           self.new_layer())
+
+    def level_key(self, level_num):
+        """Returns the cache key of the level at level_num, which only
+        needs the level to be parsed if it was saved since the last
+        flush()."""
+        with self.lock:
+            if level_num in self.dirty:
+                return cache.level_key(self.levels[level_num])
+            return cache.string_key(self.store.level_string(level_num))
+
+    def hit_rate(self):
+        """Returns the fraction of load()s that didn't have to parse the
+        level."""
+        loads = self.hits + self.misses
+        if not loads:
+            return 0.0
+        return self.hits / loads
+
+    def memory_bytes(self):
+        """Returns roughly how many bytes the kept levels take up, counting
+        anything shared between them once."""
+        return size_of(self.levels, set())
+
+    def report(self):
+        return ("levels: %d kept, %d dirty, %.0f%% hits (%d of %d), "
+                "%d flushes, %.0f KB"
+                % (len(self.levels), len(self.dirty), self.hit_rate() * 100,
+                   self.hits, self.hits + self.misses, self.flushes,
+                   self.memory_bytes() / 1024))
+
+
+def size_of(thing, seen):
+    """Returns the bytes used by thing and everything it holds that isn't
+    in seen, adding all of it to seen."""
+    if id(thing) in seen:
+        return 0
+    seen.add(id(thing))
+
+    size = sys.getsizeof(thing)
+    if isinstance(thing, dict):
+        for key, value in thing.items():
+            size += size_of(key, seen) + size_of(value, seen)
+    elif isinstance(thing, (list, tuple, set, frozenset)):
+        for item in thing:
+            size += size_of(item, seen)
+    else:
+        if hasattr(thing, "__dict__"):
+            size += size_of(thing.__dict__, seen)
+        for kind in type(thing).__mro__:
+            for name in getattr(kind, "__slots__", ()):
+                if hasattr(thing, name):
+                    size += size_of(getattr(thing, name), seen)
+    return size
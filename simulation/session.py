@@ -0,0 +1,134 @@
+from simulation import physics
+
+# A Session is everything about playing a level that changes the physics:
+# aiming, shooting, slowmo, restarting and leaving.  It doesn't draw, play
+# sounds or read the mouse itself, so the same inputs can be fed to one
+# headlessly to get exactly the same game back, like replays do.
+#
+# Ringshot's PlayScreen is a Session with drawing on top.
+
+# the keys that do something while playing.  These are the same numbers as
+# pygame.K_r and pygame.K_ESCAPE.
+RESTART_KEY = ord("r")
+EXIT_KEY = 27
+
+
+class Mouse:
+    """What the mouse did during one frame, like events.mouse."""
+    __slots__ = ("position", "clicked", "released", "held")
+
+    def __init__(self, position, clicked=False, released=False, held=False):
+        self.position = position
+        self.clicked = clicked
+        self.released = released
+        self.held = held
+
+
+class Session:
+    """The state of playing one level."""
+    SLOWMO_MAX = 8.0  # the largest factor of slowmo possible
+    SPEEDUP_FACTOR = 0.05  # how much the slowmo effect "wears off" each frame
+
+    def __init__(self):
+        self.level = None
+        self.slowmo_factor = 1.0  # the coefficient of time-slow.
+        self.balls = []
+        self.players = []
+        self.ball_type = physics.Ball
+        self.start_state = None  # the player's snapshot(), for restarting
+        self.start_buttons = None  # level.snapshot_buttons() at the start
+
+        self.pause_exit = False
+        self.transition = False
+        self.end_ball = None
+
+        self.recorder = None  # given every frame's input, if it's set
+
+    def start_level(self, level, ball_type=None):
+        """Starts playing level from the beginning.  ball_type is the class
+        of ball to play with."""
+        self.level = level
+        self.slowmo_factor = 1.0
+
+        start_ball = physics.new_player(level, ball_type)
+        self.ball_type = type(start_ball)
+        self.start_state = start_ball.snapshot()
+        self.start_buttons = level.snapshot_buttons()
+
+        self.reset_level()
+
+    def reset_level(self, slowmo=False):
+        self.balls = [self.ball_type.from_snapshot(self.start_state)]
+        self.players = [self.balls[0]]
+        self.players[0].point_towards_end(self.level)
+        self.level.restore_buttons(self.start_buttons)
+        if slowmo:
+            self.slowmo_factor = self.SLOWMO_MAX
+
+    def play_frame(self, mouse, pressed_key=None, steps=1):
+        """Handles one frame's input, then runs steps physics steps.
+
+        mouse is a Mouse, or anything else with the same attributes, in
+        level coordinates.  pressed_key is the key pressed this frame.
+        """
+        if self.recorder is not None:
+            self.recorder.add(self, mouse, pressed_key, steps)
+
+        if mouse.released and self.players[0].containing_shells:
+            self.shoot_balls(mouse.position)
+            self.slowmo_factor = 1.0
+
+        if mouse.clicked and self.players[0].containing_shells:
+            self.slowmo_factor = self.SLOWMO_MAX
+
+        if pressed_key == RESTART_KEY:
+            if mouse.held:
+                self.reset_level(True)
+            else:
+                self.reset_level(False)
+
+        elif pressed_key == EXIT_KEY:
+            self.transition = True
+            self.pause_exit = True
+            self.end_ball = self.players[0]
+
+        for _ in range(steps):
+            self.step(mouse)
+            if self.transition:
+                break
+
+    def step(self, mouse):
+        """Moves everything forward by one fixed step of game time, and
+        returns the list of physics events that happened."""
+        if mouse.held and self.players[0].containing_shells:
+            if self.slowmo_factor > 1.0:
+                self.slowmo_factor -= self.SPEEDUP_FACTOR
+
+                if self.slowmo_factor < 1.0:
+                    self.slowmo_factor = 1.0
+
+            for player in self.players:
+                player.rotate_towards(mouse.position, self.slowmo_factor)
+
+        frame_events = physics.step(self.level, self.balls, self.slowmo_factor)
+        for event in frame_events:
+            if event[0] == physics.REACHED_END:
+                self.transition = True
+                self.end_ball = event[1]
+        return frame_events
+
+    def shoot_balls(self, position):
+        """Shoots all player balls towards a specific position."""
+        physics.shoot(self.players, self.balls, position)
+
+    def ball_counts(self):
+        """Returns how many balls are (awake, asleep)."""
+        asleep = physics.count_asleep(self.balls)
+        return len(self.balls) - asleep, asleep
+
+    def state(self):
+        """Returns everything that can differ between two plays of the same
+        level, for checking that they ended up the same."""
+        balls = tuple(ball.snapshot() for ball in self.balls)
+        return (balls, self.level.snapshot_buttons(), self.slowmo_factor,
+                self.transition, self.pause_exit)
@@ -0,0 +1,324 @@
+import concurrent.futures
+import math
+import multiprocessing
+import os
+import sys
+import time
+
+import simulation
+from simulation import cache
+from simulation import physics
+from simulation import world
+
+# Checks whether levels can be beaten, by trying shots until one works.
+#     python -m simulation.solver [level number ...] [--workers N]
+#                                 [--budget SECONDS]
+# Level numbers start at 1, like in the game.  With no level numbers, every
+# level in the level file is checked.
+#
+# A shot is a (wait, angle) pair: how many frames to let everything fall
+# and roll before shooting, and which way to shoot.  The player gets one
+# shot per shell it's holding, and every combination of WAITS and ANGLES
+# is tried for each one, depth first.  After every shot, the solver also
+# tries not shooting again, and lets everything run for SETTLE_FRAMES.
+#
+# The first shots are split between worker processes.  Each worker skips
+# any moment it has already branched from once, in any of its branches,
+# which happens a lot when the player is resting on the floor while it
+# waits.
+WAITS = (0, 20, 45)
+ANGLE_COUNT = 32
+ANGLES = tuple(math.pi * 2.0 * (index / ANGLE_COUNT)
+               for index in range(ANGLE_COUNT))
+SETTLE_FRAMES = 300
+REST_FRAMES = 30  # how long everything has to be still to stop early
+REST_SPEED = 0.1
+
+AIM_DISTANCE = 50.0  # how far from the player the aim point is
+
+# how finely moments are compared when deciding if one was already seen
+SEEN_POSITION = 4.0
+SEEN_VELOCITY = 1.0
+
+
+class Search:
+    """One worker's depth first search through the shots that start with
+    a given first shot."""
+    def __init__(self, level, deadline, stop=None, seen=None):
+        self.level = level
+        self.deadline = deadline  # a time.perf_counter() time
+        self.stop = stop  # a multiprocessing.Event set when it's solved
+        if seen is None:
+            seen = set()
+        self.seen = seen  # seen_key()s of the moments already branched from
+        self.tried = 0  # how many complete shot sequences were run
+
+    def out_of_time(self):
+        if time.perf_counter() > self.deadline:
+            return True
+        return self.stop is not None and self.stop.is_set()
+
+    def search(self, balls, shots, first_shot=None):
+        """Returns a list of shots that beats the level from the moment
+        balls are in, after shots were already taken.  Returns None if
+        there isn't one, or if time runs out first.  balls is changed.
+
+        If first_shot is given, only that shot is tried next.
+        """
+        # the player never has to use all of its shells, so first see what
+        # happens if it stops shooting now
+        start = snapshot(self.level, balls)
+        self.tried += 1
+        if self.settle(balls):
+            return shots
+        restore(self.level, balls, start)
+
+        players = [ball for ball in balls if ball.is_player]
+        if not players or not players[0].containing_shells:
+            return None
+
+        waited = 0
+        for wait in WAITS:
+            if first_shot is not None and wait != first_shot[0]:
+                continue
+
+            if run(self.level, balls, wait - waited):
+                return shots + [(wait, None)]
+            waited = wait
+            if not any(ball.is_player for ball in balls):
+                return None
+
+            # the first shot is filtered, so other branches still have to
+            # try the rest of the shots from the same moment
+            if first_shot is None:
+                key = seen_key(self.level, balls)
+                if key in self.seen:
+                    continue
+                self.seen.add(key)
+
+            moment = snapshot(self.level, balls)
+            for angle in ANGLES:
+                if first_shot is not None and angle != first_shot[1]:
+                    continue
+                if self.out_of_time():
+                    return None
+
+                restore(self.level, balls, moment)
+                players = [ball for ball in balls if ball.is_player]
+                shoot_at_angle(players, balls, angle)
+                found = self.search(balls, shots + [(wait, angle)])
+                if found is not None:
+                    return found
+
+            restore(self.level, balls, moment)
+        return None
+
+    def settle(self, balls):
+        """Runs the level after the last shot, and returns whether it's
+        beaten."""
+        still_frames = 0
+        for _ in range(SETTLE_FRAMES):
+            if run(self.level, balls, 1):
+                return True
+            if not balls:
+                return False
+
+            moving = False
+            for ball in balls:
+                if (abs(ball.x_velocity) > REST_SPEED or
+                        abs(ball.y_velocity) > REST_SPEED):
+                    moving = True
+                    break
+
+            if moving:
+                still_frames = 0
+            else:
+                still_frames += 1
+                if still_frames >= REST_FRAMES:
+                    return False
+        return False
+
+
+def run(level, balls, frames):
+    """Steps the level, and returns whether it was beaten."""
+    for _ in range(frames):
+        for event in physics.step(level, balls):
+            if event[0] == physics.REACHED_END:
+                return True
+    return False
+
+
+def shoot_at_angle(players, balls, angle):
+    player = players[0]
+    target = (player.x + math.cos(angle) * AIM_DISTANCE,
+              player.y + math.sin(angle) * AIM_DISTANCE)
+    physics.shoot(players, balls, target)
+
+
+def snapshot(level, balls):
+    return [ball.snapshot() for ball in balls], level.snapshot_buttons()
+
+
+def restore(level, balls, state):
+    """Puts balls (in place) and level's buttons back to a snapshot()."""
+    ball_states, buttons = state
+    balls[:] = [physics.Ball.from_snapshot(ball_state)
+                for ball_state in ball_states]
+    level.restore_buttons(buttons)
+
+
+def seen_key(level, balls):
+    key = [level.pressed_buttons, level.pressed_bits]
+    for ball in balls:
+        key.append((round(ball.x / SEEN_POSITION),
+                    round(ball.y / SEEN_POSITION),
+                    round(ball.x_velocity / SEEN_VELOCITY),
+                    round(ball.y_velocity / SEEN_VELOCITY),
+                    ball.shell_type, ball.is_player,
+                    tuple(ball.containing_shells or ())))
+    return tuple(key)
+
+
+# in worker processes, solve()'s stop Event and the moments every branch
+# in the process has seen
+stop = None
+seen = None
+
+
+def start_worker(stop_event):
+    global stop, seen
+    stop = stop_event
+    seen = set()
+
+
+def search_branch(level_string, first_shot, deadline):
+    """Searches every shot sequence starting with first_shot, until the
+    time.time() deadline.  Runs in a worker process.  Returns (shots or
+    None, shot sequences tried)."""
+    level = simulation.string_to_level(level_string)
+    seconds = deadline - time.time()
+    search = Search(level, time.perf_counter() + seconds, stop, seen)
+    balls = [physics.new_player(level)]
+    found = search.search(balls, [], first_shot)
+    if found is not None:
+        stop.set()
+    return found, search.tried
+
+
+def beats_level(level, shots):
+    """Runs a list of shots from the solver, and returns whether they beat
+    the level."""
+    balls = [physics.new_player(level)]
+    for wait, angle in shots:
+        if run(level, balls, wait):
+            return True
+        if angle is None:
+            return False
+        shoot_at_angle([ball for ball in balls if ball.is_player], balls,
+                       angle)
+    return Search(level, math.inf).settle(balls)
+
+
+def solve(level, workers=None, seconds=60.0):
+    """Looks for shots that beat a level, spread over worker processes.
+
+    Returns (shots or None, shot sequences tried, seconds taken).  shots
+    is a list of (wait, angle) pairs, where the angle is in radians and
+    is None if the level is beaten during the wait.
+    """
+    level_string = level.to_string()
+    first_shots = [(wait, angle) for wait in WAITS for angle in ANGLES]
+
+    start = time.perf_counter()
+    deadline = time.time() + seconds
+    stop_event = multiprocessing.Event()
+    found = None
+    tried = 0
+    with concurrent.futures.ProcessPoolExecutor(
+            workers, initializer=start_worker,
+            initargs=(stop_event,)) as executor:
+        futures = [executor.submit(search_branch, level_string, first_shot,
+                                   deadline)
+                   for first_shot in first_shots]
+        for future in concurrent.futures.as_completed(futures):
+            if future.result()[0] is not None or time.time() > deadline:
+                break
+
+        # stops the branches that are still running, and waits for them
+        stop_event.set()
+        executor.shutdown(cancel_futures=True)
+
+    for future in futures:
+        if not future.cancelled():
+            shots, branch_tried = future.result()
+            tried += branch_tried
+            if found is None:
+                found = shots
+
+    return found, tried, time.perf_counter() - start
+
+
+def cached_solve(level, workers=None, seconds=60.0, results=None):
+    """Like solve(), but uses the answer saved in the ResultCache results
+    if there is one.  An unsolved answer is only used if it was given at
+    least as many seconds.  Returns (shots or None, shot sequences tried,
+    seconds taken, whether the answer was saved)."""
+    if results is None:
+        results = cache.shared
+
+    key = cache.level_key(level)
+    saved = results.get(cache.SOLUTION, key)
+    if saved is not None:
+        shots, saved_seconds, tried = saved
+        if shots is not None or saved_seconds >= seconds:
+            return shots, tried, 0.0, True
+
+    shots, tried, taken = solve(level, workers, seconds)
+    results.put(cache.SOLUTION, key, (shots, seconds, tried))
+    return shots, tried, taken, False
+
+
+def describe(shots):
+    parts = []
+    for wait, angle in shots:
+        if angle is None:
+            parts.append("wait %d frames" % wait)
+        else:
+            parts.append("wait %d frames, shoot at %.1f degrees"
+                         % (wait, math.degrees(angle)))
+    return "; ".join(parts)
+
+
+if __name__ == "__main__":
+    arguments = sys.argv[1:]
+    workers = os.cpu_count()
+    budget = 60.0
+    level_nums = []
+    while arguments:
+        argument = arguments.pop(0)
+        if argument == "--workers":
+            workers = int(arguments.pop(0))
+        elif argument == "--budget":
+            budget = float(arguments.pop(0))
+        else:
+            level_nums.append(int(argument) - 1)
+
+    if not level_nums:
+        level_nums = range(world.count_levels())
+
+    for level_num in level_nums:
+        level = simulation.load_level(level_num)
+        shots, tried, seconds, saved = cached_solve(level, workers, budget)
+        if saved:
+            speed = "saved"
+        else:
+            speed = "%d shot sequences, %.0f/s" % (tried, tried / seconds)
+
+        if shots is None:
+            print("level %d: unsolved within budget (%s)"
+                  % (level_num + 1, speed))
+        else:
+            print("level %d: %s (%s)"
+                  % (level_num + 1, describe(shots), speed))
+
+    print(cache.shared.report())
@@ -0,0 +1,99 @@
+from simulation import world
+
+# A SpatialHash is a uniform grid of which balls are on which tile, for
+# checks that would otherwise compare every ball with every other ball, or
+# every ball with every button.  Its cells are the level's own tiles, so
+# tiles outside of the level have no cells.
+#
+# physics.step() fills one with the tiles each ball touched on its way
+# during the step, then presses buttons and finds the balls on the end
+# from its cells, looking at each touched tile once.  rebuild() instead
+# fills it with the tiles balls are touching where they are now, for
+# questions like "which balls are touching", which it answers in time that
+# grows with the number of balls rather than its square.  Rebuild it after
+# every physics.step(), since balls move.  Both use the radius that balls
+# hit walls at, Ball.collision_radius().
+
+
+class SpatialHash:
+    """Which balls are on each tile of a level."""
+    def __init__(self, balls=()):
+        self.cells = {}  # (column, row) -> list of balls
+        self.rebuild(balls)
+
+    def rebuild(self, balls):
+        """Puts balls in the cells of the tiles they're touching now, at
+        the radius they hit walls at."""
+        self.cells = {}
+        for ball in balls:
+            position = (ball.x, ball.y)
+            radius = ball.collision_radius()
+            for tile in world.tiles_touching_ball(radius, position):
+                self.add(ball, tile)
+
+    def add(self, ball, tile):
+        """Puts a ball in a tile's cell.  Adding the same ball to a cell
+        again straight away does nothing."""
+        cell = self.cells.get(tile)
+        if cell is None:
+            self.cells[tile] = [ball]
+        elif cell[-1] is not ball:
+            cell.append(ball)
+
+    def balls_on(self, tile):
+        """Returns the balls touching a tile."""
+        return self.cells.get(tile, ())
+
+    def balls_on_buttons(self, level):
+        """Returns (ball, tile) pairs for every unpressed button that a
+        ball is touching."""
+        touching = []
+        for tile, balls in self.cells.items():
+            if level.is_button(tile) and not level.is_pressed(tile):
+                for ball in balls:
+                    touching.append((ball, tile))
+        return touching
+
+    def balls_on_end(self, level):
+        return list(self.balls_on(level.end_tile))
+
+    def pairs(self):
+        """Returns every pair of balls that share a tile, once each.  Balls
+        that don't share one can't be touching."""
+        found = set()
+        pairs = []
+        for balls in self.cells.values():
+            count = len(balls)
+            for first in range(count - 1):
+                ball = balls[first]
+                for other in balls[first + 1:]:
+                    if id(ball) < id(other):
+                        key = (id(ball), id(other))
+                    else:
+                        key = (id(other), id(ball))
+                    if key not in found:
+                        found.add(key)
+                        pairs.append((ball, other))
+        return pairs
+
+    def touching_pairs(self):
+        """Returns every pair of balls that are touching each other."""
+        return [pair for pair in self.pairs() if touching(*pair)]
+
+
+def touching(ball, other):
+    gap_x = ball.x - other.x
+    gap_y = ball.y - other.y
+    reach = ball.collision_radius() + other.collision_radius()
+    return gap_x * gap_x + gap_y * gap_y < reach * reach
+
+
+def touching_pairs_slowly(balls):
+    """Returns the same pairs as SpatialHash.touching_pairs() by checking
+    every pair, for balls that touch inside the level."""
+    pairs = []
+    for first, ball in enumerate(balls):
+        for other in balls[first + 1:]:
+            if touching(ball, other):
+                pairs.append((ball, other))
+    return pairs
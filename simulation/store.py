@@ -0,0 +1,491 @@
+import mmap
+import os
+import sys
+import threading
+import zlib
+
+from simulation import binary
+from simulation import world
+
+# A level file is every level's string, joined by LEVEL_SEPARATOR.  Rather
+# than reading and splitting the whole file whenever one level is needed,
+# a LevelStore finds where every level starts once, and then reads single
+# levels straight out of the file through an mmap.  Counting levels doesn't
+# touch the file at all.
+#
+# Saving a level doesn't rewrite the file.  The level's new string is
+# appended to a journal next to it (the file's path plus JOURNAL_SUFFIX)
+# and synced to disk, and from then on the store reads that level from the
+# journal.  A journal record is a line of "level_num length crc32", then
+# the level string, then a newline.  A crash can only cut off the last
+# record, and a record with the wrong length or CRC is ignored, along with
+# everything after it.  Reading a record more than once does no harm, since
+# each one holds the whole level.
+#
+# Once the journal holds more than COMPACT_BYTES, it's compacted: the file
+# is written out again with every saved level in it, on a background
+# thread, into a temporary file that then replaces the real one, so either
+# the old file or the new one is always there in full.  The replacing is
+# left for the main thread, which closes its mmap of the file first, since
+# Windows can't replace a file that's mapped.  Afterwards, the records that
+# made it into the file are cut off the front of the journal.  If the file
+# can't be replaced, the journal is kept, and compacting isn't tried again
+# until another COMPACT_BYTES have been saved.
+# Adding, deleting and moving levels renumbers them, so those compact the
+# journal first, and then replace the file the same way.
+#
+# If anything else changes the file or the journal, the store notices
+# from their sizes and modification times, and reads them again.
+#
+# A store can also read a binary level pack (see simulation.binary), which
+# it recognises from the pack's magic number.  Packs can't be edited; edit
+# the level file and convert it again.
+SEPARATOR = world.LEVEL_SEPARATOR.encode("ascii")
+JOURNAL_SUFFIX = ".journal"
+COMPACT_BYTES = 256 * 1024
+
+
+class LevelStore:
+    """The levels saved in one level file."""
+    def __init__(self, path=world.LEVEL_FILE):
+        self.path = path
+        self.journal_path = path + JOURNAL_SUFFIX
+        self.file = None
+        self.data = b""  # an mmap of the file, while it isn't empty
+
+        # where each level starts in data, and then one past the end of the
+        # file, as if there was a separator there too.  In a pack, the last
+        # one is where the last record ends, since there are no separators.
+        self.starts = [1]
+        self.gap = 1  # how far apart one level's end and the next's start are
+        self.is_pack = False
+        self.compressed = False
+        self.stamp = None  # the (size, modification time) that was indexed
+
+        self.journaled = {}  # level_num -> string, for levels in the journal
+        self.journal_bytes = 0  # how much of the journal is good records
+        self.journal_stamp = None
+
+        # [thread, journal bytes it includes, the temporary file it wrote
+        # or None, the error if it failed] for the compaction that's
+        # running, or that finished since the last refresh()
+        self.compaction = None
+        # the journal bytes that the next compaction waits for, after one
+        # failed
+        self.retry_bytes = 0
+
+    def refresh(self):
+        """Indexes the file and reads the journal again, if either has
+        changed since they were last read."""
+        self.finish_compaction()
+        stat = os.stat(self.path)
+        stamp = (stat.st_size, stat.st_mtime_ns)
+        journal_stamp = file_stamp(self.journal_path)
+        if stamp == self.stamp and journal_stamp == self.journal_stamp:
+            return
+
+        self.close()
+        if stat.st_size:
+            self.file = open(self.path, 'rb')
+            self.data = mmap.mmap(self.file.fileno(), 0,
+                                  access=mmap.ACCESS_READ)
+
+        if binary.is_pack(self.data):
+            self.is_pack = True
+            self.compressed, self.starts = binary.read_header(self.data)
+            self.gap = 0
+        else:
+            self.starts = find_starts(self.data)
+            self.read_journal()
+        self.stamp = stamp
+        self.journal_stamp = journal_stamp
+
+    def read_journal(self):
+        try:
+            file = open(self.journal_path, 'rb')
+        except FileNotFoundError:
+            return
+        try:
+            journal = file.read()
+        finally:
+            file.close()
+
+        count = len(self.starts) - 1
+        for level_num, string, end in read_records(journal):
+            # a journal left over from another version of the file can
+            # name levels that aren't there any more
+            if level_num < count:
+                self.journaled[level_num] = string
+            self.journal_bytes = end
+
+    def close(self):
+        if self.file is not None:
+            self.data.close()
+            self.file.close()
+        self.file = None
+        self.data = b""
+        self.starts = [1]
+        self.gap = 1
+        self.is_pack = False
+        self.compressed = False
+        self.stamp = None
+        self.journaled = {}
+        self.journal_bytes = 0
+        self.journal_stamp = None
+
+    def count(self):
+        """Returns how many levels are in the file."""
+        self.refresh()
+        return len(self.starts) - 1
+
+    def index(self, level_num):
+        """Returns level_num, with negative numbers counted from the end
+        like list indexes.  Raises IndexError if there's no such level."""
+        count = self.count()
+        if level_num < 0:
+            level_num += count
+        if not 0 <= level_num < count:
+            raise IndexError("there is no level %d" % level_num)
+        return level_num
+
+    def bounds(self, level_num):
+        """Returns where the level at level_num starts and ends in data,
+        which doesn't have the levels saved since the last compaction."""
+        level_num = self.index(level_num)
+        return self.starts[level_num], self.starts[level_num + 1] - self.gap
+
+    def record(self, level_num):
+        """Returns the binary.string_to_record() of a level in a pack."""
+        start, end = self.bounds(level_num)
+        if self.compressed:
+            return zlib.decompress(self.data[start:end])
+        return self.data[start:end]
+
+    def level_string(self, level_num):
+        self.refresh()
+        if self.is_pack:
+            return binary.record_to_string(self.record(level_num))
+        level_num = self.index(level_num)
+        if level_num in self.journaled:
+            return self.journaled[level_num]
+        start, end = self.bounds(level_num)
+        return self.data[start:end].decode("ascii")
+
+    def level_strings(self):
+        """Returns the string of every level in the file."""
+        if not self.count():
+            return []
+        if self.is_pack:
+            return [self.level_string(level_num)
+                    for level_num in range(self.count())]
+        return self.contents().decode("ascii").split(world.LEVEL_SEPARATOR)
+
+    def contents(self):
+        """Returns the bytes that the file would have with the journal
+        compacted into it."""
+        self.refresh()
+        if not self.journaled:
+            return self.data[:]
+        pieces = []
+        position = 0
+        for level_num, string in sorted(self.journaled.items()):
+            start, end = self.bounds(level_num)
+            pieces.append(self.data[position:start])
+            pieces.append(string.encode("ascii"))
+            position = end
+        pieces.append(self.data[position:])
+        return b"".join(pieces)
+
+    def load(self, level_num, new_level=None):
+        """Returns the level at level_num, read into new_level if it's
+        given, like world.string_to_level()."""
+        return parse_level(self.level_data(level_num), new_level)
+
+    def level_data(self, level_num):
+        """Returns what load() parses: the level's string, or its record
+        in a pack.  parse_level() turns it into a level, and doesn't need
+        the store, so it can be done on any thread."""
+        self.refresh()
+        if self.is_pack:
+            return self.record(level_num)
+        return self.level_string(level_num)
+
+    def replace(self, level_num, string):
+        self.replace_many({level_num: string})
+
+    def replace_many(self, strings):
+        """Replaces several levels, given as {level_num: string}, by
+        appending them to the journal and syncing it once."""
+        self.refresh()
+        if self.is_pack:
+            raise ValueError("%s is a level pack, which can't be edited"
+                             % self.path)
+        strings = {self.index(level_num): string
+                   for level_num, string in strings.items()}
+        records = b"".join([make_record(level_num, string)
+                            for level_num, string in strings.items()])
+
+        file = open(self.journal_path, 'ab')
+        try:
+            # anything after the good records was cut off by a crash, and
+            # would hide every record written after it
+            file.truncate(self.journal_bytes)
+            file.write(records)
+            file.flush()
+            os.fsync(file.fileno())
+        finally:
+            file.close()
+
+        self.journaled.update(strings)
+        self.journal_bytes += len(records)
+        self.journal_stamp = file_stamp(self.journal_path)
+        if self.journal_bytes > max(COMPACT_BYTES, self.retry_bytes):
+            self.compact(background=True)
+
+    def compact(self, background=False):
+        """Writes the levels in the journal into the file, and empties the
+        journal.  With background, the file is written on another thread,
+        and the journal is emptied by the first refresh() after it's
+        done."""
+        self.wait_for_compaction()
+        self.refresh()
+        if not self.journaled:
+            return
+
+        data = self.contents()
+        compaction = [None, self.journal_bytes, None, None]
+
+        def write():
+            try:
+                compaction[2] = write_temporary(self.path, data)
+            except OSError as error:
+                compaction[3] = error
+
+        if background:
+            compaction[0] = threading.Thread(target=write, daemon=True)
+            self.compaction = compaction
+            compaction[0].start()
+        else:
+            write()
+            self.compaction = compaction
+            self.finish_compaction()
+            if compaction[3] is not None:
+                raise compaction[3]
+
+    def wait_for_compaction(self):
+        if self.compaction is not None and self.compaction[0] is not None:
+            self.compaction[0].join()
+        self.finish_compaction()
+
+    def finish_compaction(self):
+        """Replaces the file with the one a finished compaction wrote, and
+        cuts the records it includes off the front of the journal."""
+        if self.compaction is None:
+            return
+        compaction = self.compaction
+        thread, included, temporary_path, error = compaction
+        if thread is not None and thread.is_alive():
+            return
+        self.compaction = None
+
+        if temporary_path is not None:
+            self.close()  # the old mapping can't outlive the old file
+            try:
+                replace_file(temporary_path, self.path)
+            except OSError as replace_error:
+                error = compaction[3] = replace_error
+        if error is not None:
+            # nothing is lost, the journal just stays for a while longer
+            print("couldn't compact the journal into %s: %s"
+                  % (self.path, error), file=sys.stderr)
+            self.retry_bytes = included + COMPACT_BYTES
+            return
+        self.retry_bytes = 0
+
+        file = open(self.journal_path, 'rb')
+        try:
+            file.seek(included)
+            rest = file.read()
+        finally:
+            file.close()
+        good_bytes = 0
+        for _, _, good_bytes in read_records(rest):
+            pass
+        rest = rest[:good_bytes]
+        if rest:
+            write_atomically(self.journal_path, rest)
+        else:
+            os.remove(self.journal_path)
+        self.stamp = None  # so that refresh() reads everything again
+
+    def insert(self, level_num, string):
+        """Puts a level string in front of the level at level_num, or at
+        the end if level_num is the number of levels."""
+        self.compact()
+        level = string.encode("ascii")
+        count = self.count()
+        if level_num == count:
+            if count:
+                self.write((self.data[:], SEPARATOR, level))
+            else:
+                self.write((level,))
+        else:
+            start, end = self.bounds(level_num)
+            self.write((self.data[:start], level, SEPARATOR,
+                        self.data[start:]))
+
+    def delete(self, level_num):
+        self.compact()
+        start, end = self.bounds(level_num)
+        if self.count() == 1:
+            self.write(())
+        elif end == len(self.data):
+            # the last level takes the separator before it along with it
+            self.write((self.data[:start - 1],))
+        else:
+            self.write((self.data[:start], self.data[end + 1:]))
+
+    def swap(self, level_num1, level_num2):
+        self.compact()
+        if self.bounds(level_num1) == self.bounds(level_num2):
+            return
+        first, second = sorted((self.bounds(level_num1),
+                                self.bounds(level_num2)))
+        data = self.data
+        self.write((data[:first[0]], data[second[0]:second[1]],
+                    data[first[1]:second[0]], data[first[0]:first[1]],
+                    data[second[1]:]))
+
+    def write(self, pieces):
+        """Replaces the file with pieces of bytes, joined together.  The
+        journal has to be compacted first."""
+        if self.is_pack:
+            raise ValueError("%s is a level pack, which can't be edited"
+                             % self.path)
+        data = b"".join(pieces)
+        self.close()  # the old mapping can't outlive the old file
+        write_atomically(self.path, data)
+        self.refresh()
+
+
+def parse_level(level_data, new_level=None):
+    """Turns a LevelStore.level_data() into a level, read into new_level
+    if it's given."""
+    if isinstance(level_data, str):
+        return world.string_to_level(level_data, new_level)
+    return binary.record_to_level(level_data, new_level)
+
+
+def find_starts(data):
+    """Returns where each level in data starts, followed by one past the
+    end of data."""
+    starts = [0]
+    position = data.find(SEPARATOR)
+    while position != -1:
+        starts.append(position + 1)
+        position = data.find(SEPARATOR, position + 1)
+
+    if len(starts) == 1 and (not data or data[:].isspace()):
+        return [len(data) + 1]  # an empty file has no levels
+    starts.append(len(data) + 1)
+    return starts
+
+
+def make_record(level_num, string):
+    """Returns the journal record that saves string as level_num."""
+    level = string.encode("ascii")
+    return b"%d %d %08x\n%s\n" % (level_num, len(level), zlib.crc32(level),
+                                  level)
+
+
+def read_records(journal):
+    """Yields (level_num, string, where the record ends) for each good
+    record at the start of journal, stopping at the first bad one."""
+    position = 0
+    while position < len(journal):
+        line_end = journal.find(b"\n", position)
+        if line_end == -1:
+            return
+        try:
+            level_num, length, crc = journal[position:line_end].split()
+            level_num = int(level_num)
+            length = int(length)
+            crc = int(crc, 16)
+        except ValueError:
+            return
+
+        start = line_end + 1
+        end = start + length
+        level = journal[start:end]
+        if journal[end:end + 1] != b"\n" or zlib.crc32(level) != crc \
+                or level_num < 0:
+            return
+        position = end + 1
+        yield level_num, level.decode("ascii"), position
+
+
+def write_atomically(path, data):
+    """Replaces the file at path with data, so that if anything goes wrong
+    part way through, the old file is still there in full."""
+    replace_file(write_temporary(path, data), path)
+
+
+def write_temporary(path, data):
+    """Writes data to a new file next to path, and returns its path.  The
+    file is removed again if writing it fails."""
+    temporary_path = "%s.%d.tmp" % (path, os.getpid())
+    written = False
+    try:
+        file = open(temporary_path, 'wb')
+        try:
+            file.write(data)
+            file.flush()
+            os.fsync(file.fileno())
+        finally:
+            file.close()
+        written = True
+    finally:
+        if not written:
+            remove_file(temporary_path)
+    return temporary_path
+
+
+def replace_file(temporary_path, path):
+    """Moves the file at temporary_path over the one at path, or removes it
+    if that fails."""
+    replaced = False
+    try:
+        os.replace(temporary_path, path)
+        replaced = True
+    finally:
+        if not replaced:
+            remove_file(temporary_path)
+
+
+def remove_file(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+def file_stamp(path):
+    """Returns the (size, modification time) of the file at path, or None
+    if there isn't one."""
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return stat.st_size, stat.st_mtime_ns
+
+
+# one store per level file, so that each one is only indexed once
+stores = {}
+
+
+def open_store(path=world.LEVEL_FILE):
+    store = stores.get(path)
+    if store is None:
+        store = LevelStore(path)
+        stores[path] = store
+    return store
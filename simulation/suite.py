@@ -0,0 +1,313 @@
+import json
+import math
+import os
+import random
+import sys
+import time
+import tracemalloc
+
+import simulation
+from simulation import benchmarks
+from simulation import world
+
+# The physics benchmark suite.  It fires the same seeded shots at every
+# level in the level file, through the real physics, and measures:
+#   steps_per_second     ball steps per second, where a ball step is one
+#                        ball moving one frame, with one check_collision()
+#   bounces_per_second   Ball.bounce() calls per second of stepping
+#   peak_bytes_per_step  how far traced memory rises during a frame, per
+#                        ball step, from tracemalloc
+#   blocks_per_step      how many more memory blocks are allocated after
+#                        a frame than before it, per ball step
+# along with the number of ball steps and bounces, which only change when
+# the physics does.  Python doesn't count every allocation, so the peak is
+# the nearest thing to how much a step allocates.
+#
+#     python -m simulation.suite [--output FILE] [--baseline FILE]
+#                                [--save-baseline] [--counts FILE]
+#                                [--save-counts]
+#
+# The results are written as JSON to the output file ("-" prints them),
+# then compared with two others:
+# - the counts file, COUNTS_FILE, which is kept with the code and only
+#   holds each level's step and bounce counts.  Those are the same on
+#   every machine, so any change means the physics changed.  Save them
+#   again with --save-counts after changing the physics on purpose.
+# - the baseline, which holds all of the results.  Timings depend on the
+#   machine, so it isn't kept with the code; save one with --save-baseline
+#   on the machine being compared before changing anything.  Totals more
+#   than TOLERANCE worse than it are problems.
+# Problems are printed and make the exit status 1.
+SEED = 0
+SHOTS = 8  # per level
+FRAMES = 300  # per shot
+REPEATS = 3  # timed runs of each level, of which the quickest is kept
+TOLERANCE = 0.1
+
+BASELINE_FILE = "benchmark_baseline.json"
+COUNTS_FILE = "suite_counts.json"
+
+# the totals compared with the baseline, and whether bigger is better
+COMPARED = (
+    ("steps_per_second", True),
+    ("bounces_per_second", True),
+    ("peak_bytes_per_step", False),
+    ("blocks_per_step", False),
+)
+
+
+class CountingBall(simulation.Ball):
+    """A Ball that counts every bounce, even the ones too quiet to make a
+    BOUNCED event."""
+    __slots__ = ()
+    bounces = 0
+
+    def bounce(self, normal_x, normal_y, events=None):
+        CountingBall.bounces += 1
+        simulation.Ball.bounce(self, normal_x, normal_y, events)
+
+
+def shots(level_num):
+    """Returns the (angle, power) of every shot fired at a level."""
+    randomizer = random.Random("%d %d" % (SEED, level_num))
+    return [(randomizer.uniform(0.0, math.pi * 2.0),
+             randomizer.uniform(4.0, 20.0)) for _ in range(SHOTS)]
+
+
+def fire(level, level_num, ball_type=None, step=simulation.step):
+    """Fires every shot at a level, running each one for FRAMES frames
+    with step(level, balls).  Returns the number of ball steps."""
+    start_buttons = level.snapshot_buttons()
+    ball_steps = 0
+    for angle, power in shots(level_num):
+        level.restore_buttons(start_buttons)
+        balls = benchmarks.shot_balls(level, angle, ball_type, power)
+        for _ in range(FRAMES):
+            if not balls:
+                break
+            ball_steps += len(balls)
+            step(level, balls)
+    level.restore_buttons(start_buttons)
+    return ball_steps
+
+
+def seconds_to_fire(level, level_num):
+    fastest = math.inf
+    for _ in range(REPEATS):
+        start = time.perf_counter()
+        fire(level, level_num)
+        fastest = min(fastest, time.perf_counter() - start)
+    return fastest
+
+
+def memory_used_firing(level, level_num):
+    """Returns (peak bytes, blocks left allocated), added up over every
+    frame of fire()."""
+    totals = [0, 0]
+
+    def measured_step(level, balls):
+        blocks = sys.getallocatedblocks()
+        tracemalloc.reset_peak()
+        current = tracemalloc.get_traced_memory()[0]
+        simulation.step(level, balls)
+        totals[0] += tracemalloc.get_traced_memory()[1] - current
+        totals[1] += sys.getallocatedblocks() - blocks
+
+    tracemalloc.start()
+    try:
+        fire(level, level_num, step=measured_step)
+    finally:
+        tracemalloc.stop()
+    return totals[0], totals[1]
+
+
+def measure_level(level, level_num):
+    CountingBall.bounces = 0
+    ball_steps = fire(level, level_num, CountingBall)
+    bounces = CountingBall.bounces
+
+    seconds = seconds_to_fire(level, level_num)
+    peak_bytes, blocks = memory_used_firing(level, level_num)
+    return results(ball_steps, bounces, seconds, peak_bytes, blocks)
+
+
+def results(ball_steps, bounces, seconds, peak_bytes, blocks):
+    divisor = max(ball_steps, 1)
+    return {
+        "steps": ball_steps,
+        "bounces": bounces,
+        "seconds": seconds,
+        "steps_per_second": ball_steps / seconds,
+        "bounces_per_second": bounces / seconds,
+        "peak_bytes_per_step": peak_bytes / divisor,
+        "blocks_per_step": blocks / divisor,
+    }
+
+
+def run_suite(level_nums=None):
+    """Measures every level, and returns the results as a dictionary that
+    can be saved as JSON."""
+    if level_nums is None:
+        level_nums = range(world.count_levels())
+
+    levels = {}
+    totals = [0, 0, 0.0, 0.0, 0.0]
+    for level_num in level_nums:
+        level = simulation.load_level(level_num)
+        level_results = measure_level(level, level_num)
+        levels[str(level_num + 1)] = level_results
+
+        steps = level_results["steps"]
+        totals[0] += steps
+        totals[1] += level_results["bounces"]
+        totals[2] += level_results["seconds"]
+        totals[3] += level_results["peak_bytes_per_step"] * steps
+        totals[4] += level_results["blocks_per_step"] * steps
+
+    return {
+        "seed": SEED,
+        "shots": SHOTS,
+        "frames": FRAMES,
+        "levels": levels,
+        "total": results(*totals),
+    }
+
+
+def counts(suite_results):
+    """Returns the parts of results from run_suite() that don't depend on
+    the machine: the shots fired, and each level's step and bounce
+    counts."""
+    return {
+        "seed": suite_results["seed"],
+        "shots": suite_results["shots"],
+        "frames": suite_results["frames"],
+        "levels": {name: {"steps": level["steps"],
+                          "bounces": level["bounces"]}
+                   for name, level in suite_results["levels"].items()},
+    }
+
+
+def compare_counts(new, old):
+    """Returns a line of text for every level whose step or bounce count
+    in the new results differs from the old ones.  old can be results
+    from run_suite() or counts()."""
+    if (new["seed"], new["shots"], new["frames"]) != \
+            (old["seed"], old["shots"], old["frames"]):
+        return ["the counts are for different shots"]
+
+    problems = []
+    for name in sorted(new["levels"], key=int):
+        if name not in old["levels"]:
+            continue
+        for key in ("steps", "bounces"):
+            new_count = new["levels"][name][key]
+            old_count = old["levels"][name][key]
+            if new_count != old_count:
+                problems.append("level %s: %s changed from %d to %d"
+                                % (name, key, old_count, new_count))
+    return problems
+
+
+def compare(new, old):
+    """Returns a line of text for every way the new results from
+    run_suite() are slower or use more memory than the old ones."""
+    if (new["seed"], new["shots"], new["frames"]) != \
+            (old["seed"], old["shots"], old["frames"]):
+        return ["the baseline fired different shots"]
+
+    problems = []
+    # single levels run too quickly to time reliably, so only the totals
+    # are compared
+    for key, bigger_is_better in COMPARED:
+        new_value = new["total"][key]
+        old_value = old["total"][key]
+        if bigger_is_better:
+            worse = new_value < old_value * (1.0 - TOLERANCE)
+        else:
+            # blocks_per_step is usually below 1, so tiny changes to it
+            # don't count
+            worse = new_value > old_value * (1.0 + TOLERANCE) + 0.01
+        if worse:
+            problems.append("%s went from %.2f to %.2f"
+                            % (key, old_value, new_value))
+    return problems
+
+
+def describe(suite_results):
+    total = suite_results["total"]
+    return ("%d ball steps, %d bounces in %.2f s: %.0f steps/s, "
+            "%.0f bounces/s, %.0f peak bytes/step, %.3f blocks/step"
+            % (total["steps"], total["bounces"], total["seconds"],
+               total["steps_per_second"], total["bounces_per_second"],
+               total["peak_bytes_per_step"], total["blocks_per_step"]))
+
+
+def save(suite_results, path):
+    file = open(path, 'w')
+    json.dump(suite_results, file, indent=1, sort_keys=True)
+    file.write("\n")
+    file.close()
+
+
+def load(path):
+    file = open(path, 'r')
+    suite_results = json.load(file)
+    file.close()
+    return suite_results
+
+
+if __name__ == "__main__":
+    arguments = sys.argv[1:]
+    output = None
+    baseline_path = BASELINE_FILE
+    save_baseline = False
+    counts_path = COUNTS_FILE
+    save_counts = False
+    while arguments:
+        argument = arguments.pop(0)
+        if argument == "--output":
+            output = arguments.pop(0)
+        elif argument == "--baseline":
+            baseline_path = arguments.pop(0)
+        elif argument == "--save-baseline":
+            save_baseline = True
+        elif argument == "--counts":
+            counts_path = arguments.pop(0)
+        elif argument == "--save-counts":
+            save_counts = True
+        else:
+            sys.exit("unknown argument: " + argument)
+
+    suite_results = run_suite()
+    if output == "-":
+        json.dump(suite_results, sys.stdout, indent=1, sort_keys=True)
+        print()
+    elif output is not None:
+        save(suite_results, output)
+    print(describe(suite_results), file=sys.stderr)
+
+    problems = []
+    if save_counts:
+        save(counts(suite_results), counts_path)
+        print("saved the counts to " + counts_path, file=sys.stderr)
+    elif os.path.exists(counts_path):
+        problems += compare_counts(suite_results, load(counts_path))
+    else:
+        print("no counts to compare with, save them with --save-counts",
+              file=sys.stderr)
+
+    if save_baseline:
+        save(suite_results, baseline_path)
+        print("saved the baseline to " + baseline_path, file=sys.stderr)
+    elif os.path.exists(baseline_path):
+        baseline = load(baseline_path)
+        print("baseline: " + describe(baseline), file=sys.stderr)
+        problems += compare(suite_results, baseline)
+    else:
+        print("no baseline to compare with, save one with --save-baseline",
+              file=sys.stderr)
+
+    for problem in problems:
+        print(problem, file=sys.stderr)
+    if problems:
+        sys.exit(1)
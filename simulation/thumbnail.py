@@ -0,0 +1,69 @@
+from simulation import cache
+from simulation import world
+
+# A level's thumbnail only shows which of its block tiles aren't empty, so
+# all a thumbnail needs is a mask of them: bytes laid out like Layer.tiles,
+# with a 1 for every tile that isn't empty and a 0 for every one that is.
+# Masks are saved in the ResultCache under the level's key, so once a
+# level's has been made, showing its thumbnail never needs the level to be
+# parsed again, even after the game restarts.  levels.Thumbnails turns them
+# into surfaces.
+#
+# Nothing is made until it's asked for, and the menu only asks for the
+# levels on the page it's showing.
+
+# for bytes.translate(), to turn tiles into a mask
+NOT_EMPTY = bytes(tile != world.EMPTY for tile in range(256))
+
+
+class ThumbnailMasks:
+    """The thumbnail mask of each level in a repository.LevelRepository,
+    made when it's first needed."""
+    def __init__(self, level_repository, results=None):
+        self.repository = level_repository
+        self.results = results  # the ResultCache, or None for cache.shared
+
+        # level_num -> level key, while the repository hasn't changed
+        self.keys = {}
+        self.changes = level_repository.changes
+        self.masks = {}  # level key -> mask
+
+        self.made = 0  # masks that had to be made from the level
+
+    def load(self, level_nums):
+        """Makes sure the masks of every level in level_nums are ready."""
+        for level_num in level_nums:
+            self.mask(level_num)
+
+    def mask(self, level_num):
+        """Returns (the level's key, its mask)."""
+        key = self.key(level_num)
+        mask = self.masks.get(key)
+        if mask is None:
+            results = self.results
+            if results is None:
+                results = cache.shared
+            mask = results.get(cache.THUMBNAIL, key)
+            if mask is None:
+                mask = layer_mask(self.repository.block_layer(level_num))
+                results.put(cache.THUMBNAIL, key, mask)
+                self.made += 1
+            self.masks[key] = mask
+        return key, mask
+
+    def key(self, level_num):
+        # saving, adding or moving levels can change any level_num's key
+        if self.changes != self.repository.changes:
+            self.changes = self.repository.changes
+            self.keys.clear()
+
+        key = self.keys.get(level_num)
+        if key is None:
+            key = self.repository.level_key(level_num)
+            self.keys[level_num] = key
+        return key
+
+
+def layer_mask(layer):
+    """Returns the mask of a layer's tiles."""
+    return bytes(layer.tiles).translate(NOT_EMPTY)
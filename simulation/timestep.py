@@ -0,0 +1,68 @@
+import constants
+
+# The physics always moves forward in steps of exactly one STEP of game
+# time, however long frames take to draw.  Real time is saved up in an
+# accumulator, and every frame runs as many whole steps as have built up.
+# Whatever is left over (less than one step) is the fraction of the way
+# to the next step, which drawing uses to place balls in between where
+# they were and where they are, so motion stays smooth when a frame gets
+# 0 or 2 steps instead of 1.
+STEP = 1.0 / constants.FPS  # seconds of game time per physics step
+
+
+class FixedStep:
+    """Decides how many physics steps to run each frame."""
+    MAX_STEPS = 5  # the most steps per frame at normal speed
+
+    def __init__(self, speed=1.0):
+        self.speed = speed  # how many seconds of game time per real second
+        self.accumulator = 0.0
+        self.alpha = 0.0  # how far between the last two steps to draw
+
+        # counted since reset_ratio(), for sim_ratio()
+        self.steps = 0
+        self.frames = 0
+
+    def advance(self, seconds):
+        """Saves up seconds of real time, and returns how many steps to
+        run this frame.  Time past MAX_STEPS is dropped, so that one very
+        slow frame slows the game down rather than making every frame
+        after it slow too."""
+        self.accumulator += seconds * self.speed
+
+        most = int(self.MAX_STEPS * max(1.0, self.speed))
+        steps = int(self.accumulator / STEP)
+        if steps > most:
+            steps = most
+            self.accumulator = STEP * steps
+
+        self.accumulator -= STEP * steps
+        self.alpha = self.accumulator / STEP
+
+        self.steps += steps
+        self.frames += 1
+        return steps
+
+    def reset(self):
+        """Forgets saved up time, like after loading a level."""
+        self.accumulator = 0.0
+        self.alpha = 0.0
+
+    def sim_ratio(self):
+        """Returns the average number of steps run per frame drawn."""
+        if self.frames == 0:
+            return 0.0
+        return self.steps / self.frames
+
+    def reset_ratio(self):
+        self.steps = 0
+        self.frames = 0
+
+
+def run_steps(update, seconds):
+    """Calls update once for every step in seconds of game time, as fast
+    as possible, without drawing.  Returns how many steps were run."""
+    steps = round(seconds / STEP)
+    for _ in range(steps):
+        update()
+    return steps
@@ -0,0 +1,74 @@
+import math
+
+# Geometry done with plain (x, y) vectors and dot products, for the parts of
+# the physics that run every frame.  Unlike geometry.py, nothing here uses
+# slopes, angles or trig, so vertical walls aren't a special case.
+
+
+class Wall:
+    """A line segment that balls bounce off of, with the numbers the
+    physics needs about it worked out ahead of time."""
+    __slots__ = ("point1", "point2", "along_x", "along_y", "length_squared",
+                 "normal_x", "normal_y")
+
+    def __init__(self, point1, point2):
+        self.point1 = point1
+        self.point2 = point2
+
+        self.along_x = point2[0] - point1[0]
+        self.along_y = point2[1] - point1[1]
+        self.length_squared = dot(self.along_x, self.along_y,
+                                  self.along_x, self.along_y)
+
+        # one of the two unit normals, the other is just the opposite
+        length = math.sqrt(self.length_squared)
+        self.normal_x = -self.along_y / length
+        self.normal_y = self.along_x / length
+
+
+def dot(x1, y1, x2, y2):
+    return x1 * x2 + y1 * y2
+
+
+def point_and_wall(x, y, wall):
+    """Returns (distance squared, offset x, offset y) from the closest point
+    on a Wall to the point (x, y).  The offset points from the wall
+    towards the point.
+    """
+    offset_x = x - wall.point1[0]
+    offset_y = y - wall.point1[1]
+    along = dot(offset_x, offset_y, wall.along_x, wall.along_y)
+    if along > 0.0:
+        if along >= wall.length_squared:
+            offset_x -= wall.along_x
+            offset_y -= wall.along_y
+        else:
+            # the closest point is on the flat side, straight out along
+            # the normal
+            gap = dot(offset_x, offset_y, wall.normal_x, wall.normal_y)
+            return gap * gap, gap * wall.normal_x, gap * wall.normal_y
+    return offset_x * offset_x + offset_y * offset_y, offset_x, offset_y
+
+
+def reflect(x, y, normal_x, normal_y):
+    """Returns the vector (x, y) bounced off of a surface with the given
+    unit normal."""
+    twice = 2.0 * dot(x, y, normal_x, normal_y)
+    return x - twice * normal_x, y - twice * normal_y
+
+
+def along_surface(x, y, normal_x, normal_y):
+    """Returns how much of the vector (x, y) points along a surface with
+    the given unit normal.  The direction along the surface counts as
+    positive if it goes right, or down if the surface is a vertical wall.
+    """
+    if normal_y > 0.0:
+        return dot(x, y, normal_y, -normal_x)
+    if normal_y < 0.0:
+        return dot(x, y, -normal_y, normal_x)
+    return y
+
+
+def is_flat(normal_x, normal_y):
+    """Returns whether a surface with the given unit normal is level."""
+    return abs(normal_x) < 0.0001 * abs(normal_y)
@@ -0,0 +1,596 @@
+import constants
+from simulation import cache
+from simulation import mesh
+
+# Note that the levels in levels.txt are saved flipped along the bottom-left
+# top-right diagonal - that is, each "row" in the file is actually a column
+# in-game, and vice versa.  This is so that when retrieving things from the
+# 2D matrix that represents the level, the x coordinate comes first and the
+# y coordinate comes second.
+
+WIDTH = constants.LEVEL_WIDTH
+HEIGHT = constants.LEVEL_HEIGHT
+PIXEL_WIDTH = WIDTH * constants.TILE_WIDTH
+PIXEL_HEIGHT = HEIGHT * constants.TILE_HEIGHT
+
+LAYER_ID_COUNTS = (8, 9)
+EMPTY = 1
+BLOCKS_WALL = 2
+# The corner blocks are named based off of the two flat sides of the block.
+# For example, on BLOCKS_TOPLEFT, the top and left sides are flat, and the
+# diagonal is from the topright to the bottomleft.
+BLOCKS_TOPLEFT = 3
+BLOCKS_TOPRIGHT = 4
+BLOCKS_BOTTOMRIGHT = 5
+BLOCKS_BOTTOMLEFT = 6
+BLOCKS_START = 7
+BLOCKS_END = 8
+
+SIDE_TOP = 1
+SIDE_RIGHT = 2
+SIDE_BOTTOM = 3
+SIDE_LEFT = 4
+SIDE_DIAGONAL = 5
+
+# which sides of each block are solid, for the blocks that can be bounced off
+BLOCK_SIDES = {
+    BLOCKS_WALL: (SIDE_TOP, SIDE_RIGHT, SIDE_BOTTOM, SIDE_LEFT),
+    BLOCKS_TOPLEFT: (SIDE_TOP, SIDE_LEFT, SIDE_DIAGONAL),
+    BLOCKS_TOPRIGHT: (SIDE_TOP, SIDE_RIGHT, SIDE_DIAGONAL),
+    BLOCKS_BOTTOMRIGHT: (SIDE_BOTTOM, SIDE_RIGHT, SIDE_DIAGONAL),
+    BLOCKS_BOTTOMLEFT: (SIDE_BOTTOM, SIDE_LEFT, SIDE_DIAGONAL),
+}
+
+BUTTONS_LEFT = 2
+BUTTONS_UP = 3
+BUTTONS_RIGHT = 4
+BUTTONS_DOWN = 5
+BUTTONS_TOPLEFT = 6
+BUTTONS_TOPRIGHT = 7
+BUTTONS_BOTTOMRIGHT = 8
+BUTTONS_BOTTOMLEFT = 9
+
+
+LAYER_COUNT = constants.LAYERS
+LAYER_BLOCKS = constants.LAYER_BLOCKS
+LAYER_BUTTONS = constants.LAYER_BUTTONS
+
+
+# these are the characters that split up the different parts of levels.txt.
+LEVEL_SEPARATOR = '*'    # character that separates each level
+LAYER_SEPARATOR = '~'    # character that separates each layer in the level
+COLUMN_SEPARATOR = '\n'  # character that separates each column in the level
+TILE_SEPARATOR = ' '     # character that separates each tile in the column
+
+LEVEL_FILE = "levels.txt"
+
+
+def load_level(level_num, path=LEVEL_FILE):
+    """Returns the level saved in the level file, at index level_num.
+
+    Unlike levels.load_level(), the returned Level can't be drawn, but
+    loading it doesn't need pygame.
+    """
+    from simulation import store  # which imports this module
+    return store.open_store(path).load(level_num)
+
+
+# where each (column, row) in a level is in Layer.tiles, and which bit it is
+# in Level.pressed_bits.  Looking a position up here is quicker than
+# checking its bounds and then indexing, and positions outside of the level
+# just aren't found.
+TILE_INDEXES = {(column, row): column * HEIGHT + row
+                for column in range(WIDTH) for row in range(HEIGHT)}
+
+
+def out_of_bounds(tile_position):
+    """Returns whether a (column, row) pair is a valid coordinate inside
+    the level.
+    """
+    if 0 <= tile_position[0] < WIDTH and 0 <= tile_position[1] < HEIGHT:
+        return False
+    return True
+
+
+def string_to_layer(string, new_layer=None):
+    """Takes a string and converts it into a Layer object.
+
+    If new_layer is given, the string is read into it instead of into a
+    brand new Layer.
+    """
+    columns = string.split(COLUMN_SEPARATOR)
+
+    tiles = bytearray()
+    for column in columns[:WIDTH]:
+        tiles += bytes(map(int, column.split(TILE_SEPARATOR)[:HEIGHT]))
+    if len(tiles) != WIDTH * HEIGHT:
+        raise IndexError("a layer has %d tiles, not %d"
+                         % (len(tiles), WIDTH * HEIGHT))
+
+    if new_layer is None:
+        new_layer = Layer()
+    new_layer.tiles = tiles
+    return new_layer
+
+
+def count_levels(path=LEVEL_FILE):
+    """Returns how many levels are saved in the level file."""
+    from simulation import store
+    return store.open_store(path).count()
+
+
+def string_to_level(string, new_level=None):
+    """Takes a string and converts it into a Level object.
+
+    If new_level is given, the string is read into it instead of into a
+    brand new Level.
+    """
+    new_level = read_level_string(string, new_level)
+    new_level.build_mesh()
+    return new_level
+
+
+def read_level_string(string, new_level=None):
+    """Like string_to_level(), but doesn't build the level's collision
+    mesh, so that it can be timed on its own."""
+    strings = string.split(LAYER_SEPARATOR)
+
+    shell_strings = strings[0]
+    shell_values = [int(shell) for shell in shell_strings.split()]
+
+    start_end_string = strings[1]
+    start_end_values = [int(value) for value in start_end_string.split()]
+
+    if new_level is None:
+        new_level = Level()
+    new_level.unshare()
+
+    layer_strings = strings[2:]
+    for layer_num, layer_string in enumerate(layer_strings):
+        string_to_layer(layer_string, new_level.layers[layer_num])
+
+    new_level.field = None
+
+    new_level.start_tile = (start_end_values[0], start_end_values[1])
+    new_level.end_tile = (start_end_values[2], start_end_values[3])
+    new_level.start_shells = shell_values
+    new_level.total_buttons = 0
+    for column in range(WIDTH):
+        for row in range(HEIGHT):
+            if new_level.is_button((column, row)):
+                new_level.total_buttons += 1
+    return new_level
+
+
+def read_layer_string(string, layer_num, new_layer=None):
+    """Reads only one layer of a level string, into new_layer if it's
+    given, like string_to_layer()."""
+    layer_string = string.split(LAYER_SEPARATOR)[2 + layer_num]
+    return string_to_layer(layer_string, new_layer)
+
+
+def grid_tile_position(point):
+    """Returns the row and column of the tile that the given point is on."""
+    column = int(point[0] // constants.TILE_WIDTH)
+    row = int(point[1] // constants.TILE_HEIGHT)
+
+    if not out_of_bounds((column, row)):
+        return column, row
+    else:
+        return None
+
+
+def tile_pixel_position(tile_position):
+    """Returns the top left corner of a given tile."""
+    column, row = tile_position
+    return column * constants.TILE_WIDTH, row * constants.TILE_HEIGHT
+
+
+def middle_pixel(tile_position):
+    x = tile_position[0] * constants.TILE_WIDTH + constants.TILE_WIDTH // 2
+    y = tile_position[1] * constants.TILE_HEIGHT + constants.TILE_HEIGHT // 2
+    return x, y
+
+
+# every (column, row) pair, made once so tiles_touching_ball() can hand
+# them out without making new ones
+TILE_POSITIONS = [[(column, row) for row in range(HEIGHT)]
+                  for column in range(WIDTH)]
+
+
+def tiles_touching_ball(radius, ball_center):
+    """Yields the (column, row) pair of every tile that the ball touches,
+    meaning some part of the tile is closer than radius to ball_center.
+    Tiles outside of the level are skipped.
+    """
+    center_x, center_y = ball_center
+    radius_squared = radius * radius
+
+    first_column = max(int((center_x - radius) // constants.TILE_WIDTH), 0)
+    last_column = int((center_x + radius) // constants.TILE_WIDTH)
+    last_column = min(last_column, WIDTH - 1)
+    first_row = max(int((center_y - radius) // constants.TILE_HEIGHT), 0)
+    last_row = int((center_y + radius) // constants.TILE_HEIGHT)
+    last_row = min(last_row, HEIGHT - 1)
+
+    for column in range(first_column, last_column + 1):
+        left = column * constants.TILE_WIDTH
+        if center_x < left:
+            gap_x = left - center_x
+        elif center_x > left + constants.TILE_WIDTH:
+            gap_x = center_x - left - constants.TILE_WIDTH
+        else:
+            gap_x = 0.0
+        room = radius_squared - gap_x * gap_x
+
+        positions = TILE_POSITIONS[column]
+        for row in range(first_row, last_row + 1):
+            top = row * constants.TILE_HEIGHT
+            if center_y < top:
+                gap_y = top - center_y
+            elif center_y > top + constants.TILE_HEIGHT:
+                gap_y = center_y - top - constants.TILE_HEIGHT
+            else:
+                gap_y = 0.0
+
+            if gap_y * gap_y < room:
+                yield positions[row]
+
+
+def tiles_near_path(radius, start, end):
+    """Yields the (column, row) pair of every tile in the box around a ball
+    moving in a straight line from start to end.  This includes every
+    tile the ball touches, and some it doesn't.
+    """
+    left_x, right_x = min(start[0], end[0]), max(start[0], end[0])
+    top_y, bottom_y = min(start[1], end[1]), max(start[1], end[1])
+    first_column = max(int((left_x - radius) // constants.TILE_WIDTH), 0)
+    last_column = int((right_x + radius) // constants.TILE_WIDTH)
+    last_column = min(last_column, WIDTH - 1)
+    first_row = max(int((top_y - radius) // constants.TILE_HEIGHT), 0)
+    last_row = int((bottom_y + radius) // constants.TILE_HEIGHT)
+    last_row = min(last_row, HEIGHT - 1)
+
+    for column in range(first_column, last_column + 1):
+        positions = TILE_POSITIONS[column]
+        for row in range(first_row, last_row + 1):
+            yield positions[row]
+
+
+def tiles_touching_path(radius, start, end):
+    """Yields the (column, row) pair of every tile that a ball touches
+    while moving in a straight line from start to end.
+    """
+    for tile_position in tiles_near_path(radius, start, end):
+        if path_touches_tile(radius, start, end, tile_position):
+            yield tile_position
+
+
+def path_touches_tile(radius, start, end, tile_position):
+    """Returns whether a ball moving in a straight line from start to end
+    touches the tile at tile_position."""
+    left, top = tile_pixel_position(tile_position)
+    right = left + constants.TILE_WIDTH
+    bottom = top + constants.TILE_HEIGHT
+
+    start_x, start_y = start
+    delta_x = end[0] - start_x
+    delta_y = end[1] - start_y
+    length_squared = delta_x * delta_x + delta_y * delta_y
+    if length_squared == 0.0:
+        return point_and_rect_gap(start, left, top, right, bottom) < radius ** 2
+
+    # the path runs through the tile
+    if path_crosses_rect(start, delta_x, delta_y, left, top, right, bottom):
+        return True
+
+    # otherwise, the closest the two get is at one end of the path or at
+    # one corner of the tile
+    gap = min(point_and_rect_gap(start, left, top, right, bottom),
+              point_and_rect_gap(end, left, top, right, bottom))
+    for corner_x, corner_y in ((left, top), (right, top),
+                               (left, bottom), (right, bottom)):
+        along = (corner_x - start_x) * delta_x + (corner_y - start_y) * delta_y
+        along = min(max(along / length_squared, 0.0), 1.0)
+        gap_x = start_x + delta_x * along - corner_x
+        gap_y = start_y + delta_y * along - corner_y
+        gap = min(gap, gap_x * gap_x + gap_y * gap_y)
+
+    return gap < radius ** 2
+
+
+def point_and_rect_gap(point, left, top, right, bottom):
+    """Returns the squared distance from a point to the nearest part of a
+    rectangle, which is 0 if the point is inside."""
+    gap_x = max(left - point[0], 0.0, point[0] - right)
+    gap_y = max(top - point[1], 0.0, point[1] - bottom)
+    return gap_x * gap_x + gap_y * gap_y
+
+
+def path_crosses_rect(start, delta_x, delta_y, left, top, right, bottom):
+    """Returns whether the line segment from start to start + delta passes
+    through a rectangle."""
+    enter = 0.0
+    leave = 1.0
+    for position, delta, low, high in ((start[0], delta_x, left, right),
+                                       (start[1], delta_y, top, bottom)):
+        if delta == 0.0:
+            if not low <= position <= high:
+                return False
+            continue
+
+        low_time = (low - position) / delta
+        high_time = (high - position) / delta
+        if low_time > high_time:
+            low_time, high_time = high_time, low_time
+        enter = max(enter, low_time)
+        leave = min(leave, high_time)
+        if enter > leave:
+            return False
+
+    return True
+
+
+def is_solid(tile_type):
+    """Returns whether a block tile is something that balls bounce off of."""
+    return tile_type in BLOCK_SIDES
+
+
+def is_ground(tile_type):
+    if tile_type == BLOCKS_WALL:
+        return True
+    if tile_type == BLOCKS_TOPLEFT:
+        return True
+    if tile_type == BLOCKS_TOPRIGHT:
+        return True
+    return False
+
+
+class Layer:
+    def __init__(self):
+        # one byte per tile, column by column like in levels.txt, at the
+        # TILE_INDEXES of their positions
+        self.tiles = bytearray([EMPTY]) * (WIDTH * HEIGHT)
+
+    @property
+    def grid(self):
+        """The tiles as a list of columns, which are lists of tiles.  It's
+        a copy, so change tiles with change_tile()."""
+        tiles = self.tiles
+        return [list(tiles[start:start + HEIGHT])
+                for start in range(0, WIDTH * HEIGHT, HEIGHT)]
+
+    @grid.setter
+    def grid(self, grid):
+        self.tiles = bytearray([tile for column in grid for tile in column])
+
+    def tile_at(self, tile_position):
+        """Returns the tile at tile_position, which is a (column, row) pair."""
+        index = TILE_INDEXES.get(tile_position)
+        if index is None:
+            return None
+        return self.tiles[index]
+
+    def to_string(self):
+        """Converts the layer into a string.  For writing to files."""
+        tile_strings = [str(tile) for tile in self.tiles]
+        column_strings = []
+        for start in range(0, WIDTH * HEIGHT, HEIGHT):
+            column_strings.append(
+                TILE_SEPARATOR.join(tile_strings[start:start + HEIGHT]))
+
+        return COLUMN_SEPARATOR.join(column_strings)
+
+    def change_tile(self, tile_id, tile_position):
+        """Changes the tile at tile_position to tile_id.
+
+        tile_position is a (column, row) pair.
+        """
+        self.tiles[TILE_INDEXES[tile_position]] = tile_id
+
+
+class Level:
+    """Everything about a level that the physics needs to know: the tiles,
+    the start and end, the shells, and which buttons have been pressed.
+
+    levels.Level adds drawing on top of this.
+    """
+    def __init__(self):
+        self.layers = [self.new_layer() for _ in range(LAYER_COUNT)]
+        # made by build_mesh(), or by tile_to_segments() if it's needed
+        # first, since a new level's tiles are usually about to be replaced
+        self.mesh = None
+        self.field = None  # made by distance_field() when it's first needed
+        self.start_tile = (WIDTH // 2, HEIGHT // 2)
+        self.end_tile = (WIDTH // 2 + 5, HEIGHT // 2)
+        self.start_shells = [0]  # the shells that the ball starts with
+        self.total_buttons = 0
+        self.pressed_buttons = 0
+        # bit TILE_INDEXES[tile] is set for every pressed button
+        self.pressed_bits = 0
+        # whether the layers and mesh might be shared with a view()
+        self.shared = False
+
+    def new_layer(self):
+        """Returns an empty layer.  Subclasses that need a different kind of
+        Layer can override this."""
+        return Layer()
+
+    def view(self):
+        """Returns a copy of the level with no buttons pressed, which
+        shares the level's layers and mesh until either of them changes a
+        tile.  Making one is much quicker than loading the level again."""
+        new_level = self.__class__.__new__(self.__class__)
+        new_level.__dict__.update(self.__dict__)
+        new_level.start_shells = list(self.start_shells)
+        new_level.pressed_buttons = 0
+        new_level.pressed_bits = 0
+        self.shared = True
+        new_level.shared = True
+        return new_level
+
+    def unshare(self):
+        """Gives the level its own copy of its layers and mesh, if a view()
+        might be sharing them.  Called before anything changes them."""
+        if not self.shared:
+            return
+        layers = []
+        for layer in self.layers:
+            new_layer = self.new_layer()
+            new_layer.tiles = bytearray(layer.tiles)
+            layers.append(new_layer)
+        if self.mesh is not None:
+            self.mesh = self.mesh.copy(layers[LAYER_BLOCKS])
+        self.layers = layers
+        self.shared = False
+
+    def to_string(self):
+        """Converts the level into a string, for writing to files."""
+        shell_string = " ".join([str(shell) for shell in self.start_shells])
+        start_string = str(self.start_tile[0]) + " " + str(self.start_tile[1])
+        end_string = str(self.end_tile[0]) + " " + str(self.end_tile[1])
+        layer_strings = [layer.to_string() for layer in self.layers]
+
+        final_string = shell_string + LAYER_SEPARATOR
+        final_string += start_string + " " + end_string + LAYER_SEPARATOR
+        final_string += LAYER_SEPARATOR.join(layer_strings)
+        return final_string
+
+    def tile_at(self, tile_position):
+        """Returns the tile type that is occupying a given position.
+
+        tile_position is a (layer, column, row) triplet.
+        """
+        layer = self.layers[tile_position[0]]
+        return layer.tile_at((tile_position[1], tile_position[2]))
+
+    def change_tile(self, tile_id, tile_position):
+        """Changes the tile at a certain position.
+
+        tile_position is a (layer, column, row) triplet.
+        """
+        self.unshare()
+        layer = self.layers[tile_position[0]]
+        position = (tile_position[1], tile_position[2])
+        was_button = tile_position[0] == LAYER_BUTTONS and \
+            self.is_button(position)
+        layer.change_tile(tile_id, position)
+
+        if tile_position[0] == LAYER_BUTTONS:
+            # keeps the counts the same as reading the level again would
+            if was_button:
+                if self.is_pressed(position):
+                    self.pressed_bits &= ~(1 << TILE_INDEXES[position])
+                    self.pressed_buttons -= 1
+                self.total_buttons -= 1
+            if tile_id != EMPTY:
+                self.total_buttons += 1
+
+        if tile_position[0] == LAYER_BLOCKS:
+            if self.mesh is not None:
+                self.mesh.update_tile(position)
+            self.field = None
+
+    def build_mesh(self, results=None):
+        """Rebuilds the collision mesh from the blocks, or loads it from the
+        ResultCache results if this level's mesh was saved there before."""
+        if results is None:
+            results = cache.shared
+
+        self.unshare()
+        key = cache.level_key(self)
+        walls = results.get(cache.MESH, key)
+        self.mesh = mesh.CollisionMesh(self.layers[LAYER_BLOCKS], walls)
+        if walls is None:
+            walls = (self.mesh.line_segments, self.mesh.tile_segments)
+            results.put(cache.MESH, key, walls)
+
+    def distance_field(self):
+        """Returns the level's field.DistanceField, which needs numpy."""
+        if self.field is None:
+            from simulation import field
+            self.field = field.load_field(self)
+        return self.field
+
+    def tile_to_segments(self, tile_position):
+        """Returns a tuple of vector.Walls representing a tile at the
+        specified tile_position.  This will always only check LAYER_BLOCKS.
+
+        The Walls come from the level's CollisionMesh, so sides that
+        can't be touched are left out, and sides that line up with their
+        neighbours are merged.  They're shared between calls, so don't
+        change them.
+
+        tile_position is a (column, row pair).
+        """
+        if self.mesh is None:
+            self.build_mesh()
+        return self.mesh.segments_at(tile_position)
+
+    def is_solid(self, tile_position):
+        """Returns whether the block at tile_position can be bounced off."""
+        return is_solid(self.layers[LAYER_BLOCKS].tile_at(tile_position))
+
+    def is_button(self, tile_position):
+        """Returns whether a tile contains a button or not."""
+        tile = self.layers[LAYER_BUTTONS].tile_at(tile_position)
+        if tile == EMPTY:
+            return False
+        return True
+
+    def unpress(self, tile_position):
+        """Unpresses the button at the given position."""
+        tile = self.layers[LAYER_BUTTONS].tile_at(tile_position)
+        if tile == EMPTY:
+            raise Exception("There is no button on tile " + str(tile_position))
+
+        bit = 1 << TILE_INDEXES[tile_position]
+        if self.pressed_bits & bit:
+            self.pressed_bits &= ~bit
+            self.pressed_buttons -= 1
+
+    def press(self, tile_position):
+        """Presses the button at a given position."""
+        tile = self.layers[LAYER_BUTTONS].tile_at(tile_position)
+        if tile == EMPTY:
+            raise Exception("There is no button on tile " + str(tile_position))
+
+        bit = 1 << TILE_INDEXES[tile_position]
+        if not self.pressed_bits & bit:
+            self.pressed_bits |= bit
+            self.pressed_buttons += 1
+
+    def is_pressed(self, tile_position):
+        """Returns whether a tile is pressed or not.
+
+        If no button exists on the tile, this returns False.
+        """
+        return self.pressed_bits >> TILE_INDEXES[tile_position] & 1 == 1
+
+    @property
+    def pressed_grid(self):
+        """Whether each tile is pressed, as a list of columns, which are
+        lists of bools.  It's a copy, so press buttons with press()."""
+        bits = self.pressed_bits
+        return [[bits >> (column * HEIGHT + row) & 1 == 1
+                 for row in range(HEIGHT)] for column in range(WIDTH)]
+
+    @pressed_grid.setter
+    def pressed_grid(self, grid):
+        bits = 0
+        for column in range(WIDTH):
+            for row in range(HEIGHT):
+                if grid[column][row]:
+                    bits |= 1 << (column * HEIGHT + row)
+        self.pressed_bits = bits
+        self.pressed_buttons = bin(bits).count("1")
+
+    def snapshot_buttons(self):
+        """Returns which buttons are pressed, for restore_buttons() to put
+        back later."""
+        return self.pressed_bits, self.pressed_buttons
+
+    def restore_buttons(self, state):
+        """Presses exactly the buttons that were pressed when
+        snapshot_buttons() was called."""
+        self.pressed_bits, self.pressed_buttons = state